@@ -0,0 +1,180 @@
+import time
+import threading
+from logs import get_logger
+
+log = get_logger("anti_entropia")
+
+INTERVALO = 300        # Segundos entre rodadas (cada rodada passa por todas as tabelas)
+RAMOS = 16             # Baldes por nível da árvore de hashes
+LINHAS_FOLHA = 1000    # Faixas com até tantas linhas são comparadas linha a linha e reparadas
+LINHAS_POR_S = 20000   # Linhas resumidas por segundo no banco (custo de fundo limitado)
+MAX_EM_VOO = 8         # Com mais requisições de clientes que isso em andamento, espera
+TIMEOUT = 30
+TENTATIVAS_REPARO = 3  # O log andou entre ler e aplicar a faixa: lê de novo
+
+
+class AntiEntropia:
+    """
+    Serviço de fundo da réplica: compara cada tabela com o coordenador por uma árvore de
+    hashes sobre faixas da PK (RAMOS baldes por nível) e desce só nos baldes que diferem.
+    Faixas pequenas o bastante são lidas do coordenador num snapshot com o seq do log e
+    substituídas aqui quando o log local está no mesmo seq: o tráfego de reparo cresce com
+    a divergência, não com o tamanho do banco. Tabelas sem PK inteira são um balde só.
+    """
+    def __init__(self, no, intervalo=INTERVALO, ramos=RAMOS, linhas_folha=LINHAS_FOLHA, linhas_por_s=LINHAS_POR_S):
+        self.no = no
+        self.intervalo = intervalo
+        self.ramos = ramos
+        self.linhas_folha = linhas_folha
+        self.linhas_por_s = linhas_por_s
+        self.lock = threading.Lock()
+        self.lock_rodada = threading.Lock()  # Rodada periódica e verificações pedidas não se sobrepõem
+        # Métricas
+        self.rodadas = 0
+        self.tabelas = 0
+        self.baldes_comparados = 0
+        self.linhas_resumidas = 0
+        self.faixas_reparadas = 0
+        self.linhas_copiadas = 0
+        self.ultima_rodada = None
+
+    def iniciar(self):
+        threading.Thread(target=self._loop, daemon=True, name=f"no{self.no.id}-anti-entropia").start()
+
+    def _loop(self):
+        log.info("[AE] Ativo (a cada %ss, %d linhas/s).", self.intervalo, self.linhas_por_s)
+        while self.no.running:
+            time.sleep(self.intervalo)
+            if self.no.id == self.no.coordenador_id or self.no.sincronizando.is_set(): continue
+            try:
+                self.rodada(self.no.coordenador_id)
+            except Exception as e:
+                log.warning("[AE] Rodada abortada: %s", e)
+
+    def verificar(self, coord, tabelas=None):
+        """Rodada fora de hora, só nas tabelas {(banco, tabela)} dadas (None = todas)."""
+        def rodar():
+            try:
+                self.rodada(coord, tabelas)
+            except Exception as e:
+                log.warning("[AE] Verificação abortada: %s", e)
+        threading.Thread(target=rodar, daemon=True, name=f"no{self.no.id}-verificacao").start()
+
+    def _pausar(self, linhas):
+        """Limita o ritmo pelo volume lido e cede a vez quando o nó está ocupado com clientes."""
+        if linhas: time.sleep(linhas / self.linhas_por_s)
+        while self.no.em_voo > MAX_EM_VOO and self.no.running:
+            time.sleep(0.1)
+
+    def _pedir(self, coord, tipo, payload, resposta):
+        resp = self.no.enviar_mensagem(coord, tipo, payload, esperar_resposta=True, timeout=TIMEOUT)
+        if not resp or resp["tipo"] != resposta:
+            raise ConnectionError(f"Coordenador {coord} respondeu {resp and resp['tipo']} a {tipo}")
+        return resp["payload"]
+
+    def rodada(self, coord, tabelas=None):
+        """Compara as tabelas (todas, ou só as de 'tabelas') com o coordenador; retorna quantas faixas foram reparadas."""
+        with self.lock_rodada:
+            return self._rodada(coord, tabelas)
+
+    def _rodada(self, coord, tabelas):
+        inicio = time.perf_counter()
+        remotas = self._pedir(coord, "AE_TABELAS_REQ", {}, "AE_TABELAS")["tabelas"]
+        locais = self.no.db.tabelas_verificaveis()
+        if tabelas is not None:
+            def escolhidas(t): return {n: v for n, v in t.items() if (v[0].lower(), v[1].lower()) in tabelas}
+            remotas, locais = escolhidas(remotas), escolhidas(locais)
+        for nome in sorted(set(locais) - set(remotas)):
+            log.warning("[AE] %s só existe neste nó; deixada como está.", nome)
+
+        reparadas = 0
+        for nome, (db_name, table, pk, colunas, menor, maior) in sorted(remotas.items()):
+            local = locais.get(nome)
+            if local is None or local[2] != pk or local[3] != colunas:
+                log.warning("[AE] %s: tabela ausente ou com esquema diferente aqui; só um sync completo resolve.", nome)
+                continue
+            if pk is None:
+                reparadas += self._comparar(coord, db_name, table, None, colunas, None, None)
+            else:
+                menores = [v for v in (menor, local[4]) if v is not None]
+                if not menores: continue  # Vazia dos dois lados
+                de, ate = min(menores), max(v for v in (maior, local[5]) if v is not None) + 1
+                reparadas += self._comparar(coord, db_name, table, pk, colunas, de, ate)
+            with self.lock: self.tabelas += 1
+
+        segundos = time.perf_counter() - inicio
+        with self.lock:
+            self.rodadas += 1
+            self.ultima_rodada = {"ts": time.time(), "segundos": round(segundos, 3), "tabelas": len(remotas),
+                                  "faixas_reparadas": reparadas}
+        log.info("[AE] Rodada concluída: %d tabelas, %d faixas reparadas em %.2fs", len(remotas), reparadas, segundos)
+        return reparadas
+
+    def _comparar(self, coord, db_name, table, pk, colunas, de, ate):
+        """Desce na árvore só pelos baldes cujo (linhas, hash) difere do coordenador."""
+        largura = max(1, -(-(ate - de) // self.ramos)) if pk else None
+        pedido = {"database": db_name, "table": table, "pk": pk, "colunas": colunas, "de": de, "ate": ate, "largura": largura}
+        remoto = {b: (n, h) for b, n, h in self._pedir(coord, "AE_HASH_REQ", pedido, "AE_HASH")["baldes"]}
+        local = {b: (n, h) for b, n, h in self.no.db.hash_faixas(db_name, table, pk, colunas, de, ate, largura)}
+        lidas = sum(n for n, _ in local.values())
+        with self.lock:
+            self.baldes_comparados += len(set(remoto) | set(local))
+            self.linhas_resumidas += lidas
+        self._pausar(lidas)
+
+        if pk is None:
+            return self._reparar(coord, db_name, table, None, None, None) if remoto != local else 0
+        reparadas = 0
+        for b in sorted(set(remoto) | set(local)):
+            if remoto.get(b) == local.get(b): continue
+            sub_de = de + b * largura
+            sub_ate = min(ate, sub_de + largura)
+            linhas = max(remoto.get(b, (0, 0))[0], local.get(b, (0, 0))[0])
+            if linhas <= self.linhas_folha or largura == 1:
+                reparadas += self._reparar(coord, db_name, table, pk, sub_de, sub_ate)
+            else:
+                reparadas += self._comparar(coord, db_name, table, pk, colunas, sub_de, sub_ate)
+        return reparadas
+
+    def _reparar(self, coord, db_name, table, pk, de, ate):
+        """
+        Lê a faixa do coordenador (com o seq do snapshot) e a aplica aqui quando o log local
+        está no mesmo seq. Diferença que era só atraso de replicação não é tocada.
+        """
+        pedido = {"database": db_name, "table": table, "pk": pk, "de": de, "ate": ate}
+        for _ in range(TENTATIVAS_REPARO):
+            remoto = self._pedir(coord, "AE_LINHAS_REQ", pedido, "AE_LINHAS")
+            prazo = time.monotonic() + TIMEOUT
+            while self.no.wal.ultimo_seq < remoto["seq"] and time.monotonic() < prazo:
+                time.sleep(0.05)  # A replicação ainda vai trazer o que o snapshot já tem
+            with self.no.lock_aplicacao:
+                if self.no.wal.ultimo_seq != remoto["seq"]: continue
+                _, linhas = self.no.db.ler_faixa(db_name, table, pk, de, ate)
+                if self._mesmas_linhas(linhas, remoto["linhas"], pk): return 0
+                n = self.no.db.substituir_faixa(db_name, table, pk, de, ate, remoto["colunas"], remoto["linhas"])
+                if self.no.cache: self.no.cache.invalidar({(db_name.lower(), table.lower())})
+            log.warning("[AE] %s.%s faixa [%s, %s): %d linhas locais trocadas por %d do coordenador",
+                        db_name, table, de, ate, len(linhas), n)
+            with self.lock:
+                self.faixas_reparadas += 1
+                self.linhas_copiadas += n
+            return 1
+        log.info("[AE] %s.%s faixa [%s, %s): log em movimento, fica para a próxima rodada", db_name, table, de, ate)
+        return 0
+
+    @staticmethod
+    def _mesmas_linhas(locais, remotas, pk):
+        if pk: return locais == remotas  # As duas em ordem de PK
+        return sorted(map(repr, locais)) == sorted(map(repr, remotas))
+
+    def metricas(self):
+        with self.lock:
+            return {
+                "rodadas": self.rodadas,
+                "tabelas": self.tabelas,
+                "baldes_comparados": self.baldes_comparados,
+                "linhas_resumidas": self.linhas_resumidas,
+                "faixas_reparadas": self.faixas_reparadas,
+                "linhas_copiadas": self.linhas_copiadas,
+                "ultima_rodada": self.ultima_rodada,
+            }
@@ -0,0 +1,140 @@
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from classificador_sql import classificar, com_banco
+
+
+def normalizar_sql(sql):
+    """Espaços colapsados fora de literais e sem ';' final: variações de formatação viram a mesma chave."""
+    partes = re.split(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")", sql.strip().rstrip(";").strip())
+    return "".join(p if i % 2 else " ".join(p.split()) for i, p in enumerate(partes))
+
+
+def tabelas_leitura(sql, database):
+    """Tabelas (banco, tabela) lidas por um comando (CTEs fora); vazio se não lê nenhuma."""
+    return com_banco(classificar(sql).tabelas_lidas, database)
+
+
+def tabelas_escrita(sql, database):
+    """Tabelas alteradas por uma escrita; None = não identificado (invalida tudo)."""
+    escritas = classificar(sql).tabelas_escritas
+    return None if escritas is None else com_banco(escritas, database)
+
+
+def _copiar(valor):
+    """Cópia das listas e dicts de um resultado (os valores das colunas são imutáveis)."""
+    if isinstance(valor, dict): return {k: _copiar(v) for k, v in valor.items()}
+    if isinstance(valor, list): return [_copiar(v) for v in valor]
+    return valor
+
+
+class CacheResultados:
+    """
+    Cache LRU de resultados de SELECT por (banco, SQL normalizado, parâmetros), com TTL
+    e limite de entradas e de bytes. Escritas aplicadas no nó (locais ou replicadas)
+    invalidam por tabela. Cada tabela tem uma versão: um resultado lido enquanto uma
+    escrita na mesma tabela acontecia não é guardado. Guarda e devolve cópias: quem
+    alterar o resultado recebido não altera a entrada.
+    """
+    def __init__(self, max_entradas=1000, max_bytes=64 * 1024 * 1024, ttl=5.0):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entradas = OrderedDict()  # chave -> (resultado, tabelas, bytes, expira_em)
+        self.por_tabela = {}           # (banco, tabela) -> {chaves}
+        self.versoes = {}              # (banco, tabela) -> nº de invalidações
+        self.versao_global = 0
+        self.bytes = 0
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.despejos = 0
+        self.expiradas = 0
+        self.invalidacoes = 0
+
+    @staticmethod
+    def chave(sql, database, params=None):
+        return (database or "", normalizar_sql(sql), json.dumps(params) if params is not None else None)
+
+    @staticmethod
+    def cacheavel(sql):
+        # Leitura pura e com resultado que só depende das tabelas (sem NOW(), RAND(), @variáveis, FOR UPDATE...)
+        classe = classificar(sql)
+        return classe.tipo == "SELECT" and classe.leitura and classe.deterministico
+
+    def buscar(self, chave):
+        with self.lock:
+            item = self.entradas.get(chave)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[3] < time.monotonic():
+                self._remover(chave)
+                self.expiradas += 1
+                self.misses += 1
+                return None
+            self.entradas.move_to_end(chave)
+            self.hits += 1
+            resultado = item[0]
+        return _copiar(resultado)
+
+    def versao(self, tabelas):
+        """Tirada antes de ir ao banco; guardar() compara com a de depois."""
+        with self.lock:
+            return self.versao_global, tuple(self.versoes.get(t, 0) for t in tabelas)
+
+    def guardar(self, chave, resultado, tabelas, versao):
+        tamanho = len(json.dumps(resultado, default=str))
+        if tamanho > self.max_bytes // 4: return  # Um resultado não expulsa o cache inteiro
+        copia = _copiar(resultado)
+        with self.lock:
+            if (self.versao_global, tuple(self.versoes.get(t, 0) for t in tabelas)) != versao: return
+            if chave in self.entradas: self._remover(chave)
+            self.entradas[chave] = (copia, tabelas, tamanho, time.monotonic() + self.ttl)
+            self.bytes += tamanho
+            for t in tabelas: self.por_tabela.setdefault(t, set()).add(chave)
+            while self.entradas and (len(self.entradas) > self.max_entradas or self.bytes > self.max_bytes):
+                self._remover(next(iter(self.entradas)))
+                self.despejos += 1
+
+    def _remover(self, chave):
+        _, tabelas, tamanho, _ = self.entradas.pop(chave)
+        self.bytes -= tamanho
+        for t in tabelas:
+            chaves = self.por_tabela.get(t)
+            if chaves:
+                chaves.discard(chave)
+                if not chaves: del self.por_tabela[t]
+
+    def invalidar(self, tabelas):
+        """Tabelas alteradas por uma escrita; None invalida tudo (DDL de banco, escrita não identificada)."""
+        with self.lock:
+            if tabelas is None:
+                self.versao_global += 1
+                self.invalidacoes += len(self.entradas)
+                self.entradas.clear()
+                self.por_tabela.clear()
+                self.bytes = 0
+                return
+            for t in tabelas:
+                self.versoes[t] = self.versoes.get(t, 0) + 1
+                for chave in list(self.por_tabela.get(t, ())):
+                    self._remover(chave)
+                    self.invalidacoes += 1
+
+    def metricas(self):
+        with self.lock:
+            consultas = self.hits + self.misses
+            return {
+                "entradas": len(self.entradas),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_hit": round(self.hits / consultas, 4) if consultas else 0.0,
+                "despejos": self.despejos,
+                "expiradas": self.expiradas,
+                "invalidacoes": self.invalidacoes,
+            }
@@ -0,0 +1,285 @@
+import re
+from decimal import Decimal
+from functools import lru_cache
+from collections import namedtuple
+
+TAMANHO_CACHE = 4096  # Textos de comando distintos guardados já analisados
+
+Token = namedtuple("Token", "tipo texto inicio fim nivel")
+
+_TOKEN = re.compile(r"""
+    (?P<comentario>--(?:[ \t][^\n]*)?(?=\n|$)|\#[^\n]*|/\*(?!!).*?\*/)
+  | (?P<espaco>\s+|/\*!\d*|\*/)
+  | (?P<texto>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<nome>`[^`]+`)
+  | (?P<numero>\d+(?:\.\d+)?)
+  | (?P<marcador>%s|\?)
+  | (?P<variavel>@@?[A-Za-z0-9_.$]*)
+  | (?P<palavra>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<simbolo><=|>=|<>|!=|[(),.;=<>*+\-/%])
+  | (?P<outro>.)
+""", re.X | re.S)
+
+LEITURAS = {"SELECT", "SHOW", "DESCRIBE", "DESC", "EXPLAIN"}
+DML = {"INSERT", "REPLACE", "UPDATE", "DELETE"}
+DDL = {"CREATE", "ALTER", "DROP", "TRUNCATE", "RENAME"}  # COMMIT implícito no MySQL
+# Controle de transação/sessão: mexem na conexão, que volta ao pool (autocommit) para outros pedidos
+CONTROLE_SESSAO = {"BEGIN", "START", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "XA", "LOCK", "UNLOCK"}
+# Resultado ou efeito depende de algo além dos dados: relógio, sorteio, sessão
+NAO_DETERMINISTICAS = {
+    "NOW", "SYSDATE", "CURDATE", "CURTIME", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "CURRENT_USER",
+    "LOCALTIME", "LOCALTIMESTAMP", "UNIX_TIMESTAMP", "UTC_DATE", "UTC_TIME", "UTC_TIMESTAMP", "RAND", "UUID",
+    "UUID_SHORT", "LAST_INSERT_ID", "FOUND_ROWS", "ROW_COUNT", "CONNECTION_ID", "DATABASE", "SCHEMA", "USER",
+    "SESSION_USER", "SYSTEM_USER", "SLEEP", "GET_LOCK", "RELEASE_LOCK", "IS_FREE_LOCK",
+}
+# Estas valem sem parênteses também
+SEM_PARENTESES = {"CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "CURRENT_USER", "LOCALTIME", "LOCALTIMESTAMP",
+                  "UTC_DATE", "UTC_TIME", "UTC_TIMESTAMP"}
+FIM_TABELAS = {"WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "CROSS", "GROUP", "ORDER", "LIMIT", "HAVING", "UNION", "FOR",
+               "SET", "ON", "USING", "NATURAL", "STRAIGHT_JOIN", "VALUES", "VALUE", "SELECT", "PARTITION", "WINDOW",
+               "LOCK", "INTO", "FROM", "TO", "LIKE", "AS"}
+
+Classificacao = namedtuple("Classificacao", [
+    "tipo",               # Comando principal (WITH ... resolvido para o SELECT/UPDATE/... de fora); "" se vazio
+    "objeto",             # DDL: TABLE, DATABASE, INDEX...; None nos outros
+    "leitura",            # Pode rodar em qualquer réplica (leitura pura, sem trava nem efeito)
+    "escrita",            # Muda dados ou esquema: vai ao Master e é replicada
+    "trava",              # SELECT ... FOR UPDATE / FOR SHARE / LOCK IN SHARE MODE
+    "deterministico",     # Mesmo resultado em qualquer nó com os mesmos dados
+    "multiplos",          # Mais de um comando no texto
+    "tabelas_lidas",      # frozenset((banco ou None, tabela))
+    "tabelas_escritas",   # frozenset, ou None se não deu para identificar
+    "toks",               # Tokens (sem espaços e comentários), para quem precisa olhar mais fundo
+])
+
+
+def tokens(sql):
+    resultado, nivel = [], 0
+    for m in _TOKEN.finditer(sql):
+        tipo = m.lastgroup
+        if tipo in ("espaco", "comentario"): continue
+        texto = m.group()
+        if texto == ")": nivel -= 1
+        resultado.append(Token(tipo, texto, m.start(), m.end(), nivel))
+        if texto == "(": nivel += 1
+    return resultado
+
+
+def nome(token):
+    return token.texto.strip("`").lower()
+
+
+def palavra(token, *palavras):
+    return token.tipo == "palavra" and token.texto.upper() in palavras
+
+
+def ler_tabelas(toks, j, lista=True):
+    """
+    Nomes de tabela a partir de toks[j] ("banco.tabela [AS] apelido, ..."): ([(banco ou None, tabela)], índice seguinte).
+    Com lista=False lê só o primeiro.
+    """
+    achadas = []
+    nivel = toks[j].nivel if j < len(toks) else 0
+    while j < len(toks) and toks[j].tipo in ("palavra", "nome") and not palavra(toks[j], *FIM_TABELAS):
+        if j + 2 < len(toks) and toks[j + 1].texto == "." and toks[j + 2].tipo in ("palavra", "nome"):
+            achadas.append((nome(toks[j]), nome(toks[j + 2])))
+            j += 3
+        else:
+            achadas.append((None, nome(toks[j])))
+            j += 1
+        if not lista: break
+        while j < len(toks) and toks[j].nivel >= nivel and toks[j].texto != "," and not (
+                toks[j].nivel == nivel and palavra(toks[j], *FIM_TABELAS - {"AS"})):
+            j += 1
+        if j < len(toks) and toks[j].texto == "," and toks[j].nivel == nivel: j += 1
+        else: break
+    return achadas, j
+
+
+def valor_literal(toks, i):
+    """(valor, índice do parâmetro) do literal em toks[i]; ('?', None) se não é um literal."""
+    t = toks[i]
+    negativo = t.texto == "-" and i + 1 < len(toks) and toks[i + 1].tipo == "numero"
+    if negativo: t = toks[i + 1]
+    if t.tipo == "marcador":
+        return None, sum(1 for x in toks[:i] if x.tipo == "marcador")
+    if t.tipo == "numero":
+        v = Decimal(t.texto) if "." in t.texto else int(t.texto)
+        return (-v if negativo else v), None
+    if t.tipo == "texto":
+        corpo = t.texto[1:-1]
+        return re.sub(r"\\(.)", r"\1", corpo.replace(t.texto[0] * 2, t.texto[0])), None
+    return "?", None
+
+
+def insert_valores(toks):
+    """
+    INSERT/REPLACE ... [(colunas)] VALUES (...), (...): (colunas, [(início, fim) de cada tupla]),
+    colunas vazia = todas, na ordem da tabela. None para INSERT ... SELECT / INSERT ... SET.
+    """
+    valores = next((i for i, t in enumerate(toks) if t.nivel == 0 and palavra(t, "VALUES", "VALUE")), None)
+    if valores is None: return None
+    abre = next((i for i in range(valores) if toks[i].texto == "(" and toks[i].nivel == 0), None)
+    colunas = [] if abre is None else [nome(t) for t in toks[abre + 1:valores] if t.nivel == 1 and t.tipo in ("palavra", "nome")]
+    tuplas, i = [], valores + 1
+    while i < len(toks) and toks[i].texto == "(" and toks[i].nivel == 0:
+        fecha = next(j for j in range(i + 1, len(toks)) if toks[j].texto == ")" and toks[j].nivel == 0)
+        tuplas.append((i, fecha))
+        i = fecha + 1
+        if i < len(toks) and toks[i].texto == ",": i += 1
+        else: break
+    return colunas, tuplas
+
+
+def indice_campo(toks, tupla, posicao):
+    """Índice do token onde começa o campo 'posicao' de uma tupla de insert_valores."""
+    inicio, fim = tupla
+    campo, i = 0, inicio + 1
+    while i < fim and campo < posicao:
+        if toks[i].texto == "," and toks[i].nivel == 1: campo += 1
+        i += 1
+    return i
+
+
+def valor_na_tupla(toks, tupla, posicao):
+    return valor_literal(toks, indice_campo(toks, tupla, posicao))
+
+
+def _from_de_consulta(toks, i):
+    """FROM de um SELECT/DELETE do mesmo nível (não o de EXTRACT(x FROM y), TRIM(... FROM ...))."""
+    nivel = toks[i].nivel
+    for k in range(i - 1, -1, -1):
+        if toks[k].nivel < nivel: return False
+        if toks[k].nivel == nivel and palavra(toks[k], "SELECT", "DELETE"): return True
+    return False
+
+
+def _ctes(toks):
+    """(nomes das CTEs, índice do comando principal) de WITH [RECURSIVE] a AS (...), b AS (...) <comando>."""
+    nomes, i = set(), 1
+    if i < len(toks) and palavra(toks[i], "RECURSIVE"): i += 1
+    while i < len(toks):
+        if toks[i].tipo in ("palavra", "nome"): nomes.add(nome(toks[i]))
+        # Pula (colunas) e AS (consulta) até a vírgula ou o comando do nível de fora
+        i += 1
+        while i < len(toks) and not (toks[i].nivel == 0 and (toks[i].texto == "," or palavra(toks[i], *LEITURAS | DML))):
+            i += 1
+        if i < len(toks) and toks[i].texto == ",":
+            i += 1
+            continue
+        return nomes, i
+    return nomes, len(toks)
+
+
+def _lidas(toks, ctes):
+    lidas = set()
+    for i, t in enumerate(toks):
+        if palavra(t, "JOIN") or (palavra(t, "FROM") and _from_de_consulta(toks, i)):
+            achadas, _ = ler_tabelas(toks, i + 1)
+            lidas.update(a for a in achadas if not (a[0] is None and a[1] in ctes))
+    return lidas
+
+
+def _escritas(toks, inicio, tipo, objeto):
+    """Tabelas que o comando altera; None se não deu para identificar."""
+    j = inicio + 1
+    while j < len(toks) and palavra(toks[j], "LOW_PRIORITY", "DELAYED", "HIGH_PRIORITY", "IGNORE", "QUICK",
+                                     "TEMPORARY", "IF", "NOT", "EXISTS", "TABLE", "ONLINE", "OFFLINE"):
+        j += 1
+    if tipo in ("INSERT", "REPLACE"):
+        if j < len(toks) and palavra(toks[j], "INTO"): j += 1
+        achadas, _ = ler_tabelas(toks, j, lista=False)
+    elif tipo == "UPDATE":
+        # Todas as tabelas antes do SET (UPDATE a JOIN b SET ...): qualquer uma pode ser alterada
+        fim = next((k for k in range(j, len(toks)) if toks[k].nivel == 0 and palavra(toks[k], "SET")), len(toks))
+        achadas, _ = ler_tabelas(toks, j)
+        achadas += _lidas(toks[j:fim], set())
+    elif tipo == "DELETE":
+        fim = next((k for k in range(j, len(toks)) if toks[k].nivel == 0 and palavra(toks[k], "WHERE", "ORDER", "LIMIT")),
+                   len(toks))
+        achadas, _ = ler_tabelas(toks, j)  # DELETE t1, t2 FROM ...
+        for k in range(j, fim):
+            if toks[k].nivel == 0 and palavra(toks[k], "FROM", "USING", "JOIN"): achadas += ler_tabelas(toks, k + 1)[0]
+    elif tipo in ("ALTER", "DROP", "CREATE", "TRUNCATE") and objeto in ("TABLE", None):
+        achadas, _ = ler_tabelas(toks, j, lista=tipo == "DROP")
+    elif tipo == "RENAME" and objeto == "TABLE":
+        achadas = [(nome(toks[k - 2]), nome(t)) if k >= 2 and toks[k - 1].texto == "." else (None, nome(t))
+                   for k, t in enumerate(toks) if k > inicio + 1 and t.tipo in ("palavra", "nome")
+                   and not palavra(t, "TO") and not (k + 1 < len(toks) and toks[k + 1].texto == ".")]
+    elif tipo in ("CREATE", "DROP") and objeto == "INDEX":
+        k = next((k for k in range(j, len(toks)) if palavra(toks[k], "ON")), None)
+        if k is None: return None
+        achadas, _ = ler_tabelas(toks, k + 1, lista=False)
+    else:
+        return None
+    return set(achadas) or None
+
+
+def _deterministico(toks, tipo):
+    if tipo in DDL: return True  # DEFAULT CURRENT_TIMESTAMP de coluna não é efeito do comando
+    for i, t in enumerate(toks):
+        if t.tipo == "variavel": return False
+        if t.tipo != "palavra": continue
+        funcao = t.texto.upper()
+        if funcao in NAO_DETERMINISTICAS and (funcao in SEM_PARENTESES or (i + 1 < len(toks) and toks[i + 1].texto == "(")):
+            if i > 0 and toks[i - 1].texto == ".": continue  # tabela.user é coluna
+            return False
+    if tipo in DML:
+        # UPDATE/DELETE ... LIMIT e INSERT ... SELECT ... LIMIT sem ORDER BY escolhem linhas ao acaso
+        niveis_limite = {t.nivel for t in toks if palavra(t, "LIMIT")}
+        niveis_ordem = {t.nivel for t in toks if palavra(t, "ORDER")}
+        if niveis_limite - niveis_ordem: return False
+    return True
+
+
+@lru_cache(maxsize=TAMANHO_CACHE)
+def classificar(sql):
+    """Classificação do comando (guardada por texto: o mesmo comando não é analisado de novo)."""
+    toks = tokens(sql)
+    principal = next((i for i, t in enumerate(toks) if t.tipo == "palavra"), None)
+    if principal is None:
+        return Classificacao("", None, False, False, False, True, False, frozenset(), frozenset(), tuple(toks))
+    tipo = toks[principal].texto.upper()
+    ctes = set()
+    if tipo == "WITH":
+        ctes, principal = _ctes(toks)
+        tipo = toks[principal].texto.upper() if principal < len(toks) else ""
+    if tipo == "DESC": tipo = "DESCRIBE"
+    objeto = None
+    if tipo in DDL:
+        k = principal + 1
+        while k < len(toks) and palavra(toks[k], "TEMPORARY", "UNIQUE", "FULLTEXT", "SPATIAL", "OR", "REPLACE",
+                                         "ONLINE", "OFFLINE", "IGNORE", "DEFINER", "SQL", "SECURITY", "ALGORITHM"):
+            k += 1
+        if k < len(toks) and toks[k].tipo == "palavra": objeto = toks[k].texto.upper()
+
+    multiplos = any(t.texto == ";" and t.nivel == 0 for t in toks[:-1])
+    # Em qualquer nível: (SELECT ... FOR UPDATE), ramos de UNION e subconsultas também travam linhas
+    trava = tipo == "SELECT" and any(
+        palavra(t, "FOR") and i + 1 < len(toks) and palavra(toks[i + 1], "UPDATE", "SHARE")
+        or palavra(t, "LOCK") and i + 1 < len(toks) and palavra(toks[i + 1], "IN")
+        for i, t in enumerate(toks))
+    # SELECT ... INTO @var / OUTFILE (também em (SELECT a INTO @x ...)): tem efeito fora do resultado
+    com_efeito = tipo == "SELECT" and any(palavra(t, "INTO") for t in toks)
+    leitura = tipo in LEITURAS and not (trava or com_efeito or multiplos)
+    escrita = not leitura and not trava and not com_efeito and tipo not in LEITURAS
+    lidas = _lidas(toks, ctes)
+    escritas = _escritas(toks, principal, tipo, objeto) if tipo in DML | DDL else (frozenset() if not escrita else None)
+    return Classificacao(tipo, objeto, leitura, escrita, trava, _deterministico(toks, tipo), multiplos,
+                         frozenset(lidas), frozenset(escritas) if escritas is not None else None, tuple(toks))
+
+
+def controle_de_sessao(classe):
+    """BEGIN/COMMIT/LOCK TABLES/SET autocommit... avulsos: deixariam a conexão do pool numa transação aberta."""
+    if classe.tipo in CONTROLE_SESSAO: return True
+    return classe.tipo == "SET" and any(t.texto.upper().split(".")[-1] in ("AUTOCOMMIT", "@@AUTOCOMMIT", "TRANSACTION")
+                                        for t in classe.toks)
+
+
+def eh_leitura(sql):
+    return classificar(sql).leitura
+
+
+def com_banco(tabelas, database):
+    """{(banco, tabela)} em minúsculas, com o banco da sessão onde o comando não diz."""
+    return {((banco or database or "").lower(), tabela) for banco, tabela in tabelas}
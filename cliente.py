@@ -1,21 +1,14 @@
 import customtkinter as ctk
-import socket
-import json
-import hashlib
 import threading
-import random
 from datetime import datetime
+from cliente_ddb import Conexao, ErroDDB, NODES
 
 # Configuração Visual
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("blue")
 
-# Configuração de Rede
-NODES = [
-    {"ip": "localhost", "porta": 5001},
-    {"ip": "localhost", "porta": 5002},
-    {"ip": "localhost", "porta": 5003}
-]
+MAX_ATRASO_LEITURA = 2.0 # Segundos de atraso de replicação aceitos numa leitura
+LIMITE_LINHAS = 5000 # Linhas exibidas por consulta (o resto do stream é cancelado)
 
 class ClientApp(ctk.CTk):
     def __init__(self):
@@ -59,6 +52,7 @@ class ClientApp(ctk.CTk):
         self.log_box = ctk.CTkTextbox(self, font=("Consolas", 12), state="disabled")
         self.log_box.grid(row=3, column=0, padx=20, pady=(0, 20), sticky="nsew")
         
+        self.conexao = Conexao(NODES, max_atraso_s=MAX_ATRASO_LEITURA, binario=False)
         self.log_message("Sistema pronto. Conectado ao cluster.")
 
     def log_message(self, msg):
@@ -88,52 +82,25 @@ class ClientApp(ctk.CTk):
         else:
             return str(dados)
 
-    def criar_mensagem(self, tipo, payload):
-        payload_str = json.dumps(payload, sort_keys=True)
-        checksum = hashlib.md5(payload_str.encode("utf-8")).hexdigest()
-        return {
-            "tipo": tipo,
-            "origem": "CLIENT_GUI",
-            "payload": payload,
-            "checksum": checksum
-        }
-
     def enviar_rede(self, sql):
         def thread_task():
-            node = random.choice(NODES)
-            self.log_message(f"Enviando para Nó {node['porta']}...")
-            
+            self.log_message("Enviando ao cluster...")
+            cursor = self.conexao.cursor()
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(10) # Timeout maior para queries pesadas
-                sock.connect((node['ip'], node['porta']))
-                
-                msg = self.criar_mensagem("QUERY_REQ", {"sql": sql})
-                sock.sendall(json.dumps(msg).encode("utf-8"))
-                
-                resp_bytes = sock.recv(65536) # Buffer grande
-                sock.close()
-                
-                if resp_bytes:
-                    resp = json.loads(resp_bytes.decode("utf-8"))
-                    payload = resp.get("payload", {})
-                    
-                    if resp.get("tipo") == "QUERY_RESP":
-                        status = payload.get("status", "UNKNOWN")
-                        self.log_message(f"Status: {status}")
-                        
-                        if "dados" in payload:
-                            tabela_formatada = self.formatar_resultado(payload["dados"])
-                            self.log_message(f"\n{tabela_formatada}\n")
-                        elif "mensagem" in payload:
-                            self.log_message(f"Resposta: {payload['mensagem']}")
-                    else:
-                        self.log_message(f"Erro remoto: {payload}")
-                else:
-                    self.log_message("Sem resposta do servidor (Timeout ou erro).")
-
-            except Exception as e:
-                self.log_message(f"Erro na conexão: {e}")
+                cursor.execute(sql)
+                self.log_message("Status: OK")
+                if cursor.colunas:
+                    linhas = cursor.fetchmany(LIMITE_LINHAS)
+                    dados = [dict(zip(cursor.colunas, linha)) for linha in linhas]
+                    self.log_message(f"\n{self.formatar_resultado(dados)}\n")
+                    if cursor.fetchone() is not None:
+                        self.log_message(f"(exibindo as primeiras {LIMITE_LINHAS} linhas)")
+                elif cursor.mensagem:
+                    self.log_message(f"Resposta: {cursor.mensagem}")
+            except ErroDDB as e:
+                self.log_message(f"Erro: {e}")
+            finally:
+                cursor.close()
 
         threading.Thread(target=thread_task, daemon=True).start()
 
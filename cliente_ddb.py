@@ -0,0 +1,524 @@
+import sys
+import csv
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import deque, namedtuple
+from protocolo import ConexaoPeer, ConexaoPeerAsync
+from roteamento import Roteador, eh_leitura
+from comandos_preparados import id_comando
+from membros import carregar_config, enderecos
+
+# Configuração de Rede: os nós iniciais (DDB_NOS ou membros.json); os demais vêm da visão de membros
+NODES = enderecos(carregar_config())
+TIMEOUT_PADRAO = 60 # Segundos por resposta (ou por página, em leituras paginadas)
+TAMANHO_PAGINA = 1000 # Linhas por QUERY_PAGINA
+JANELA_PAGINAS = 4 # Páginas que o nó manda à frente do que o cursor já consumiu
+JANELA_LER_ESCRITAS = 5.0 # Depois de uma escrita, leituras vão ao coordenador por este tempo
+
+
+class ErroDDB(Exception):
+    pass
+
+
+# Comando preparado: o id é o hash do SQL, então qualquer nó resolve depois de um PREPARE
+Comando = namedtuple("Comando", "sql stmt_id")
+
+
+def criar_mensagem(tipo, payload, origem="CLIENTE"):
+    # Sem checksum na mensagem: o frame leva CRC32 (ou HMAC) dos bytes enviados
+    return {
+        "tipo": tipo,
+        "origem": origem,
+        "payload": payload
+    }
+
+
+def _texto(sql):
+    return sql.sql if isinstance(sql, Comando) else sql
+
+
+def _desconhecido(resp):
+    return bool(resp) and (resp.get("payload") or {}).get("codigo") == "COMANDO_DESCONHECIDO"
+
+
+def _checar(resp):
+    """Payload de uma resposta de sucesso; ErroDDB para ERRO / status ERRO."""
+    payload = resp.get("payload") or {}
+    if resp.get("tipo") == "ERRO" or payload.get("status") == "ERRO":
+        raise ErroDDB(payload.get("mensagem", "Erro desconhecido"))
+    return payload
+
+
+class _BaseConexao:
+    """Escolha de nó e montagem dos pedidos, comum às versões síncrona e asyncio."""
+    def __init__(self, nodes, max_atraso_s, consistencia, rotear, timeout):
+        self.nodes = list(nodes)
+        self.max_atraso_s = max_atraso_s
+        self.consistencia = consistencia
+        self.timeout = timeout
+        # Cada nó guarda streams por (origem, req_id): a origem precisa ser única por conexão
+        self.origem = f"CLIENTE-{uuid.uuid4().hex[:8]}"
+        self.lock_nodes = threading.Lock()
+        self.roteador = None
+        for node in self.nodes: self._nova_conexao(node)
+        # Mesmo com um nó só: é pela visão de membros que o roteador acha os outros
+        self.roteador = Roteador(self.nodes, self._mensagem, ao_descobrir=self._indice_redirecionado) if rotear else None
+        self.ultima_escrita = 0.0
+
+    def _mensagem(self, tipo, payload):
+        return criar_mensagem(tipo, payload, self.origem)
+
+    def preparar(self, sql):
+        """
+        Comando para executar muitas vezes com parâmetros (%s ou ?). Só o id e os valores
+        viajam; o nó que ainda não conhece o id recebe o SQL uma vez, no primeiro uso.
+        """
+        sql = sql.strip()
+        return Comando(sql, id_comando(sql))
+
+    def _preparar(self, sql, conjuntos=None, **opcoes):
+        """(índice do nó, payload do QUERY_REQ). 'conjuntos' = lista de conjuntos de parâmetros."""
+        leitura = eh_leitura(_texto(sql))
+        if isinstance(sql, Comando):
+            payload = {"stmt_id": sql.stmt_id, "parametros": conjuntos or [[]]}
+        elif conjuntos is not None:
+            payload = {"sql": sql, "parametros": conjuntos}
+        else:
+            payload = {"sql": sql}
+        if leitura:
+            ler_escritas = opcoes.pop("ler_proprias_escritas", None)
+            if ler_escritas is None:
+                ler_escritas = time.monotonic() - self.ultima_escrita < JANELA_LER_ESCRITAS
+            max_atraso_s = opcoes.pop("max_atraso_s", self.max_atraso_s)
+            payload.update(max_atraso_s=max_atraso_s, ler_proprias_escritas=ler_escritas)
+            indice = self.roteador.escolher(True, max_atraso_s, ler_escritas) if self.roteador else 0
+        else:
+            if self.consistencia: payload["consistencia"] = self.consistencia
+            indice = self.roteador.escolher(False) if self.roteador else 0
+        payload.update(opcoes)
+        return indice, payload
+
+    def _preparar_transacao(self, comandos, fim, **opcoes):
+        """(índice do coordenador, payload) de uma transação. Cada comando: SQL, Comando ou (sql, parametros)."""
+        itens = []
+        for comando in comandos:
+            sql, parametros = (comando, None) if isinstance(comando, (str, Comando)) else comando
+            item = {"sql": _texto(sql)}
+            if parametros is not None: item["parametros"] = [list(parametros)]
+            itens.append(item)
+        payload = {"transacao": itens, "fim": fim}
+        if self.consistencia: payload["consistencia"] = self.consistencia
+        payload.update(opcoes)
+        return (self.roteador.escolher(False) if self.roteador else 0), payload
+
+    def _indice_redirecionado(self, destino):
+        """Nó indicado num REDIRECIONAR (ou na visão de membros); entra na lista se ainda não era conhecido."""
+        with self.lock_nodes:
+            for i, node in enumerate(self.nodes):
+                if (node["ip"], node["porta"]) == (destino["ip"], destino["porta"]): return i
+            self.nodes.append({"ip": destino["ip"], "porta": destino["porta"]})
+            self._nova_conexao(self.nodes[-1])
+            # O roteador acrescenta na mesma posição: os índices das duas listas continuam batendo
+            if self.roteador: self.roteador.adicionar(self.nodes[-1])
+            return len(self.nodes) - 1
+
+    def _nova_conexao(self, node):
+        raise NotImplementedError
+
+
+class Conexao(_BaseConexao):
+    """
+    Conexão com o cluster: um socket persistente por nó, reaproveitado por todas as
+    consultas (várias podem estar em voo ao mesmo tempo, de threads diferentes).
+    """
+    def __init__(self, nodes=NODES, max_atraso_s=None, consistencia=None, rotear=True, timeout=TIMEOUT_PADRAO,
+                 binario=True):
+        self.conexoes = []
+        self.binario = binario  # False: fica em JSON mesmo que o nó aceite msgpack
+        super().__init__(nodes, max_atraso_s, consistencia, rotear, timeout)
+
+    def _nova_conexao(self, node):
+        self.conexoes.append(ConexaoPeer(node["ip"], node["porta"], binario=self.binario))
+
+    def _requisitar(self, indice, payload):
+        try:
+            return self.conexoes[indice].requisitar(self._mensagem("QUERY_REQ", payload), timeout=self.timeout)
+        except Exception as e:
+            raise ErroDDB(f"Falha falando com {self.nodes[indice]['ip']}:{self.nodes[indice]['porta']}: {e}")
+
+    def executar(self, sql, parametros=None, **opcoes):
+        """Uma requisição, uma resposta. Retorna o payload do QUERY_RESP."""
+        return self._executar(sql, None if parametros is None else [list(parametros)], **opcoes)
+
+    def executar_lote(self, sql, conjuntos, **opcoes):
+        """Vários conjuntos de parâmetros numa mensagem (escritas: uma transação no Master)."""
+        return self._executar(sql, [list(p) for p in conjuntos], **opcoes)
+
+    def transacao(self, comandos, fim="COMMIT", **opcoes):
+        """
+        BEGIN, os comandos e COMMIT (ou ROLLBACK) numa requisição: uma transação no Master e
+        uma entrada no log, que as réplicas aplicam inteira ou nada. "resultados" tem um item
+        por comando. Erro em qualquer comando desfaz todos (ErroDDB).
+        """
+        indice, payload = self._preparar_transacao(comandos, fim, **opcoes)
+        resultado = _checar(self._enviar(indice, payload))
+        self.ultima_escrita = time.monotonic()
+        return resultado
+
+    def _enviar(self, indice, payload):
+        if not self.roteador: return self._requisitar(indice, payload)
+        with self.roteador.usar(indice): return self._requisitar(indice, payload)
+
+    def _executar(self, sql, conjuntos, **opcoes):
+        indice, payload = self._preparar(sql, conjuntos, **opcoes)
+        resp = self._enviar(indice, payload)
+        if _desconhecido(resp):
+            resp = self._requisitar(indice, dict(payload, sql=_texto(sql)))
+        resultado = _checar(resp)
+        if not eh_leitura(_texto(sql)): self.ultima_escrita = time.monotonic()
+        return resultado
+
+    def paginas(self, sql, tamanho_pagina=TAMANHO_PAGINA, parametros=None, **opcoes):
+        """
+        Gera as páginas de uma leitura ({"linhas", "colunas" na primeira}). Cada página
+        é confirmada (STREAM_ACK) só quando a próxima é pedida, então o nó nunca fica
+        mais que JANELA_PAGINAS à frente de quem consome. O último item é o QUERY_FIM.
+        """
+        indice, payload = self._preparar(sql, None if parametros is None else [list(parametros)], **opcoes)
+        payload.update(paginar=tamanho_pagina, janela=JANELA_PAGINAS)
+        for _ in range(3):
+            conn = self.conexoes[indice]
+            msg = self._mensagem("QUERY_REQ", payload)
+            terminou = False
+            try:
+                for frame in conn.requisitar_stream(msg, timeout=self.timeout):
+                    if frame["tipo"] == "QUERY_PAGINA":
+                        yield frame["payload"]
+                        conn.requisitar(self._mensagem("STREAM_ACK", {"stream": msg["req_id"]}), esperar_resposta=False)
+                    elif frame["tipo"] == "REDIRECIONAR":
+                        terminou = True
+                        indice = self._indice_redirecionado(frame["payload"])
+                        payload = dict(payload, max_atraso_s=None, ler_proprias_escritas=False)
+                        break
+                    elif _desconhecido(frame):
+                        terminou = True
+                        payload = dict(payload, sql=_texto(sql))
+                        break
+                    else:
+                        terminou = True
+                        yield dict(_checar(frame), fim=True)
+                        return
+                else:
+                    raise ErroDDB("Stream encerrado sem QUERY_FIM")
+            except (OSError, ConnectionError) as e:
+                raise ErroDDB(f"Stream interrompido: {e}")
+            finally:
+                if not terminou and "req_id" in msg:
+                    try:
+                        conn.requisitar(self._mensagem("STREAM_ACK", {"stream": msg["req_id"], "cancelar": True}),
+                                        esperar_resposta=False)
+                    except OSError:
+                        pass
+        raise ErroDDB("Redirecionamentos demais")
+
+    def cursor(self, tamanho_pagina=TAMANHO_PAGINA):
+        return Cursor(self, tamanho_pagina)
+
+    def fechar(self):
+        if self.roteador: self.roteador.parar()
+        for conn in self.conexoes: conn.fechar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+class _BaseCursor:
+    """Estado comum dos cursores: colunas, linhas da página atual e contadores."""
+    def __init__(self, conexao, tamanho_pagina):
+        self.conexao = conexao
+        self.arraysize = tamanho_pagina
+        self._limpar()
+
+    def _limpar(self):
+        self.description = None
+        self.colunas = []
+        self.rowcount = -1
+        self.mensagem = None
+        self.resposta = None
+        self._buffer = deque()
+        self._paginas = None
+
+    def _receber(self, item):
+        """Consome um item de paginas(); False quando o stream terminou."""
+        if item is None or item.get("fim"):
+            if item: self.rowcount = item.get("linhas", self.rowcount)
+            self._paginas = None
+            return False
+        if "colunas" in item:
+            self.colunas = item["colunas"]
+            self.description = tuple((c, None, None, None, None, None, None) for c in self.colunas)
+        self._buffer.extend(tuple(linha) for linha in item["linhas"])
+        return True
+
+    def _resultado_unico(self, resp):
+        self.resposta = resp
+        self.mensagem = resp.get("mensagem")
+        dados = resp.get("dados")
+        if dados is None and "resultados" in resp:  # Leitura com vários conjuntos de parâmetros
+            dados = [linha for parte in resp["resultados"] for linha in parte]
+        if dados:
+            self.colunas = list(dados[0].keys())
+            self.description = tuple((c, None, None, None, None, None, None) for c in self.colunas)
+            self._buffer.extend(tuple(linha[c] for c in self.colunas) for linha in dados)
+        self.rowcount = len(dados) if dados is not None else resp.get("afetadas", -1)
+
+
+class Cursor(_BaseCursor):
+    """
+    Cursor no estilo DB-API: leituras chegam paginadas e fetchmany só puxa páginas
+    conforme precisa, então milhões de linhas cabem em memória limitada.
+    """
+    def execute(self, sql, parametros=None, **opcoes):
+        """'sql' pode ser texto ou um Comando de Conexao.preparar; parâmetros com %s ou ?."""
+        self.close()
+        if eh_leitura(_texto(sql)):
+            self._paginas = self.conexao.paginas(sql, self.arraysize, parametros, **opcoes)
+            self._puxar()  # Primeira página: colunas e erros de SQL aparecem já aqui
+        else:
+            self._resultado_unico(self.conexao.executar(sql, parametros, **opcoes))
+        return self
+
+    def executemany(self, sql, conjuntos, **opcoes):
+        self.close()
+        self._resultado_unico(self.conexao.executar_lote(sql, conjuntos, **opcoes))
+        return self
+
+    def _puxar(self):
+        if self._paginas is None: return False
+        return self._receber(next(self._paginas, None))
+
+    def fetchone(self):
+        while not self._buffer:
+            if not self._puxar(): return None
+        return self._buffer.popleft()
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        while len(self._buffer) < size and self._puxar(): pass
+        return [self._buffer.popleft() for _ in range(min(size, len(self._buffer)))]
+
+    def fetchall(self):
+        while self._puxar(): pass
+        linhas = list(self._buffer)
+        self._buffer.clear()
+        return linhas
+
+    def __iter__(self):
+        while True:
+            linha = self.fetchone()
+            if linha is None: return
+            yield linha
+
+    def close(self):
+        if self._paginas is not None: self._paginas.close()  # Cancela o stream no nó
+        self._limpar()
+
+
+class ConexaoAsync(_BaseConexao):
+    """Mesma API para asyncio: executar/cursor com await, sockets no event loop."""
+    def __init__(self, nodes=NODES, max_atraso_s=None, consistencia=None, rotear=True, timeout=TIMEOUT_PADRAO,
+                 binario=True):
+        self.conexoes = []
+        self.binario = binario  # False: fica em JSON mesmo que o nó aceite msgpack
+        super().__init__(nodes, max_atraso_s, consistencia, rotear, timeout)
+
+    def _nova_conexao(self, node):
+        self.conexoes.append(ConexaoPeerAsync(node["ip"], node["porta"], binario=self.binario))
+
+    async def executar(self, sql, parametros=None, **opcoes):
+        return await self._executar(sql, None if parametros is None else [list(parametros)], **opcoes)
+
+    async def executar_lote(self, sql, conjuntos, **opcoes):
+        return await self._executar(sql, [list(p) for p in conjuntos], **opcoes)
+
+    async def _requisitar(self, indice, payload):
+        try:
+            return await self.conexoes[indice].requisitar(self._mensagem("QUERY_REQ", payload), timeout=self.timeout)
+        except Exception as e:
+            raise ErroDDB(f"Falha falando com {self.nodes[indice]['ip']}:{self.nodes[indice]['porta']}: {e}")
+
+    async def transacao(self, comandos, fim="COMMIT", **opcoes):
+        """Versão async de Conexao.transacao."""
+        indice, payload = self._preparar_transacao(comandos, fim, **opcoes)
+        resultado = _checar(await self._requisitar(indice, payload))
+        self.ultima_escrita = time.monotonic()
+        return resultado
+
+    async def _executar(self, sql, conjuntos, **opcoes):
+        indice, payload = self._preparar(sql, conjuntos, **opcoes)
+        resp = await self._requisitar(indice, payload)
+        if _desconhecido(resp):
+            resp = await self._requisitar(indice, dict(payload, sql=_texto(sql)))
+        resultado = _checar(resp)
+        if not eh_leitura(_texto(sql)): self.ultima_escrita = time.monotonic()
+        return resultado
+
+    async def paginas(self, sql, tamanho_pagina=TAMANHO_PAGINA, parametros=None, **opcoes):
+        """Versão async de Conexao.paginas."""
+        indice, payload = self._preparar(sql, None if parametros is None else [list(parametros)], **opcoes)
+        payload.update(paginar=tamanho_pagina, janela=JANELA_PAGINAS)
+        for _ in range(3):
+            conn = self.conexoes[indice]
+            msg = self._mensagem("QUERY_REQ", payload)
+            terminou = False
+            frames = conn.requisitar_stream(msg, timeout=self.timeout)
+            try:
+                async for frame in frames:
+                    if frame["tipo"] == "QUERY_PAGINA":
+                        yield frame["payload"]
+                        await conn.requisitar(self._mensagem("STREAM_ACK", {"stream": msg["req_id"]}), esperar_resposta=False)
+                    elif frame["tipo"] == "REDIRECIONAR":
+                        terminou = True
+                        indice = self._indice_redirecionado(frame["payload"])
+                        payload = dict(payload, max_atraso_s=None, ler_proprias_escritas=False)
+                        break
+                    elif _desconhecido(frame):
+                        terminou = True
+                        payload = dict(payload, sql=_texto(sql))
+                        break
+                    else:
+                        terminou = True
+                        yield dict(_checar(frame), fim=True)
+                        return
+                else:
+                    raise ErroDDB("Stream encerrado sem QUERY_FIM")
+            except (OSError, ConnectionError) as e:
+                raise ErroDDB(f"Stream interrompido: {e}")
+            finally:
+                await frames.aclose()
+                if not terminou and "req_id" in msg:
+                    try:
+                        await conn.requisitar(self._mensagem("STREAM_ACK", {"stream": msg["req_id"], "cancelar": True}),
+                                              esperar_resposta=False)
+                    except OSError:
+                        pass
+        raise ErroDDB("Redirecionamentos demais")
+
+    def cursor(self, tamanho_pagina=TAMANHO_PAGINA):
+        return CursorAsync(self, tamanho_pagina)
+
+    def fechar(self):
+        if self.roteador: self.roteador.parar()
+        for conn in self.conexoes: conn.fechar()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.fechar()
+
+
+class CursorAsync(_BaseCursor):
+    async def execute(self, sql, parametros=None, **opcoes):
+        await self.close()
+        if eh_leitura(_texto(sql)):
+            self._paginas = self.conexao.paginas(sql, self.arraysize, parametros, **opcoes)
+            await self._puxar()
+        else:
+            self._resultado_unico(await self.conexao.executar(sql, parametros, **opcoes))
+        return self
+
+    async def executemany(self, sql, conjuntos, **opcoes):
+        await self.close()
+        self._resultado_unico(await self.conexao.executar_lote(sql, conjuntos, **opcoes))
+        return self
+
+    async def _puxar(self):
+        if self._paginas is None: return False
+        return self._receber(await anext(self._paginas, None))
+
+    async def fetchone(self):
+        while not self._buffer:
+            if not await self._puxar(): return None
+        return self._buffer.popleft()
+
+    async def fetchmany(self, size=None):
+        size = size or self.arraysize
+        while len(self._buffer) < size and await self._puxar(): pass
+        return [self._buffer.popleft() for _ in range(min(size, len(self._buffer)))]
+
+    async def fetchall(self):
+        while await self._puxar(): pass
+        linhas = list(self._buffer)
+        self._buffer.clear()
+        return linhas
+
+    async def __aiter__(self):
+        while True:
+            linha = await self.fetchone()
+            if linha is None: return
+            yield linha
+
+    async def close(self):
+        if self._paginas is not None: await self._paginas.aclose()
+        self._limpar()
+
+
+def conectar(**kwargs):
+    return Conexao(**kwargs)
+
+
+# --------- Linha de comando -----------
+def _imprimir(cursor, formato, saida):
+    if formato == "csv":
+        escritor = csv.writer(saida)
+        if cursor.colunas: escritor.writerow(cursor.colunas)
+        for linha in cursor: escritor.writerow(linha)
+    elif formato == "json":
+        for linha in cursor: saida.write(json.dumps(dict(zip(cursor.colunas, linha)), default=str) + "\n")
+    else:
+        if cursor.colunas:
+            cabecalho = " | ".join(cursor.colunas)
+            saida.write(cabecalho + "\n" + "-" * len(cabecalho) + "\n")
+        for linha in cursor: saida.write(" | ".join(str(v) for v in linha) + "\n")
+    if cursor.mensagem: saida.write(cursor.mensagem + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cliente de linha de comando do banco distribuído")
+    parser.add_argument("sql", nargs="*", help="comandos SQL (sem argumentos: lê do stdin, um por linha terminada em ';')")
+    parser.add_argument("--no", action="append", metavar="IP:PORTA", help="nó do cluster (repetível; padrão: os 3 locais)")
+    parser.add_argument("--formato", choices=["tabela", "csv", "json"], default="tabela")
+    parser.add_argument("--pagina", type=int, default=TAMANHO_PAGINA, help="linhas por página nas leituras")
+    parser.add_argument("--max-atraso", type=float, default=None, help="atraso de replicação aceito nas leituras (s)")
+    parser.add_argument("--consistencia", choices=["async", "quorum", "all"], default=None)
+    args = parser.parse_args(argv)
+
+    nodes = NODES
+    if args.no:
+        nodes = [{"ip": ip, "porta": int(porta)} for ip, porta in (n.rsplit(":", 1) for n in args.no)]
+    comandos = args.sql or [c.strip() for c in sys.stdin.read().split(";") if c.strip()]
+
+    codigo = 0
+    with Conexao(nodes, max_atraso_s=args.max_atraso, consistencia=args.consistencia) as conn:
+        cursor = conn.cursor(args.pagina)
+        for sql in comandos:
+            try:
+                cursor.execute(sql)
+                _imprimir(cursor, args.formato, sys.stdout)
+            except ErroDDB as e:
+                print(f"ERRO: {e}", file=sys.stderr)
+                codigo = 1
+            finally:
+                cursor.close()
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+import threading
+from logs import get_logger
+
+log = get_logger("comandos")
+
+
+def id_comando(sql):
+    """Id de um comando = hash do texto: o mesmo em todos os nós e no cliente, sem coordenação."""
+    return hashlib.sha1(sql.strip().encode("utf-8")).hexdigest()[:16]
+
+
+class ComandosPreparados:
+    """
+    Registro stmt_id -> SQL do nó. Entradas do log de replicação guardam só o id e os
+    parâmetros, então o registro é persistido (uma linha JSON por comando) para o log
+    continuar resolvível depois de reiniciar. O texto guardado é sempre o mesmo objeto
+    str, o que deixa o cursor preparado do mysql-connector reaproveitar o PREPARE.
+    O fsync fica para 'sincronizar' (o log de replicação chama antes do seu) e 'compactar'
+    acompanha a retenção do log: sobram os ids das entradas retidas e os registrados desde
+    a última compactação. Cliente com um id descartado recebe COMANDO_DESCONHECIDO e prepara de novo.
+    """
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.lock = threading.Lock()
+        self.comandos = {}
+        self.recentes = set()  # Registrados desde a última compactação (talvez ainda sem entrada no log)
+        self.pendente = False  # Há linhas gravadas sem fsync
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        if os.path.exists(caminho):
+            with open(caminho, encoding="utf-8") as f:
+                for linha in f:
+                    try:
+                        item = json.loads(linha)
+                    except ValueError:
+                        break  # última linha incompleta
+                    self.comandos[item["stmt_id"]] = item["sql"]
+            log.info("[PREPARE] %d comandos carregados de %s", len(self.comandos), caminho)
+        self.arquivo = open(caminho, "a", encoding="utf-8")
+
+    def registrar(self, sql, stmt_id=None):
+        """Registra (se ainda não existe) e retorna o stmt_id."""
+        sql = sql.strip()
+        stmt_id = stmt_id or id_comando(sql)
+        with self.lock:
+            if stmt_id not in self.comandos:
+                self.comandos[stmt_id] = sql
+                self.arquivo.write(json.dumps({"stmt_id": stmt_id, "sql": sql}) + "\n")
+                self.arquivo.flush()
+                self.pendente = True
+            self.recentes.add(stmt_id)
+        return stmt_id
+
+    def sincronizar(self):
+        """fsync do que foi registrado; o log de replicação chama antes de gravar entradas que usam os ids."""
+        with self.lock:
+            if not self.pendente: return
+            os.fsync(self.arquivo.fileno())
+            self.pendente = False
+
+    def compactar(self, entradas):
+        """Reescreve o registro só com os comandos das 'entradas' retidas no log e os recentes."""
+        with self.lock:
+            manter = set(self._usados(entradas)) | self.recentes
+            comandos = {i: sql for i, sql in self.comandos.items() if i in manter}
+            if len(comandos) < len(self.comandos):
+                temporario = self.caminho + ".tmp"
+                with open(temporario, "w", encoding="utf-8") as f:
+                    for stmt_id, sql in comandos.items(): f.write(json.dumps({"stmt_id": stmt_id, "sql": sql}) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.arquivo.close()
+                os.replace(temporario, self.caminho)
+                self.arquivo = open(self.caminho, "a", encoding="utf-8")
+                log.info("[PREPARE] Registro compactado: %d -> %d comandos", len(self.comandos), len(comandos))
+                self.comandos, self.pendente = comandos, False
+            self.recentes = set()
+
+    @staticmethod
+    def _usados(entradas):
+        return (c["stmt_id"] for e in entradas for c in e.get("transacao", [e]) if "stmt_id" in c)
+
+    def registrar_varios(self, comandos):
+        for stmt_id, sql in (comandos or {}).items(): self.registrar(sql, stmt_id)
+
+    def sql(self, stmt_id):
+        return self.comandos.get(stmt_id)
+
+    def resolver(self, entradas):
+        """{stmt_id: sql} dos comandos usados por estas entradas do log (vai junto no lote)."""
+        return {i: self.comandos[i] for i in set(self._usados(entradas)) if i in self.comandos}
+
+    def fechar(self):
+        with self.lock:
+            self.arquivo.close()
@@ -1,8 +1,137 @@
 import mysql.connector
 import sys
+import time
+import threading
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal
+from logs import get_logger, span, campos
+from metricas import Metricas
+from classificador_sql import classificar, LEITURAS, DDL
+from replicacao_linhas import MAX_LINHAS, chaves_do_insert, codificar
+
+log = get_logger("db")
+
+MAX_PREPARADOS_CONEXAO = 128 # Comandos preparados mantidos abertos por conexão do pool (LRU)
+DUMP_WORKERS = 4              # Conexões lendo tabelas/faixas em paralelo no dump completo
+DUMP_LINHAS_FAIXA = 100000    # Tabelas com mais linhas (estimativa) são lidas em faixas da PK
+DUMP_MAX_FAIXAS = 64
+
+class PoolEsgotado(Exception):
+    pass
+
+class ConexaoPool:
+    """Conexão do pool + estado de sessão que não queremos consultar no servidor a cada uso."""
+    def __init__(self, connection):
+        self.connection = connection
+        self.db_atual = None   # último USE aplicado nesta sessão
+        self.ultimo_uso = time.monotonic()
+        self.invalida = False  # estado de protocolo incerto (ex.: resultado não lido): não volta ao pool
+        self.preparados = OrderedDict()  # (sql, banco) -> cursor com o PREPARE já feito no servidor
+
+class PoolConexoes:
+    """
+    Pool limitado de conexões MySQL.
+    - checkout/devolver (ou o context manager conexao())
+    - health check (ping) só para conexões paradas há mais de intervalo_saude
+    - conexões ociosas há mais de max_ocioso são fechadas
+    """
+    def __init__(self, config, tamanho_max=10, max_ocioso=300, intervalo_saude=30, timeout_checkout=10):
+        self.config = config
+        self.tamanho_max = tamanho_max
+        self.max_ocioso = max_ocioso
+        self.intervalo_saude = intervalo_saude
+        self.timeout_checkout = timeout_checkout
+        self.livres = []  # pilha: reaproveita a mais recente (mais provável de estar viva)
+        self.total = 0
+        self.cond = threading.Condition()
+
+    def _criar(self):
+        # Autocommit: um comando avulso confirma sozinho (sem a ida extra do COMMIT) e uma leitura não
+        # deixa transação aberta (snapshot velho, travas) na conexão que volta ao pool. Quem precisa de
+        # transação chama start_transaction(), que vale até o commit()/rollback().
+        return ConexaoPool(mysql.connector.connect(autocommit=True, **self.config))
+
+    def _fechar(self, conn):
+        try: conn.connection.close()
+        except Exception: pass
+
+    def _despejar_ociosas(self):
+        """Chamado com o lock. As mais antigas ficam no fundo da pilha."""
+        limite = time.monotonic() - self.max_ocioso
+        while self.livres and self.livres[0].ultimo_uso < limite:
+            self._fechar(self.livres.pop(0))
+            self.total -= 1
+
+    def _saudavel(self, conn):
+        if time.monotonic() - conn.ultimo_uso < self.intervalo_saude: return True
+        try:
+            conn.connection.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def checkout(self):
+        prazo = time.monotonic() + self.timeout_checkout
+        while True:
+            with self.cond:
+                self._despejar_ociosas()
+                while not self.livres and self.total >= self.tamanho_max:
+                    restante = prazo - time.monotonic()
+                    if restante <= 0 or not self.cond.wait(restante):
+                        raise PoolEsgotado(f"Nenhuma conexão livre em {self.timeout_checkout}s")
+                conn = self.livres.pop() if self.livres else None
+                if conn is None: self.total += 1
+
+            if conn is None:
+                try:
+                    return self._criar()
+                except Exception:
+                    with self.cond:
+                        self.total -= 1
+                        self.cond.notify()
+                    raise
+            if self._saudavel(conn): return conn
+            log.warning("[DB WARN] Conexão do pool morta. Descartando...")
+            self.devolver(conn, descartar=True)
+
+    def devolver(self, conn, descartar=False):
+        with self.cond:
+            if descartar:
+                self._fechar(conn)
+                self.total -= 1
+            else:
+                conn.ultimo_uso = time.monotonic()
+                self.livres.append(conn)
+            self.cond.notify()
+
+    @contextmanager
+    def conexao(self):
+        conn = self.checkout()
+        descartar = False
+        try:
+            yield conn
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            descartar = True
+            raise
+        finally:
+            self.devolver(conn, descartar or conn.invalida)
+
+    def em_uso(self):
+        with self.cond:
+            return self.total - len(self.livres), self.tamanho_max
+
+    def fechar_todas(self):
+        with self.cond:
+            for conn in self.livres: self._fechar(conn)
+            self.total -= len(self.livres)
+            self.livres = []
+
 
 class DBManager:
-    def __init__(self, host, user, password, database=None, port=3306):
+    def __init__(self, host, user, password, database=None, port=3306, tamanho_pool=10, metricas=None):
         self.config = {
             'host': host,
             'port': port,
@@ -10,158 +139,818 @@ class DBManager:
             'password': password,
             # 'database': database  <-- Deixe comentado! Vamos conectar no servidor globalmente.
         }
-        
-        # Conexão persistente
-        self.connection = None
-        self.cursor = None
-        
-        print(f"[DB INIT] Tentando conectar ao MySQL em {host}...")
+
+        # Pool de conexões: cada requisição usa a sua
+        self.pool = PoolConexoes(self.config, tamanho_max=tamanho_pool)
+        # Banco escolhido pelo último USE (semântica global de antes, agora reaplicada por conexão)
+        self.db_sessao = None
+        # Andamento do último get_full_dump: "banco.tabela" -> linhas, faixas, segundos, status
+        self.progresso = {}
+        self.lock_progresso = threading.Lock()
+        # (banco, tabela) -> colunas, PK e AUTO_INCREMENT (replicação por linhas); limpo a cada DDL
+        self.esquemas = {}
+        self.lock_esquemas = threading.Lock()
+        # Tempo de execução no MySQL e volume de dump/restore (exportados pelo nó)
+        self.metricas = metricas or Metricas()
+
+        log.info("[DB INIT] Tentando conectar ao MySQL em %s...", host)
         self.conectar()
 
     def conectar(self):
+        """Valida o acesso ao servidor abrindo a primeira conexão do pool."""
         try:
-            self.connection = mysql.connector.connect(**self.config)
-            # buffered=True evita erro de "Unread result found"
-            self.cursor = self.connection.cursor(dictionary=True, buffered=True)
-            print(f"[DB CONN] Conexão estabelecida com sucesso (ID Conexão: {self.connection.connection_id})")
+            with self.pool.conexao() as conn:
+                log.info("[DB CONN] Conexão estabelecida com sucesso (ID Conexão: %s, pool máx: %s)",
+                         conn.connection.connection_id, self.pool.tamanho_max)
         except mysql.connector.Error as err:
-            print(f"[DB CRITICAL] Falha ao conectar: {err}")
+            log.critical("[DB CRITICAL] Falha ao conectar: %s", err)
             sys.exit(1)
 
-    def _get_current_db(self):
-        """Helper para saber onde estamos conectados agora"""
+    @staticmethod
+    def _nome_banco(classe):
+        """Extrai o nome do banco de 'USE x' / 'DROP DATABASE [IF EXISTS] x'."""
+        nomes = [t for t in classe.toks if t.tipo in ("palavra", "nome")]
+        return nomes[-1].texto.strip("`") if len(nomes) > (1 if classe.tipo == "USE" else 2) else None
+
+    def _preparar_sessao(self, conn, cursor, database):
+        """Garante que a conexão do pool está no banco certo; só emite USE quando muda."""
+        if database and conn.db_atual != database:
+            cursor.execute(f"USE {database}")
+            conn.db_atual = database
+
+    def _atualizar_sessao(self, conn, sql, database):
+        """Estado de sessão rastreado localmente depois de USE / DROP DATABASE."""
+        classe = classificar(sql)
+        if classe.tipo == "USE":
+            conn.db_atual = self._nome_banco(classe)
+            if database is None: self.db_sessao = conn.db_atual
+        elif classe.tipo == "DROP" and classe.objeto in ("DATABASE", "SCHEMA"):
+            apagado = self._nome_banco(classe)
+            if conn.db_atual == apagado: conn.db_atual = None
+            if self.db_sessao == apagado: self.db_sessao = None
+        if classe.tipo in DDL:
+            with self.lock_esquemas: self.esquemas.clear()
+
+    def executar_query(self, sql, database=None):
+        alvo = database or self.db_sessao
+
         try:
-            self.cursor.execute("SELECT DATABASE()")
-            res = self.cursor.fetchone()
-            if res:
-                return list(res.values())[0]
-        except:
-            return "Unknown"
-        return "None"
-
-    def executar_query(self, sql):
-        # 1. Verifica conexão
-        if self.connection is None or not self.connection.is_connected():
-            print("[DB WARN] Conexão perdida. Reconectando...")
-            self.conectar()
+            with self.pool.conexao() as conn:
+                cursor = conn.connection.cursor(dictionary=True, buffered=True)
+                try:
+                    self._preparar_sessao(conn, cursor, alvo)
+
+                    # Uma ida ao servidor por comando: sem SELECT DATABASE() de diagnóstico
+                    # e sem COMMIT separado (conexões do pool estão em autocommit)
+                    with self.metricas.cronometro("db_execucao_ms", operacao="exec"), \
+                         span(log, "db.exec", db=conn.db_atual, sql=sql[:100]) as trace:
+                        cursor.execute(sql)
+
+                        self._atualizar_sessao(conn, sql, database)
+
+                        # Tratamento SELECT vs ESCRITA (pelo que o servidor devolveu: WITH ..., SELECT ... INTO)
+                        if cursor.with_rows:
+                            decimais = set()
+                            resultado = self._sanitizar(cursor.fetchall(), decimais)
+                            trace["linhas"] = len(resultado)
+                            return self._resposta_leitura(resultado, decimais)
+                        else:
+                            trace["afetadas"] = cursor.rowcount
+                            return {"status": "OK", "mensagem": "Query executada com sucesso"}
+                except mysql.connector.Error:
+                    try: conn.connection.rollback()
+                    except mysql.connector.Error: pass
+                    raise
+                finally:
+                    cursor.close()
+        except (mysql.connector.Error, PoolEsgotado) as err:
+            log.warning("[DB ERROR] %s", err, extra=campos(sql=sql[:100]))
+            return {"status": "ERRO", "mensagem": str(err)}
+
+    @staticmethod
+    def _sanitizar(resultado, decimais=None):
+        """Converte datas/decimais para string (linhas em dict). Anota em 'decimais' as colunas DECIMAL."""
+        for row in resultado:
+            for key, value in row.items():
+                if value is not None and not isinstance(value, (int, float, str, bool)):
+                    if decimais is not None and isinstance(value, Decimal): decimais.add(key)
+                    row[key] = str(value)
+        return resultado
 
+    @staticmethod
+    def _resposta_leitura(dados, decimais):
+        """QUERY_RESP de leitura; "decimais" diz quais colunas de texto são números (juntar shards)."""
+        resposta = {"status": "OK", "dados": dados}
+        if decimais: resposta["decimais"] = sorted(decimais)
+        return resposta
+
+    def _cursor_preparado(self, conn, sql):
+        """
+        Cursor com 'sql' já preparado nesta conexão (PREPARE uma vez por conexão e banco).
+        Retorna também o objeto str usado no PREPARE: o mysql-connector só reaproveita o
+        comando se receber exatamente o mesmo objeto.
+        """
+        chave = (sql, conn.db_atual)
+        item = conn.preparados.get(chave)
+        if item is not None:
+            conn.preparados.move_to_end(chave)
+            return item
+        item = (conn.connection.cursor(prepared=True, dictionary=True), sql)
+        conn.preparados[chave] = item
+        if len(conn.preparados) > MAX_PREPARADOS_CONEXAO:
+            antigo, _ = conn.preparados.popitem(last=False)[1]
+            try: antigo.close()  # DEALLOCATE no servidor
+            except mysql.connector.Error: pass
+        return item
+
+    def executar_preparado(self, sql, parametros, database=None):
+        """
+        Executa um comando preparado no servidor com um ou vários conjuntos de parâmetros
+        (só os valores vão ao MySQL a cada execução). Vários conjuntos de uma escrita rodam
+        numa única transação. Leitura: "dados" (um conjunto) ou "resultados" (um por conjunto).
+        """
+        leitura = classificar(sql).tipo in LEITURAS
+        transacao = len(parametros) > 1 and not leitura
         try:
-            # 2. Log de Debug PRE-EXECUÇÃO
-            db_atual = self._get_current_db()
-            sql_clean = sql.strip().replace('\n', ' ')
-            print(f"[DB EXEC] DB_ATUAL=[{db_atual}] | SQL: {sql_clean[:100]}...")
-
-            # 3. Limpeza de buffer (casos raros de erro anterior)
-            try: self.cursor.fetchall() 
-            except: pass 
-
-            # 4. Execução
-            self.cursor.execute(sql)
-
-            # 5. Tratamento SELECT vs ESCRITA
-            if any(sql.strip().upper().startswith(cmd) for cmd in ["SELECT", "SHOW", "DESCRIBE", "EXPLAIN"]):
-                resultado = self.cursor.fetchall()
-                
-                # Sanitização (converte datas/decimais para string)
-                for row in resultado:
-                    for key, value in row.items():
-                        if value is not None and not isinstance(value, (int, float, str, bool, type(None))):
-                            row[key] = str(value)
-                
-                print(f"   -> [DB RESULT] Retornou {len(resultado)} linhas.")
-                return {"status": "OK", "dados": resultado}
-                        
-            else:
-                self.connection.commit()
-                print(f"   -> [DB COMMIT] Sucesso. Linhas afetadas: {self.cursor.rowcount}")
-                return {"status": "OK", "mensagem": "Query executada com sucesso"}
-                
-        except mysql.connector.Error as err:
-            print(f"   -> [DB ERROR] {err}")
+            with self.pool.conexao() as conn:
+                meta = conn.connection.cursor(buffered=True)
+                try:
+                    self._preparar_sessao(conn, meta, database or self.db_sessao)
+                finally:
+                    meta.close()
+                cursor, sql = self._cursor_preparado(conn, sql)
+                resultados, afetadas, decimais = [], 0, set()
+                try:
+                    if transacao: conn.connection.start_transaction()
+                    with self.metricas.cronometro("db_execucao_ms", operacao="preparado"), \
+                         span(log, "db.exec_preparado", db=conn.db_atual, sql=sql[:100], conjuntos=len(parametros)):
+                        for params in parametros:
+                            cursor.execute(sql, tuple(params))
+                            if leitura: resultados.append(self._sanitizar(cursor.fetchall(), decimais))
+                            else: afetadas += max(cursor.rowcount, 0)
+                    if transacao: conn.connection.commit()
+                except mysql.connector.Error:
+                    try: conn.connection.rollback()
+                    except mysql.connector.Error: pass
+                    raise
+        except (mysql.connector.Error, PoolEsgotado) as err:
+            log.warning("[DB ERROR] %s", err, extra=campos(sql=sql[:100]))
+            return {"status": "ERRO", "mensagem": str(err)}
+
+        if leitura:
+            if len(resultados) == 1: return self._resposta_leitura(resultados[0], decimais)
+            return {"status": "OK", "resultados": resultados}
+        return {"status": "OK", "mensagem": "Query executada com sucesso", "afetadas": afetadas}
+
+    def iterar_query(self, sql, tamanho_pagina=1000, database=None, params=None):
+        """
+        Leitura em páginas de até 'tamanho_pagina' linhas, com cursor não-bufferizado:
+        o resultado nunca fica inteiro em memória. A primeira página traz as colunas.
+        A conexão do pool fica presa ao gerador até ele terminar (ou ser fechado).
+        Com 'params' a leitura usa um comando preparado (cursor próprio, fechado no fim).
+        """
+        with self.pool.conexao() as conn:
+            cursor = conn.connection.cursor(buffered=False, prepared=params is not None)
+            try:
+                self._preparar_sessao(conn, cursor, database or self.db_sessao)
+                if params is None: cursor.execute(sql)
+                else: cursor.execute(sql, tuple(params))
+                pagina = 0
+                while True:
+                    linhas = cursor.fetchmany(tamanho_pagina)
+                    dados = {"pagina": pagina, "linhas": [[self._serializar_valor(v) for v in linha] for linha in linhas]}
+                    if pagina == 0: dados["colunas"] = list(cursor.column_names)
+                    yield dados
+                    if len(linhas) < tamanho_pagina: break
+                    pagina += 1
+            finally:
+                try:
+                    cursor.close()
+                except mysql.connector.Error:
+                    conn.invalida = True  # Gerador fechado com resultado não lido
+
+    def executar_transacao(self, comandos, database=None, confirmar=True, planos=None):
+        """
+        BEGIN, [(sql, parametros), ...] e COMMIT (ou ROLLBACK, com confirmar=False) numa só
+        conexão. O primeiro erro desfaz tudo. 'parametros' como em executar_preparado (lista
+        de conjuntos) ou None. Um resultado por comando: "dados" (leitura) ou "afetadas".
+        Com 'planos' (um por comando, ou None), "imagens" traz as linhas capturadas de cada um.
+        """
+        resultados, imagens = [], []
+        try:
+            with self.pool.conexao() as conn:
+                cursor = conn.connection.cursor(dictionary=True, buffered=True)
+                try:
+                    self._preparar_sessao(conn, cursor, database or self.db_sessao)
+                    conn.connection.start_transaction()
+                    with self.metricas.cronometro("db_execucao_ms", operacao="transacao"), \
+                         span(log, "db.transacao", db=conn.db_atual, comandos=len(comandos)):
+                        for i, (sql, parametros) in enumerate(comandos):
+                            try:
+                                plano = planos[i] if planos else None
+                                if plano:
+                                    resultado, imagem = self._executar_capturando(conn, cursor, sql, parametros, plano)
+                                else:
+                                    resultado, imagem = self._executar_na_transacao(conn, cursor, sql, database, parametros), None
+                                resultados.append(resultado)
+                                imagens.append(imagem)
+                            except mysql.connector.Error as err:
+                                conn.connection.rollback()
+                                log.warning("[DB ERROR] Transação desfeita no comando %d: %s", i, err, extra=campos(sql=sql[:100]))
+                                return {"status": "ERRO", "mensagem": str(err), "comando": i}
+                    if confirmar: conn.connection.commit()
+                    else: conn.connection.rollback()
+                except mysql.connector.Error:
+                    try: conn.connection.rollback()
+                    except mysql.connector.Error: pass
+                    raise
+                finally:
+                    cursor.close()
+        except (mysql.connector.Error, PoolEsgotado) as err:
+            log.warning("[DB ERROR] %s", err)
             return {"status": "ERRO", "mensagem": str(err)}
+        if planos: return {"status": "OK", "resultados": resultados, "imagens": imagens}
+        return {"status": "OK", "resultados": resultados}
+
+    def _executar_na_transacao(self, conn, cursor, sql, database, parametros):
+        """Um comando dentro da transação aberta em 'conn' (sem COMMIT)."""
+        leitura = classificar(sql).tipo in LEITURAS
+        if parametros is None:
+            cursor.execute(sql)
+            self._atualizar_sessao(conn, sql, database)
+            if cursor.with_rows: return {"dados": self._sanitizar(cursor.fetchall())}
+            return {"afetadas": max(cursor.rowcount, 0)}
+        preparado, sql = self._cursor_preparado(conn, sql)
+        dados, afetadas = [], 0
+        for params in parametros:
+            preparado.execute(sql, tuple(params))
+            if leitura: dados.extend(self._sanitizar(preparado.fetchall()))
+            else: afetadas += max(preparado.rowcount, 0)
+        return {"dados": dados} if leitura else {"afetadas": afetadas}
 
-    def get_full_dump(self):
+    # --------- Replicação por linhas -----------
+    def esquema(self, db_name, table):
         """
-        Gera um dump completo de todos os bancos.
-        Usa uma conexão separada para não poluir o estado da conexão principal.
+        {"banco", "tabela", "colunas", "pk", "auto", "passo"} da tabela, com os nomes como estão no
+        servidor; guardado até o próximo DDL. None se ela não existe (ou o banco não respondeu).
+        """
+        chave = (db_name.lower(), table.lower())
+        with self.lock_esquemas:
+            if chave in self.esquemas: return self.esquemas[chave]
+        try:
+            with self.pool.conexao() as conn:
+                cursor = conn.connection.cursor(buffered=True)
+                try:
+                    cursor.execute("SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, EXTRA FROM information_schema.COLUMNS"
+                                   " WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION", (db_name, table))
+                    colunas = [[v.decode() if isinstance(v, (bytes, bytearray)) else v for v in linha] for linha in cursor.fetchall()]
+                    cursor.execute("SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = %s"
+                                   " AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY' ORDER BY ORDINAL_POSITION", (db_name, table))
+                    pk = [c.decode() if isinstance(c, (bytes, bytearray)) else c for c, in cursor.fetchall()]
+                    cursor.execute("SELECT @@auto_increment_increment")
+                    passo = int(cursor.fetchone()[0])
+                finally:
+                    cursor.close()
+        except (mysql.connector.Error, PoolEsgotado) as err:
+            log.warning("[DB ERROR] Esquema de %s.%s: %s", db_name, table, err)
+            return None
+        esquema = {"banco": colunas[0][0], "tabela": colunas[0][1], "colunas": [c[2] for c in colunas], "pk": pk,
+                   "auto": next((c[2] for c in colunas if "auto_increment" in (c[3] or "").lower()), None),
+                   "passo": passo} if colunas else None
+        with self.lock_esquemas: self.esquemas[chave] = esquema
+        return esquema
+
+    def executar_com_imagens(self, sql, parametros, database, plano):
+        """
+        Escrita do Master com captura das linhas (plano de replicacao_linhas.planejar), numa transação:
+        (resultado, imagem). Imagem None quando não deu para capturar: as réplicas recebem o SQL.
+        """
+        try:
+            with self.pool.conexao() as conn:
+                cursor = conn.connection.cursor(buffered=True)
+                try:
+                    self._preparar_sessao(conn, cursor, database or self.db_sessao)
+                    conn.connection.start_transaction()
+                    with self.metricas.cronometro("db_execucao_ms", operacao="linhas"), \
+                         span(log, "db.exec_linhas", db=conn.db_atual, sql=sql[:100]) as trace:
+                        resultado, imagem = self._executar_capturando(conn, cursor, sql, parametros, plano)
+                        trace["afetadas"] = resultado["afetadas"]
+                        trace["linhas"] = len(imagem["gravar"]) + len(imagem["apagar"]) if imagem else None
+                    conn.connection.commit()
+                except mysql.connector.Error:
+                    try: conn.connection.rollback()
+                    except mysql.connector.Error: pass
+                    raise
+                finally:
+                    cursor.close()
+        except (mysql.connector.Error, PoolEsgotado) as err:
+            log.warning("[DB ERROR] %s", err, extra=campos(sql=sql[:100]))
+            return {"status": "ERRO", "mensagem": str(err)}, None
+        return {"status": "OK", "mensagem": "Query executada com sucesso", "afetadas": resultado["afetadas"]}, imagem
+
+    def _executar_capturando(self, conn, cursor, sql, parametros, plano):
+        """
+        Executa o comando na transação aberta em 'conn' e lê como ficaram as linhas que ele pode ter
+        mudado (chaves candidatas travadas antes, chaves geradas ou explícitas depois): ({"afetadas"}, imagem).
+        """
+        leitor = conn.connection.cursor(buffered=True)
+        try:
+            chaves, capturar, afetadas = [], True, 0
+            for params in (parametros if parametros is not None else [None]):
+                if "selecao" in plano and capturar:
+                    de, ate = plano["marcadores"]
+                    leitor.execute(plano["selecao"], tuple(params[de:ate]) if params else None)
+                    chaves += [tuple(linha) for linha in leitor.fetchall()]
+                    capturar = len(chaves) <= MAX_LINHAS
+                if params is None:
+                    executado = cursor
+                    executado.execute(sql)
+                else:
+                    executado, sql = self._cursor_preparado(conn, sql)
+                    executado.execute(sql, tuple(params))
+                if executado.with_rows: executado.fetchall()
+                afetadas += max(executado.rowcount, 0)
+                if plano.get("gerada"):
+                    # Chaves seguidas a partir do LAST_INSERT_ID (as escritas no Master são serializadas)
+                    primeira = executado.lastrowid
+                    if primeira: chaves += [(primeira + k * plano["passo"],) for k in range(plano["tuplas"])]
+                    elif afetadas: capturar = False
+                elif "chaves" in plano:
+                    chaves += chaves_do_insert(plano, params)
+            if not capturar or len(chaves) > MAX_LINHAS or any(v is None for chave in chaves for v in chave):
+                return {"afetadas": afetadas}, None
+            return {"afetadas": afetadas}, self._imagem(leitor, plano, list(dict.fromkeys(chaves)))
+        finally:
+            leitor.close()
+
+    def _imagem(self, cursor, plano, chaves, tamanho_lote=500):
+        """Linhas atuais das chaves (gravar) e chaves que não existem mais (apagar), prontas para o log."""
+        pk, colunas, gravar, achadas = plano["pk"], [], [], set()
+        for i in range(0, len(chaves), tamanho_lote):
+            parte = chaves[i:i + tamanho_lote]
+            if len(pk) == 1:
+                filtro = f"`{pk[0]}` IN ({', '.join(['%s'] * len(parte))})"
+            else:
+                tupla = "(" + ", ".join(["%s"] * len(pk)) + ")"
+                filtro = f"({', '.join(f'`{c}`' for c in pk)}) IN ({', '.join([tupla] * len(parte))})"
+            cursor.execute(f"SELECT * FROM `{plano['banco']}`.`{plano['tabela']}` WHERE {filtro}",
+                           [v for chave in parte for v in chave])
+            colunas = list(cursor.column_names)
+            indices = [colunas.index(c) for c in pk]
+            for linha in cursor.fetchall():
+                achadas.add(tuple(str(linha[j]) for j in indices))
+                gravar.append([codificar(v) for v in linha])
+        # Chave que não casou pelo texto (colação, 5 vs '5') vira um DELETE a mais antes do INSERT: inofensivo
+        apagar = [[codificar(v) for v in chave] for chave in chaves if tuple(map(str, chave)) not in achadas]
+        return {"banco": plano["banco"], "tabela": plano["tabela"], "pk": pk, "colunas": colunas,
+                "gravar": gravar, "apagar": apagar}
+
+    def executar_lote(self, itens):
+        """
+        Group commit: executa [(sql, database, parametros), ...] numa única transação, com
+        um só COMMIT (um fsync do InnoDB) para o lote inteiro. 'parametros' (lista de
+        conjuntos, ou None para SQL puro) usa o comando preparado da conexão. O primeiro erro
+        encerra o lote: o item com erro é desfeito (o MySQL desfaz só aquele comando), os
+        anteriores são confirmados e os seguintes nem rodam (a réplica não pode pular entradas).
+        Um item que é uma lista de (sql, database, parametros) é uma transação do cliente:
+        roda sob um SAVEPOINT e, com erro em qualquer comando, sai inteira. DDL faz COMMIT
+        implícito no MySQL: o lote é confirmado antes dele e uma nova transação começa depois.
+        Retorna um resultado por item executado (o último é o ERRO, se houve).
+        """
+        resultados = []
+        with self.pool.conexao() as conn:
+            cursor = conn.connection.cursor(dictionary=True, buffered=True)
+            try:
+                conn.connection.start_transaction()
+                for item in itens:
+                    transacao = isinstance(item, list)
+                    ddl = not transacao and classificar(item[0]).tipo in DDL
+                    try:
+                        if transacao: cursor.execute("SAVEPOINT transacao")
+                        if ddl: conn.connection.commit()
+                        for sql, database, parametros in (item if transacao else [item]):
+                            self._preparar_sessao(conn, cursor, database or self.db_sessao)
+                            self._executar_na_transacao(conn, cursor, sql, database, parametros)
+                        if transacao: cursor.execute("RELEASE SAVEPOINT transacao")
+                        if ddl: conn.connection.start_transaction()
+                        resultados.append({"status": "OK"})
+                    except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+                        raise
+                    except mysql.connector.Error as err:
+                        if transacao: cursor.execute("ROLLBACK TO SAVEPOINT transacao")
+                        resultados.append({"status": "ERRO", "mensagem": str(err)})
+                        break
+                conn.connection.commit()
+            except mysql.connector.Error:
+                try: conn.connection.rollback()
+                except mysql.connector.Error: pass
+                raise
+            finally:
+                cursor.close()
+        return resultados
+
+    # --------- Carga em massa (restore) -----------
+    @staticmethod
+    def _inserir_em_lotes(cursor, tabela, colunas, linhas, tamanho_lote):
+        """
+        INSERT parametrizado via executemany: o conector reescreve cada lote num único
+        INSERT multi-linha, então são len(linhas)/tamanho_lote idas ao servidor.
+        """
+        lista_colunas = ", ".join(f"`{c}`" for c in colunas)
+        marcadores = ", ".join(["%s"] * len(colunas))
+        sql = f"INSERT INTO `{tabela}` ({lista_colunas}) VALUES ({marcadores})"
+        for i in range(0, len(linhas), tamanho_lote):
+            cursor.executemany(sql, linhas[i:i + tamanho_lote])
+
+    def restaurar_tabela(self, db_name, table_name, create_sql, colunas, linhas, tamanho_lote=1000, recriar=True):
+        """
+        Recria uma tabela e carrega as linhas (tuplas na ordem de 'colunas') numa única
+        transação, com as checagens de FK/unique desligadas durante a carga (no InnoDB é o
+        que vale: DISABLE KEYS só age em MyISAM).
+        Roda numa conexão própria do pool, então várias tabelas podem ser carregadas em paralelo.
+        Com recriar=False só acrescenta as linhas (chunks seguintes de um dump em streaming).
+        Retorna o número de linhas inseridas.
+        """
+        inicio = time.perf_counter()
+        if recriar:
+            with self.lock_esquemas: self.esquemas.clear()
+        with self.pool.conexao() as conn:
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
+                self._preparar_sessao(conn, cursor, db_name)
+                if not table_name: return 0
+
+                cursor.execute("SET SESSION foreign_key_checks = 0")
+                cursor.execute("SET SESSION unique_checks = 0")
+                if recriar:
+                    # DDL faz commit implícito: tudo isso vem antes da transação da carga
+                    cursor.execute(f"DROP TABLE IF EXISTS `{table_name}`")
+                    if create_sql: cursor.execute(create_sql)
+                if not linhas: return 0
+
+                conn.connection.start_transaction()
+                self._inserir_em_lotes(cursor, table_name, colunas, linhas, tamanho_lote)
+                conn.connection.commit()
+                self.metricas.contador("restore_linhas", "Linhas carregadas por restore (dump completo ou chunks)").somar(len(linhas))
+                self.metricas.contador("restore_segundos", "Tempo gasto carregando essas linhas").somar(time.perf_counter() - inicio)
+                return len(linhas)
+            except mysql.connector.Error:
+                try: conn.connection.rollback()
+                except mysql.connector.Error: pass
+                raise
+            finally:
+                # Variáveis de sessão sobrevivem à devolução ao pool: restaura
+                try:
+                    cursor.execute("SET SESSION unique_checks = 1")
+                    cursor.execute("SET SESSION foreign_key_checks = 1")
+                except mysql.connector.Error: pass
+                cursor.close()
+
+    # --------- Dump em streaming -----------
+    @staticmethod
+    def _serializar_valor(v):
+        if v is None or isinstance(v, (int, float, bool, str)): return v
+        return str(v)
+
+    def iterar_dump(self, tamanho_chunk=5000, retomar=None, trava=None, ao_iniciar=None):
+        """
+        Dump em streaming: gera um chunk por vez, nunca mais que tamanho_chunk linhas em
+        memória, lendo com cursor não-bufferizado dentro de um snapshot consistente.
+        Tabelas saem em ordem (banco, tabela) e as linhas em ordem de PK; cada chunk leva em "ate"
+        a PK da sua última linha. retomar = {"database", "table", "chunk", "ate", "ultimo"} continua
+        logo depois do último chunk já confirmado pelo receptor (tabela sem PK recomeça do chunk 0).
+        'trava' (um lock) é segurado enquanto o snapshot é aberto e 'ao_iniciar' é chamado
+        logo em seguida, para o chamador anotar a posição do snapshot (ex.: seq do log); se ele
+        retornar False o 'retomar' é ignorado e o dump recomeça do primeiro banco.
+        """
+        ignore_dbs = ['information_schema', 'mysql', 'performance_schema', 'sys']
+        ponto = (retomar["database"], retomar["table"] or "") if retomar else None
+
+        with self.pool.conexao() as conn:
+            meta = conn.connection.cursor(buffered=True)
+            try:
+                with trava or nullcontext():
+                    conn.connection.start_transaction(consistent_snapshot=True, readonly=True)
+                    if ao_iniciar and ao_iniciar() is False: ponto = retomar = None
+                meta.execute("SHOW DATABASES")
+                bancos = sorted(row[0] for row in meta.fetchall() if row[0] not in ignore_dbs)
+
+                for db_name in bancos:
+                    meta.execute(f"SHOW TABLES FROM `{db_name}`")
+                    tabelas = sorted(row[0] for row in meta.fetchall())
+
+                    if not tabelas:
+                        if ponto is None or (db_name, "") > ponto:
+                            yield {"database": db_name, "table": None, "chunk": 0, "schema": None,
+                                   "colunas": [], "linhas": [], "ultimo": True}
+                        continue
+
+                    for table in tabelas:
+                        inicio, apos = 0, None
+                        if ponto is not None:
+                            if (db_name, table) < ponto: continue
+                            if (db_name, table) == ponto:
+                                if retomar.get("ultimo"): continue
+                                inicio, apos = retomar["chunk"] + 1, retomar.get("ate")
+                        yield from self._iterar_tabela(conn, meta, db_name, table, tamanho_chunk, inicio, apos)
+
+                conn.connection.commit()
+            finally:
+                if conn.connection.in_transaction:
+                    try: conn.connection.rollback()
+                    except mysql.connector.Error: conn.invalida = True
+                meta.close()
+
+    def _iterar_tabela(self, conn, meta, db_name, table, tamanho_chunk, inicio, apos=None):
+        """
+        Chunks de uma tabela em ordem de PK, a partir da linha seguinte à PK 'apos'. Posição por
+        chave e não por OFFSET: linhas inseridas ou apagadas antes da retomada não deslocam nada.
+        """
+        meta.execute(f"SHOW KEYS FROM `{db_name}`.`{table}` WHERE Key_name = 'PRIMARY'")
+        pk = [c.decode() if isinstance(c, (bytes, bytearray)) else c
+              for c in (linha[4] for linha in sorted(meta.fetchall(), key=lambda linha: linha[3]))]
+        if inicio and (not pk or apos is None):
+            inicio, apos = 0, None  # Sem PK não há como achar o ponto: a tabela é recriada do começo
+
+        schema = None
+        if inicio == 0:
+            meta.execute(f"SHOW CREATE TABLE `{db_name}`.`{table}`")
+            schema = meta.fetchone()[1]
+
+        sql, params = f"SELECT * FROM `{db_name}`.`{table}`", ()
+        if pk:
+            colunas_pk = ", ".join(f"`{c}`" for c in pk)
+            if apos is not None:
+                sql += f" WHERE ({colunas_pk}) > ({', '.join(['%s'] * len(pk))})"
+                params = tuple(apos)
+            sql += f" ORDER BY {colunas_pk}"
+
+        cursor = conn.connection.cursor(buffered=False)
+        try:
+            cursor.execute(sql, params or None)
+            colunas = list(cursor.column_names)
+            posicoes_pk = [colunas.index(c) for c in pk]
+            chunk = inicio
+            while True:
+                lido_em = time.perf_counter()
+                linhas = cursor.fetchmany(tamanho_chunk)
+                ultimo = len(linhas) < tamanho_chunk
+                linhas = [[self._serializar_valor(v) for v in linha] for linha in linhas]
+                self.metricas.contador("dump_linhas").somar(len(linhas))
+                self.metricas.contador("dump_segundos").somar(time.perf_counter() - lido_em)
+                ate = [linhas[-1][i] for i in posicoes_pk] if pk and linhas else None
+                yield {"database": db_name, "table": table, "chunk": chunk, "schema": schema,
+                       "colunas": colunas, "ultimo": ultimo, "linhas": linhas, "ate": ate}
+                if ultimo: break
+                schema = None
+                chunk += 1
+        finally:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                # Gerador fechado no meio da tabela: sobrou resultado não lido na conexão
+                conn.invalida = True
+
+    def get_full_dump(self, workers=DUMP_WORKERS, linhas_faixa=DUMP_LINHAS_FAIXA, trava=None):
+        """
+        Gera um dump completo de todos os bancos, lendo tabelas em paralelo.
+        Cada worker usa uma conexão separada (fora do pool, para não disputar com as queries)
+        com uma transação de snapshot consistente; todas são abertas com 'trava' segurada,
+        então enxergam o mesmo ponto do banco. Tabelas grandes com PK inteira são lidas
+        em faixas da PK. O andamento por tabela fica em progresso_dump().
         """
         dump = {}
-        connector = None
-        
-        print("\n[DUMP START] --- Iniciando Varredura Completa ---")
+        conexoes = []
+        inicio = time.perf_counter()
+        with self.lock_progresso: self.progresso = {}
+
+        log.info("[DUMP START] --- Iniciando Varredura Completa (%d workers) ---", workers)
+        try:
+            conexoes = [mysql.connector.connect(**self.config) for _ in range(max(1, workers))]
+            with trava or nullcontext():
+                for connector in conexoes:
+                    connector.start_transaction(consistent_snapshot=True, readonly=True)
+
+            tarefas = self._planejar_dump(conexoes[0], linhas_faixa, dump)
+            livres = queue.Queue()
+            for connector in conexoes: livres.put(connector)
+            with ThreadPoolExecutor(max_workers=len(conexoes), thread_name_prefix="dump") as executor:
+                partes = [executor.submit(self._ler_faixa, livres, *tarefa) for tarefa in tarefas]
+                # Faixas de uma tabela saem na ordem da PK
+                for tarefa, parte in zip(tarefas, partes):
+                    dump[f"{tarefa[0]}.{tarefa[1]}"]["rows"].extend(parte.result())
+
+            for connector in conexoes: connector.commit()
+            log.info("[DUMP END] --- Varredura Finalizada: %d tabelas em %.2fs ---",
+                     len(self.progresso), time.perf_counter() - inicio)
+            return dump
+
+        except Exception as e:
+            log.error("[DUMP CRITICAL] Erro ao gerar dump: %s", e)
+            return {}
+        finally:
+            for connector in conexoes:
+                try: connector.close()
+                except Exception: pass
+
+    def _planejar_dump(self, connector, linhas_faixa, dump):
+        """Schemas e lista de (banco, tabela, faixa, pk) a ler; preenche 'dump' com as tabelas vazias de linhas."""
+        ignore_dbs = ['information_schema', 'mysql', 'performance_schema', 'sys']
+        cursor = connector.cursor(buffered=True)
+        tarefas = []
         try:
-            connector = mysql.connector.connect(**self.config)
-            cursor = connector.cursor(dictionary=True, buffered=True)
-            
-            # Pega lista de bancos
             cursor.execute("SHOW DATABASES")
-            all_dbs = [list(row.values())[0] for row in cursor.fetchall()]
-            
-            ignore_dbs = ['information_schema', 'mysql', 'performance_schema', 'sys']
-
-            for db_name in all_dbs:
-                if db_name in ignore_dbs: continue
-
-                print(f"[DUMP SCAN] Analisando Banco: '{db_name}'")
-                
-                # Troca de contexto
-                cursor.execute(f"USE {db_name}")
-                
-                # Lista tabelas
-                cursor.execute("SHOW TABLES")
-                tables = cursor.fetchall()
-                
+            for db_name in [row[0] for row in cursor.fetchall() if row[0] not in ignore_dbs]:
+                cursor.execute(f"SHOW TABLES FROM `{db_name}`")
+                table_names = [row[0] for row in cursor.fetchall()]
+
                 # Caso: Banco Vazio
-                if not tables:
-                    print(f"   -> [DUMP] Banco vazio encontrado.")
-                    key = f"{db_name}.__EMPTY_DB__"
-                    dump[key] = {
-                        "database": db_name,
-                        "table": None, "schema": None, "rows": []
-                    }
+                if not table_names:
+                    log.info("   -> [DUMP] Banco vazio encontrado: '%s'", db_name)
+                    dump[f"{db_name}.__EMPTY_DB__"] = {"database": db_name, "table": None, "schema": None, "rows": []}
                     continue
 
-                # Caso: Banco com Tabelas
-                table_names = [list(t.values())[0] for t in tables]
-                print(f"   -> [DUMP] Tabelas encontradas: {table_names}")
-
+                log.info("[DUMP SCAN] Banco '%s': tabelas %s", db_name, table_names)
                 for table in table_names:
-                    # Schema
-                    cursor.execute(f"SHOW CREATE TABLE {table}")
+                    cursor.execute(f"SHOW CREATE TABLE `{db_name}`.`{table}`")
                     row = cursor.fetchone()
-                    create_sql = list(row.values())[1] if row else ""
-
-                    # Dados
-                    cursor.execute(f"SELECT * FROM {table}")
-                    rows = cursor.fetchall()
-                    
-                    # Serialização
-                    serialized_rows = []
-                    for r in rows:
-                        new_row = {}
-                        for k, v in r.items():
-                            if v is None: new_row[k] = None
-                            elif isinstance(v, (int, float, bool)): new_row[k] = v
-                            else: new_row[k] = str(v)
-                        serialized_rows.append(new_row)
-                    
-                    print(f"      -> Tabela '{table}': {len(serialized_rows)} registros exportados.")
-                    
-                    key = f"{db_name}.{table}"
-                    dump[key] = {
-                        "database": db_name,
-                        "table": table,
-                        "schema": create_sql,
-                        "rows": serialized_rows
-                    }
-
-            print("[DUMP END] --- Varredura Finalizada ---\n")
-            return dump
+                    dump[f"{db_name}.{table}"] = {"database": db_name, "table": table,
+                                                  "schema": row[1] if row else "", "rows": []}
+                    pk, faixas = self._faixas_pk(cursor, db_name, table, linhas_faixa)
+                    with self.lock_progresso:
+                        self.progresso[f"{db_name}.{table}"] = {"status": "pendente", "linhas": 0, "faixas": len(faixas),
+                                                                 "faixas_lidas": 0, "segundos": 0.0, "inicio": None}
+                    tarefas.extend((db_name, table, faixa, pk) for faixa in faixas)
+        finally:
+            cursor.close()
+        return tarefas
 
-        except Exception as e:
-            print(f"[DUMP CRITICAL] Erro ao gerar dump: {e}")
-            return {}
+    @staticmethod
+    def _pk_inteira(cursor, db_name, table):
+        """Coluna da PK se ela for uma coluna só, de tipo inteiro (dá para dividir em faixas); senão None."""
+        cursor.execute(f"SHOW KEYS FROM `{db_name}`.`{table}` WHERE Key_name = 'PRIMARY'")
+        chaves = cursor.fetchall()
+        if len(chaves) != 1: return None
+        pk = chaves[0][4]
+        if isinstance(pk, (bytes, bytearray)): pk = pk.decode()
+        cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS"
+                       " WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s", (db_name, table, pk))
+        tipo = (cursor.fetchone() or (None,))[0]
+        if isinstance(tipo, (bytes, bytearray)): tipo = tipo.decode()
+        return pk if tipo and str(tipo).lower().endswith("int") else None
+
+    def _faixas_pk(self, cursor, db_name, table, linhas_faixa):
+        """(coluna da PK, faixas [de, até)) ; tabela pequena ou sem PK inteira de uma coluna = uma faixa só."""
+        pk = self._pk_inteira(cursor, db_name, table)
+        if pk is None: return None, [None]
+        cursor.execute("SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+                       (db_name, table))
+        estimativa = (cursor.fetchone() or (0,))[0] or 0
+        if estimativa <= linhas_faixa: return pk, [None]
+        cursor.execute(f"SELECT MIN(`{pk}`), MAX(`{pk}`) FROM `{db_name}`.`{table}`")
+        menor, maior = cursor.fetchone()
+        if menor is None: return pk, [None]
+        n = min(DUMP_MAX_FAIXAS, -(-estimativa // linhas_faixa))
+        passo = max(1, -(-(maior - menor + 1) // n))
+        limites = list(range(menor + passo, maior + 1, passo))
+        # Pontas abertas: nada fica de fora mesmo se a estimativa estiver velha
+        return pk, list(zip([None] + limites, limites + [None]))
+
+    def _ler_faixa(self, livres, db_name, table, faixa, pk):
+        chave = f"{db_name}.{table}"
+        with self.lock_progresso:
+            prog = self.progresso[chave]
+            if prog["inicio"] is None: prog.update(status="lendo", inicio=time.time())
+        filtro, params = self._filtro_faixa(pk, *(faixa or (None, None)))
+        sql = f"SELECT * FROM `{db_name}`.`{table}`{filtro}"
+        inicio = time.perf_counter()
+
+        connector = livres.get()
+        cursor = connector.cursor(buffered=False)
+        try:
+            cursor.execute(sql, params or None)
+            colunas = cursor.column_names
+            serializar = self._serializar_valor
+            linhas = [dict(zip(colunas, map(serializar, linha))) for linha in cursor.fetchall()]
+        except Exception:
+            with self.lock_progresso: prog["status"] = "erro"
+            raise
         finally:
-            if connector and connector.is_connected():
+            cursor.close()
+            livres.put(connector)
+
+        self.metricas.contador("dump_linhas", "Linhas lidas para dumps completos").somar(len(linhas))
+        self.metricas.contador("dump_segundos", "Tempo gasto lendo essas linhas (somado entre as conexões)").somar(time.perf_counter() - inicio)
+        with self.lock_progresso:
+            prog["linhas"] += len(linhas)
+            prog["faixas_lidas"] += 1
+            prog["segundos"] = round(time.time() - prog["inicio"], 3)
+            if prog["faixas_lidas"] == prog["faixas"]:
+                prog["status"] = "ok"
+                log.info("      -> Tabela '%s': %d registros exportados em %.2fs (%d faixas).",
+                         chave, prog["linhas"], prog["segundos"], prog["faixas"])
+        return linhas
+
+    @staticmethod
+    def _filtro_faixa(pk, de, ate):
+        """WHERE de uma faixa [de, ate) da PK; ponta None = aberta."""
+        condicoes, params = [], []
+        if de is not None: condicoes.append(f"`{pk}` >= %s"); params.append(de)
+        if ate is not None: condicoes.append(f"`{pk}` < %s"); params.append(ate)
+        return (" WHERE " + " AND ".join(condicoes) if condicoes else ""), params
+
+    def progresso_dump(self):
+        """Andamento do último dump completo, por tabela."""
+        with self.lock_progresso:
+            return {t: {k: v for k, v in p.items() if k != "inicio"} for t, p in self.progresso.items()}
+
+    # --------- Anti-entropia -----------
+    def tabelas_verificaveis(self):
+        """{"banco.tabela": [banco, tabela, pk inteira ou None, colunas, menor pk, maior pk]} dos bancos de usuário."""
+        ignore_dbs = ['information_schema', 'mysql', 'performance_schema', 'sys']
+        tabelas = {}
+        with self.pool.conexao() as conn:
+            cursor = conn.connection.cursor(buffered=True)
+            try:
+                cursor.execute("SHOW DATABASES")
+                for db_name in [row[0] for row in cursor.fetchall() if row[0] not in ignore_dbs]:
+                    cursor.execute(f"SHOW TABLES FROM `{db_name}`")
+                    for table in [row[0] for row in cursor.fetchall()]:
+                        cursor.execute(f"SHOW COLUMNS FROM `{db_name}`.`{table}`")
+                        colunas = [row[0] for row in cursor.fetchall()]
+                        pk = self._pk_inteira(cursor, db_name, table)
+                        menor = maior = None
+                        if pk:
+                            cursor.execute(f"SELECT MIN(`{pk}`), MAX(`{pk}`) FROM `{db_name}`.`{table}`")
+                            menor, maior = cursor.fetchone()
+                        tabelas[f"{db_name}.{table}"] = [db_name, table, pk, colunas, menor, maior]
+            finally:
+                cursor.close()
+        return tabelas
+
+    def hash_faixas(self, db_name, table, pk, colunas, de, ate, largura):
+        """
+        [[balde, linhas, hash]] da faixa [de, ate) da PK dividida em baldes de 'largura' valores.
+        O hash de um balde é o XOR do CRC32 de cada linha, calculado no próprio MySQL:
+        só os resumos saem do banco. Sem PK inteira a tabela inteira é um balde só.
+        """
+        linha = ", ".join([f"`{c}`" for c in colunas] + [f"ISNULL(`{c}`)" for c in colunas])
+        soma = f"COUNT(*), BIT_XOR(CRC32(CONCAT_WS('#', {linha})))"
+        if pk is None:
+            sql, params = f"SELECT 0, {soma} FROM `{db_name}`.`{table}`", []
+        else:
+            filtro, params = self._filtro_faixa(pk, de, ate)
+            sql = (f"SELECT (CAST(`{pk}` AS SIGNED) - %s) DIV %s AS balde, {soma}"
+                   f" FROM `{db_name}`.`{table}`{filtro} GROUP BY balde")
+            params = [de, largura] + params
+        with self.pool.conexao() as conn:
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute(sql, params or None)
+                return [[int(b), int(n), int(h or 0)] for b, n, h in cursor.fetchall() if n]
+            finally:
+                cursor.close()
+
+    def ler_faixa(self, db_name, table, pk, de, ate, trava=None, ao_iniciar=None):
+        """
+        (colunas, linhas) da faixa em ordem de PK, num snapshot aberto com 'trava' segurada
+        ('ao_iniciar' anota a posição do log correspondente, como em iterar_dump).
+        """
+        filtro, params = self._filtro_faixa(pk, de, ate) if pk else ("", [])
+        ordem = f" ORDER BY `{pk}`" if pk else ""
+        with self.pool.conexao() as conn:
+            cursor = conn.connection.cursor()
+            try:
+                with trava or nullcontext():
+                    conn.connection.start_transaction(consistent_snapshot=True, readonly=True)
+                    if ao_iniciar: ao_iniciar()
+                cursor.execute(f"SELECT * FROM `{db_name}`.`{table}`{filtro}{ordem}", params or None)
+                colunas = list(cursor.column_names)
+                linhas = [[self._serializar_valor(v) for v in linha] for linha in cursor.fetchall()]
+                conn.connection.commit()
+                return colunas, linhas
+            finally:
+                if conn.connection.in_transaction:
+                    try: conn.connection.rollback()
+                    except mysql.connector.Error: conn.invalida = True
+                cursor.close()
+
+    def substituir_faixa(self, db_name, table, pk, de, ate, colunas, linhas, tamanho_lote=1000):
+        """Troca o conteúdo da faixa (ou da tabela, sem PK inteira) pelas linhas dadas, numa transação."""
+        filtro, params = self._filtro_faixa(pk, de, ate) if pk else ("", [])
+        with self.pool.conexao() as conn:
+            cursor = conn.connection.cursor()
+            try:
+                self._preparar_sessao(conn, cursor, db_name)
+                conn.connection.start_transaction()
+                cursor.execute(f"DELETE FROM `{table}`{filtro}", params or None)
+                if linhas: self._inserir_em_lotes(cursor, table, colunas, [tuple(l) for l in linhas], tamanho_lote)
+                conn.connection.commit()
+                return len(linhas)
+            except mysql.connector.Error:
+                try: conn.connection.rollback()
+                except mysql.connector.Error: pass
+                raise
+            finally:
                 cursor.close()
-                connector.close()
@@ -0,0 +1,131 @@
+import os
+import math
+import time
+import random
+import threading
+from collections import deque
+
+INTERVALO_GOSSIP = float(os.environ.get("DDB_INTERVALO_GOSSIP", 0.1)) # Segundos entre rodadas de gossip
+FANOUT_GOSSIP = int(os.environ.get("DDB_FANOUT_GOSSIP", 2))   # Peers sorteados por rodada
+LIMIAR_PHI = float(os.environ.get("DDB_LIMIAR_PHI", 8.0))     # phi acima disso = nó suspeito
+PAUSA_ACEITAVEL = float(os.environ.get("DDB_PAUSA_ACEITAVEL", 0.3)) # Folga para pausas (GC, pico de carga)
+CHANCE_SUSPEITO = 0.1  # Por rodada, de também mandar gossip a um nó suspeito
+JANELA_AMOSTRAS = 100
+DESVIO_MINIMO = 0.05
+
+
+class DetectorFalhas:
+    """
+    Detector phi-accrual alimentado por gossip de contadores de batimento.
+    Cada nó incrementa o próprio contador a cada rodada e manda a sua visão (contador e
+    informações de cada nó) a alguns peers sorteados; quem recebe fica com o maior contador
+    de cada nó. Um contador que sobe conta como batimento recebido, não importa por qual
+    peer chegou, então um Master vivo mas com um link lento não é dado como morto.
+    O contador vem com a geração do processo (instante em que ele subiu): um nó reiniciado
+    recomeça do zero numa geração maior e os pares (geração, contador) continuam crescendo.
+    phi cresce com o tempo desde o último batimento, medido contra a distribuição dos
+    intervalos já observados: picos de carga alargam a distribuição em vez de derrubar o nó.
+    """
+    def __init__(self, meu_id, nos, intervalo=INTERVALO_GOSSIP, limiar=LIMIAR_PHI, pausa=PAUSA_ACEITAVEL):
+        self.meu_id = meu_id
+        self.intervalo = intervalo
+        self.limiar = limiar
+        self.pausa = pausa
+        self.lock = threading.Lock()
+        self.geracao = time.time_ns() // 1000  # µs desde a época: cada reinício ganha uma geração maior
+        self.batimentos = {meu_id: (self.geracao, 0)}  # nó -> (geração, contador)
+        self.info = {meu_id: {}}
+        self.chegadas = {}   # nó -> monotonic do último batimento
+        self.intervalos = {} # nó -> deque dos últimos intervalos entre batimentos
+        for no in nos:
+            if no != meu_id: self.reiniciar(no)
+
+    def reiniciar(self, no):
+        """Começa a vigiar 'no' agora, como se um batimento tivesse acabado de chegar."""
+        with self.lock:
+            self.chegadas[no] = time.monotonic()
+            self.intervalos[no] = deque([self.intervalo], maxlen=JANELA_AMOSTRAS)
+
+    def esquecer(self, no):
+        """Nó saiu do cluster: para de ser vigiado."""
+        with self.lock:
+            for estado in (self.chegadas, self.intervalos, self.batimentos, self.info): estado.pop(no, None)
+
+    def bater(self, info):
+        """Uma rodada: incrementa o próprio contador; retorna a visão a difundir."""
+        with self.lock:
+            geracao, contador = self.batimentos[self.meu_id]
+            self.batimentos[self.meu_id] = (geracao, contador + 1)
+            self.info[self.meu_id] = info
+            return {no: {"geracao": g, "batimento": b, "info": self.info.get(no, {})} for no, (g, b) in self.batimentos.items()}
+
+    def alvos(self, peers):
+        """Peers desta rodada; suspeitos só de vez em quando (para notarem que voltamos, sem encher o log)."""
+        vivos = [p for p in peers if not self.suspeito(p)]
+        escolhidos = random.sample(vivos, min(FANOUT_GOSSIP, len(vivos)))
+        suspeitos = [p for p in peers if p not in vivos]
+        if suspeitos and random.random() < CHANCE_SUSPEITO: escolhidos.append(random.choice(suspeitos))
+        return escolhidos
+
+    def mesclar(self, visao):
+        """Visão recebida de um peer; retorna os nós com batimento novo."""
+        agora = time.monotonic()
+        novos = []
+        with self.lock:
+            for no, estado in visao.items():
+                recebido = (estado.get("geracao", 0), estado["batimento"])
+                anterior = self.batimentos.get(no)
+                if no == self.meu_id or (anterior is not None and recebido <= anterior): continue
+                self.batimentos[no] = recebido
+                self.info[no] = estado.get("info", {})
+                if anterior is not None and recebido[0] != anterior[0]:
+                    # Reiniciou: o tempo parado não entra na distribuição dos intervalos
+                    self.intervalos[no] = deque([self.intervalo], maxlen=JANELA_AMOSTRAS)
+                elif no in self.chegadas:
+                    self.intervalos[no].append(agora - self.chegadas[no])
+                else:
+                    self.intervalos[no] = deque([self.intervalo], maxlen=JANELA_AMOSTRAS)
+                self.chegadas[no] = agora
+                novos.append(no)
+        return novos
+
+    def phi(self, no, agora=None):
+        with self.lock:
+            if no not in self.chegadas: return 0.0
+            decorrido = (agora or time.monotonic()) - self.chegadas[no]
+            amostras = self.intervalos[no]
+            media = sum(amostras) / len(amostras)
+            desvio = max(DESVIO_MINIMO, math.sqrt(sum((a - media) ** 2 for a in amostras) / len(amostras)))
+        media += self.pausa
+        # Aproximação logística da CDF normal (a mesma do Akka/Cassandra)
+        y = (decorrido - media) / desvio
+        e = max(1e-99, math.exp(-y * (1.5976 + 0.070566 * y * y)))
+        if decorrido > media: return -math.log10(e / (1.0 + e))
+        return max(0.0, -math.log10(1.0 - 1.0 / (1.0 + e)))
+
+    def suspeito(self, no):
+        return self.phi(no) > self.limiar
+
+    def coordenadores(self):
+        """Master apontado por cada nó não suspeito, segundo o último gossip dele."""
+        with self.lock:
+            nos = [no for no, info in self.info.items() if no != self.meu_id and "coordenador" in info]
+        return {no: self.info[no]["coordenador"] for no in nos if not self.suspeito(no)}
+
+    def batimento(self, no):
+        """[geração, contador] do último batimento de 'no' (lista: vai no gossip), ou None."""
+        with self.lock:
+            b = self.batimentos.get(no)
+            return list(b) if b else None
+
+    def info_de(self, no):
+        with self.lock:
+            return dict(self.info.get(no, {}))
+
+    def resumo(self):
+        agora = time.monotonic()
+        with self.lock:
+            nos = list(self.chegadas)
+        return {no: {"phi": round(self.phi(no, agora), 2), "suspeito": self.phi(no, agora) > self.limiar,
+                     "batimento": self.batimento(no), "ultimo_s": round(agora - self.chegadas[no], 3)}
+                for no in nos}
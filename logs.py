@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from contextlib import contextmanager
+
+# Configuração por ambiente (padrão = produção: INFO, sem debug)
+NIVEL_PADRAO = os.environ.get("DDB_LOG_LEVEL", "INFO").upper()
+AMOSTRA_DEBUG = float(os.environ.get("DDB_LOG_AMOSTRA", "1.0"))  # fração das mensagens DEBUG emitidas
+ARQUIVO_LOG = os.environ.get("DDB_LOG_ARQUIVO")
+FORMATO_JSON = os.environ.get("DDB_LOG_JSON", "0") == "1"
+
+_listener = None
+
+
+class FiltroAmostragem(logging.Filter):
+    """Deixa passar só uma fração das mensagens DEBUG; os demais níveis passam sempre."""
+    def __init__(self, taxa):
+        super().__init__()
+        self.taxa = taxa
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.taxa >= 1.0 or random.random() < self.taxa
+
+
+class FormatadorEstruturado(logging.Formatter):
+    """Texto legível com os campos estruturados em k=v no final, ou uma linha JSON por evento."""
+    def __init__(self, formato_json=False):
+        super().__init__()
+        self.formato_json = formato_json
+
+    def format(self, record):
+        dados = getattr(record, "campos", None) or {}
+        if self.formato_json:
+            evento = {"ts": round(record.created, 6), "nivel": record.levelname,
+                      "logger": record.name, "msg": record.getMessage()}
+            evento.update(dados)
+            return json.dumps(evento, default=str)
+        linha = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname[0]} {record.getMessage()}"
+        if dados:
+            linha += " | " + " ".join(f"{k}={v}" for k, v in dados.items())
+        if record.exc_info:
+            linha += "\n" + self.formatException(record.exc_info)
+        return linha
+
+
+def configurar(nivel=NIVEL_PADRAO, arquivo=ARQUIVO_LOG, formato_json=FORMATO_JSON, amostra_debug=AMOSTRA_DEBUG):
+    """
+    Instala os sinks do logger 'ddb'. As threads de trabalho só enfileiram o registro
+    (QueueHandler); a escrita em stdout/arquivo acontece na thread do QueueListener.
+    """
+    global _listener
+    raiz = logging.getLogger("ddb")
+    if _listener is not None: _listener.stop()
+    raiz.handlers.clear()
+    raiz.setLevel(nivel)
+    raiz.propagate = False
+
+    formatador = FormatadorEstruturado(formato_json)
+    sinks = [logging.StreamHandler(sys.stdout)]
+    if arquivo: sinks.append(logging.FileHandler(arquivo, encoding="utf-8"))
+    for sink in sinks: sink.setFormatter(formatador)
+
+    fila = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(fila)
+    handler.addFilter(FiltroAmostragem(amostra_debug))
+    raiz.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(fila, *sinks, respect_handler_level=False)
+    _listener.start()
+    return raiz
+
+
+def get_logger(nome):
+    if _listener is None: configurar()
+    return logging.getLogger(f"ddb.{nome}")
+
+
+def campos(**kwargs):
+    """Atalho para extra=...: log.info("msg", extra=campos(sql=sql, linhas=n))"""
+    return {"campos": kwargs}
+
+
+@contextmanager
+def span(logger, nome, **dados):
+    """
+    Trecho cronometrado, emitido em DEBUG com a duração.
+    Com DEBUG desligado não mede nada (só o teste de nível).
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        yield dados
+        return
+    inicio = time.perf_counter()
+    try:
+        yield dados
+    finally:
+        dados["duracao_ms"] = round((time.perf_counter() - inicio) * 1000, 3)
+        logger.debug(f"[TRACE] {nome}", extra={"campos": dados})
+
+
+@atexit.register
+def _encerrar():
+    if _listener is not None: _listener.stop()
@@ -0,0 +1,158 @@
+import os
+import json
+import threading
+from logs import get_logger
+
+log = get_logger("membros")
+
+# Sem DDB_NOS nem arquivo de configuração: os três nós locais de desenvolvimento
+CONFIG_PADRAO = {
+    "1": {"ip": "localhost", "porta": 5001, "db_host": "localhost"},
+    "2": {"ip": "localhost", "porta": 5002, "db_host": "localhost"},
+    "3": {"ip": "localhost", "porta": 5003, "db_host": "localhost"},
+}
+ARQUIVO_CONFIG = os.environ.get("DDB_MEMBROS", "membros.json")
+
+
+def _ler_lista(texto):
+    """'1=host:porta[/db_host],2=...' -> {id: {"ip", "porta", "db_host"}}"""
+    nos = {}
+    for item in texto.split(","):
+        if not item.strip(): continue
+        nid, endereco = item.strip().split("=", 1)
+        endereco, _, db_host = endereco.partition("/")
+        ip, porta = endereco.rsplit(":", 1)
+        nos[nid.strip()] = {"ip": ip, "porta": int(porta), "db_host": db_host or ip}
+    return nos
+
+
+def carregar_config(arquivo=ARQUIVO_CONFIG):
+    """
+    Nós iniciais do cluster (os votantes): DDB_NOS="1=host:porta/db_host,..." ou o arquivo JSON
+    {"1": {"ip": ..., "porta": ..., "db_host": ...}, ...}; sem nenhum dos dois, CONFIG_PADRAO.
+    """
+    texto = os.environ.get("DDB_NOS")
+    if texto: return _ler_lista(texto)
+    if os.path.exists(arquivo):
+        with open(arquivo, encoding="utf-8") as f:
+            nos = json.load(f)
+        return {str(nid): {"ip": info["ip"], "porta": int(info["porta"]), "db_host": info.get("db_host", info["ip"])}
+                for nid, info in nos.items()}
+    return {nid: dict(info) for nid, info in CONFIG_PADRAO.items()}
+
+
+def versao_de(v):
+    """(termo, n) de uma versão de visão vinda da rede ou do disco; inteiro (formato antigo) = termo 0."""
+    if isinstance(v, (list, tuple)): return tuple(v)
+    return (0, v or 0)
+
+
+def enderecos(config):
+    """Lista de {"ip", "porta"} para os clientes."""
+    return [{"ip": info["ip"], "porta": info["porta"]} for info in config.values()]
+
+
+class Membros:
+    """
+    Visão de membros do cluster: {id: {"ip", "porta", "db_host", "votante"}} com uma versão.
+    Os votantes são os da configuração (eleição e lease contam só eles, então a maioria não
+    muda com o cluster no ar); quem entra com JOIN vira réplica de leitura. Só o Master muda
+    a visão; os outros ficam com a de maior versão que receberem. A versão é (termo, n), com o
+    termo do Master que a publicou: depois de uma troca de Master, duas visões nunca empatam. Persistida: um nó reiniciado
+    não esquece as réplicas que entraram depois da configuração.
+    """
+    def __init__(self, config, arquivo=None):
+        self.arquivo = arquivo
+        self.lock = threading.Lock()
+        self.versao = (0, 0)
+        self.votantes_config = {nid: dict(info, votante=True) for nid, info in config.items()}
+        self.nos = dict(self.votantes_config)
+        if arquivo and os.path.exists(arquivo):
+            try:
+                with open(arquivo, encoding="utf-8") as f:
+                    self._substituir(json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                log.warning("[MEMBROS] %s ilegível (%s); ficando com a configuração.", arquivo, e)
+
+    def _substituir(self, visao):
+        """Votantes sempre da configuração local; réplicas da visão recebida."""
+        self.versao = versao_de(visao["versao"])
+        replicas = {nid: dict(info, votante=False) for nid, info in visao["nos"].items()
+                    if nid not in self.votantes_config}
+        self.nos = dict(self.votantes_config, **replicas)
+
+    def _gravar(self):
+        if not self.arquivo: return
+        os.makedirs(os.path.dirname(self.arquivo) or ".", exist_ok=True)
+        temporario = self.arquivo + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump({"versao": list(self.versao), "nos": self.nos}, f)
+        os.replace(temporario, self.arquivo)
+
+    def get(self, nid):
+        with self.lock:
+            return self.nos.get(nid)
+
+    def __contains__(self, nid):
+        with self.lock:
+            return nid in self.nos
+
+    def ids(self):
+        with self.lock:
+            return list(self.nos)
+
+    def peers(self, meu_id):
+        with self.lock:
+            return [nid for nid in self.nos if nid != meu_id]
+
+    def votantes(self):
+        with self.lock:
+            return [nid for nid, info in self.nos.items() if info["votante"]]
+
+    def eh_votante(self, nid):
+        with self.lock:
+            return nid in self.nos and self.nos[nid]["votante"]
+
+    def visao(self):
+        with self.lock:
+            return {"versao": list(self.versao), "nos": {nid: dict(info) for nid, info in self.nos.items()}}
+
+    def _proxima_versao(self, termo):
+        termo_atual, n = self.versao
+        self.versao = (termo, 1) if termo > termo_atual else (termo_atual, n + 1)
+
+    def entrar(self, nid, endereco, termo):
+        """Master (no 'termo'): JOIN. Retorna True se a visão mudou (nó novo ou endereço novo)."""
+        info = {"ip": endereco["ip"], "porta": int(endereco["porta"]), "db_host": endereco.get("db_host", endereco["ip"])}
+        with self.lock:
+            atual = self.nos.get(nid)
+            if atual and {k: atual[k] for k in info} == info: return False
+            if nid in self.votantes_config and atual:
+                raise ValueError(f"Nó {nid} é votante: o endereço vem da configuração")
+            self.nos[nid] = dict(info, votante=False)
+            self._proxima_versao(termo)
+            self._gravar()
+            return True
+
+    def sair(self, nid, termo):
+        """Master (no 'termo'): LEAVE. Votantes não saem com o cluster no ar (mudaria a maioria)."""
+        with self.lock:
+            if nid not in self.nos: return False
+            if self.nos[nid]["votante"]:
+                raise ValueError(f"Nó {nid} é votante: só sai mudando a configuração")
+            del self.nos[nid]
+            self._proxima_versao(termo)
+            self._gravar()
+            return True
+
+    def aplicar(self, visao):
+        """
+        Visão vinda do Master (ou de um peer mais atualizado): (novos ou com endereço novo, removidos),
+        ou None se é velha.
+        """
+        with self.lock:
+            if versao_de(visao.get("versao")) <= self.versao: return None
+            antes = self.nos
+            self._substituir(visao)
+            self._gravar()
+            return sorted(nid for nid, info in self.nos.items() if antes.get(nid) != info), sorted(set(antes) - set(self.nos))
@@ -0,0 +1,206 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Histograma:
+    """Histograma de latência com buckets fixos em ms (contagens cumulativas, como no Prometheus)."""
+    LIMITES_PADRAO = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self, limites=LIMITES_PADRAO):
+        self.limites = tuple(limites)
+        self.contagens = [0] * (len(self.limites) + 1)  # último = acima do maior limite
+        self.soma = 0.0
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def observar(self, valor_ms):
+        i = bisect.bisect_left(self.limites, valor_ms)
+        with self.lock:
+            self.contagens[i] += 1
+            self.soma += valor_ms
+            self.total += 1
+
+    def percentil(self, p):
+        """Estimativa pelo limite superior do bucket onde cai o percentil p (0-100)."""
+        with self.lock:
+            if not self.total: return 0.0
+            alvo = self.total * p / 100.0
+            acumulado = 0
+            for i, n in enumerate(self.contagens):
+                acumulado += n
+                if acumulado >= alvo:
+                    return self.limites[i] if i < len(self.limites) else float("inf")
+        return float("inf")
+
+    def buckets(self):
+        """[(limite, contagem cumulativa), ...] terminando em ('+Inf', total)."""
+        with self.lock:
+            acumulado, saida = 0, []
+            for limite, n in zip(self.limites, self.contagens):
+                acumulado += n
+                saida.append((limite, acumulado))
+            saida.append(("+Inf", self.total))
+            return saida
+
+    def resumo(self):
+        return {
+            "total": self.total,
+            "media_ms": round(self.soma / self.total, 3) if self.total else 0.0,
+            "p50_ms": self.percentil(50),
+            "p95_ms": self.percentil(95),
+            "p99_ms": self.percentil(99),
+        }
+
+
+class Contador:
+    """Valor que só cresce (mensagens, bytes, linhas)."""
+
+    def __init__(self):
+        self.valor = 0
+        self.lock = threading.Lock()
+
+    def somar(self, n=1):
+        with self.lock:
+            self.valor += n
+
+
+# Bytes de frames que passaram por este processo (contados no protocolo, valem para todos os nós dele)
+BYTES_RECEBIDOS = Contador()
+BYTES_ENVIADOS = Contador()
+
+
+class Metricas:
+    """
+    Registro de contadores, histogramas e medidores de um nó, por nome e rótulos.
+    Exportado como dict (mensagem STATS) ou no formato texto do Prometheus.
+    """
+    MAX_SERIES = 100  # Por nome; rótulos além disso viram "outros" (tipos de mensagem vêm da rede)
+
+    def __init__(self, prefixo="ddb"):
+        self.prefixo = prefixo
+        self.series = {}   # nome -> {rotulos (tupla ordenada): Contador | Histograma}
+        self.tipos = {}    # nome -> "counter" | "histogram"
+        self.ajudas = {}
+        self.medidores = []  # (nome, ajuda, função -> número ou {rotulos (tupla): número})
+        self.lock = threading.Lock()
+
+    def _serie(self, nome, tipo, ajuda, fabrica, rotulos):
+        chave = tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+        with self.lock:
+            series = self.series.setdefault(nome, {})
+            serie = series.get(chave)
+            if serie is None:
+                if len(series) >= self.MAX_SERIES: chave = tuple((k, "outros") for k, _ in chave)
+                serie = series.setdefault(chave, fabrica())
+                self.tipos[nome] = tipo
+            if ajuda: self.ajudas[nome] = ajuda
+            return serie
+
+    def contador(self, nome, ajuda="", **rotulos):
+        return self._serie(nome, "counter", ajuda, Contador, rotulos)
+
+    def histograma(self, nome, ajuda="", **rotulos):
+        return self._serie(nome, "histogram", ajuda, Histograma, rotulos)
+
+    def registrar(self, nome, serie, ajuda="", **rotulos):
+        """Expõe um Contador/Histograma que já existe (ex.: BYTES_ENVIADOS) sob este nome."""
+        chave = tuple(sorted((k, str(v)) for k, v in rotulos.items()))
+        with self.lock:
+            self.series.setdefault(nome, {})[chave] = serie
+            self.tipos[nome] = "histogram" if isinstance(serie, Histograma) else "counter"
+            if ajuda: self.ajudas[nome] = ajuda
+
+    def medidor(self, nome, funcao, ajuda=""):
+        """Valor lido só na hora da exportação: número, ou {(("rotulo", "valor"), ...): número}."""
+        with self.lock:
+            self.medidores.append((nome, ajuda, funcao))
+
+    @contextmanager
+    def cronometro(self, nome, ajuda="", **rotulos):
+        """Observa em ms a duração do bloco (também quando ele termina com exceção)."""
+        histograma = self.histograma(nome, ajuda, **rotulos)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            histograma.observar((time.perf_counter() - inicio) * 1000)
+
+    def _ler_medidores(self):
+        with self.lock: medidores = list(self.medidores)
+        for nome, ajuda, funcao in medidores:
+            valor = funcao()
+            if isinstance(valor, dict): yield nome, ajuda, valor
+            elif valor is not None: yield nome, ajuda, {(): valor}
+
+    def instantaneo(self):
+        """{nome: valor} ou {nome: {"rotulo=valor,...": valor}}; histogramas como Histograma.resumo()."""
+        def formatar(series, ler):
+            saida = {",".join(f"{k}={v}" for k, v in chave): ler(s) for chave, s in series.items()}
+            return saida.pop("") if list(saida) == [""] else saida
+        with self.lock:
+            copia = {nome: dict(series) for nome, series in self.series.items()}
+        saida = {nome: formatar(series, lambda s: s.resumo() if isinstance(s, Histograma) else s.valor)
+                 for nome, series in sorted(copia.items())}
+        for nome, _, valores in self._ler_medidores():
+            saida[nome] = formatar(valores, lambda v: v)
+        return saida
+
+    def prometheus(self):
+        """Formato texto de exposição do Prometheus (versão 0.0.4)."""
+        linhas = []
+        def cabecalho(nome, tipo, ajuda):
+            if ajuda: linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+        with self.lock:
+            copia = {nome: dict(series) for nome, series in self.series.items()}
+            tipos, ajudas = dict(self.tipos), dict(self.ajudas)
+        for nome, series in sorted(copia.items()):
+            # Contador: a família e as amostras têm o mesmo nome, com o sufixo _total
+            completo = f"{self.prefixo}_{nome}" + ("_total" if tipos[nome] == "counter" else "")
+            cabecalho(completo, tipos[nome], ajudas.get(nome))
+            for chave, serie in sorted(series.items()):
+                if isinstance(serie, Histograma):
+                    for limite, n in serie.buckets():
+                        linhas.append(f"{completo}_bucket{_rotulos(chave + (('le', limite),))} {n}")
+                    linhas.append(f"{completo}_sum{_rotulos(chave)} {serie.soma:.3f}")
+                    linhas.append(f"{completo}_count{_rotulos(chave)} {serie.total}")
+                else:
+                    linhas.append(f"{completo}{_rotulos(chave)} {serie.valor}")
+        for nome, ajuda, valores in self._ler_medidores():
+            completo = f"{self.prefixo}_{nome}"
+            cabecalho(completo, "gauge", ajuda)
+            for chave, valor in sorted(valores.items()):
+                linhas.append(f"{completo}{_rotulos(chave)} {float(valor) if valor is not None else 'NaN'}")
+        return "\n".join(linhas) + "\n"
+
+
+def _rotulos(chave):
+    if not chave: return ""
+    escapar = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in chave) + "}"
+
+
+def servir_prometheus(metricas, porta, host="0.0.0.0"):
+    """GET /metrics em texto do Prometheus, numa thread própria; retorna o servidor HTTP."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            corpo = metricas.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, formato, *args):
+            pass  # Um scrape a cada poucos segundos não vai para o log
+
+    servidor = ThreadingHTTPServer((host, porta), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="metricas-http").start()
+    return servidor
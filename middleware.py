@@ -1,199 +1,382 @@
 import socket
 import threading
 import json
-import hashlib
 import time
+import os
 import sys
+import argparse
+import inspect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from db_manager import DBManager
+from replicacao_log import LogReplicacao
+from pipeline_replicacao import PipelineReplicacao
+from comandos_preparados import ComandosPreparados
+from cache_resultados import CacheResultados, tabelas_leitura, tabelas_escrita
+from classificador_sql import classificar, controle_de_sessao, DDL
+from replicacao_linhas import planejar, comandos_das_linhas
+from anti_entropia import AntiEntropia
+from detector_falhas import DetectorFalhas, INTERVALO_GOSSIP
+from membros import Membros, carregar_config, versao_de
+from sharding import MapaShards, CamadaShards, carregar_shards, GRUPO
+from protocolo import ConexaoPeer, enviar_frame, receber_frame, eh_legado, checksum_legado, CHAVE_HMAC, FLAG_ACEITA_MSGPACK
+from logs import get_logger, span, configurar as configurar_logs
+from metricas import Histograma, Metricas, BYTES_RECEBIDOS, BYTES_ENVIADOS, servir_prometheus
 
-# Configuração dos hosts
-NODES_CONFIG = {
-    "1": {"ip": "localhost", "porta": 5001, "db_host": "localhost"},
-    "2": {"ip": "localhost", "porta": 5002, "db_host": "localhost"},
-    "3": {"ip": "localhost", "porta": 5003, "db_host": "localhost"},
-}
+log = get_logger("node")
+
+# Nós da configuração (votantes): DDB_NOS, arquivo DDB_MEMBROS ou os três locais. Réplicas entram com JOIN.
+NODES_CONFIG = carregar_config()
 
 DB_USER = "root"
 DB_PASS = "admin"
 DB_NAME = "ddb"
+DB_POOL_TAMANHO = 16 # Conexões MySQL simultâneas por nó
+
+BACKLOG = 128
+TIMEOUT_PADRAO = 5
+TIMEOUT_QUERY = 60
+TIMEOUT_SYNC = 300 # Dumps grandes
+RESTORE_LOTE = 1000 # Linhas por INSERT multi-linha no restore
+RESTORE_WORKERS = 4 # Tabelas carregadas em paralelo
+SYNC_CHUNK_LINHAS = 5000 # Linhas por SYNC_CHUNK
+SYNC_JANELA = 8 # Chunks enviados sem ACK antes do Master esperar o receptor
+SYNC_TENTATIVAS = 5 # Retomadas do stream após queda de conexão
+DIR_DADOS = os.environ.get("DDB_DADOS", "dados") # Log de replicação de cada nó
+WAL_RETENCAO = 100000 # Entradas guardadas para catch-up incremental
+CATCHUP_LOTE = 5000 # Entradas por CATCHUP_DATA
+REPL_MAX_LOTE = 500 # Entradas por REPLICACAO_LOTE (e por commit na réplica)
+REPL_MAX_ATRASO = 0.005 # Segundos que o pipeline espera para juntar um lote
+REPL_MAX_PENDENTES = 100000 # Acima disso o peer recupera pelo log (CATCHUP)
+# async: responde logo após o commit local | quorum: espera a maioria do cluster | all: todas as réplicas
+MODOS_CONSISTENCIA = ("async", "quorum", "all")
+REPL_CONSISTENCIA = os.environ.get("DDB_CONSISTENCIA", "async") # Padrão do cluster (sobrescrito por requisição)
+# Modo por tabela, "banco.tabela=modo,tabela=modo": vale para as escritas nela sem modo na requisição
+REPL_CONSISTENCIA_TABELAS = os.environ.get("DDB_CONSISTENCIA_TABELAS", "")
+REPL_TIMEOUT_ACK = 2.0 # Segundos esperando ACKs em quorum/all antes de responder com TIMEOUT
+# Escritas não determinísticas (NOW(), RAND(), UUID(), AUTO_INCREMENT, UPDATE ... LIMIT) vão às réplicas
+# como as linhas que deixaram no Master; com 0, como SQL (e a anti-entropia corrige o que divergir)
+REPL_LINHAS = os.environ.get("DDB_REPL_LINHAS", "1") == "1"
+PORTA_METRICAS = int(os.environ.get("DDB_PORTA_METRICAS", 0)) # HTTP GET /metrics (Prometheus); 0 = desligado
+QUERY_JANELA = 4 # Páginas de uma leitura paginada enviadas sem STREAM_ACK do cliente
+CACHE_ATIVO = os.environ.get("DDB_CACHE", "0") == "1" # Cache de resultados de SELECT (opcional)
+CACHE_TTL = 5.0 # Segundos que um resultado pode ser servido do cache
+CACHE_MAX_ENTRADAS = 1000
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+LIMITE_SILENCIO = 2.0 # Segundos sem batimento do Master que passam a contar como atraso da réplica
+TIMEOUT_ELEICAO = 1.0 # Resposta de um nó maior a ELEICAO
+CONFLITO_PERSISTENTE = 1.0 # Segundos com nós vivos apontando Masters diferentes antes de nova eleição
+# Master só aceita escritas até DURACAO_LEASE depois do último batimento confirmado pela maioria;
+# tem que ser menor que o tempo de detecção de falha, senão a eleição espera a promessa expirar
+DURACAO_LEASE = float(os.environ.get("DDB_LEASE", 0.5))
+INTERVALO_CANDIDATURA = 2.0 # Sem Master confirmado: segundos entre candidaturas
+ANTI_ENTROPIA_ATIVA = os.environ.get("DDB_ANTI_ENTROPIA", "1") == "1" # Réplicas comparam tabelas com o Master em fundo
+# Processados em sequência na thread da conexão (ordem preservada, sem thread extra)
+TIPOS_ORDENADOS = {"REPLICACAO", "REPLICACAO_LOTE", "STREAM_ACK", "GOSSIP"}
+
+
+def consistencia_por_tabela(texto):
+    """"banco.tabela=quorum,tabela=async" -> {"banco.tabela": "quorum", "tabela": "async"}."""
+    modos = {}
+    for item in filter(None, (p.strip() for p in texto.split(","))):
+        tabela, _, modo = item.partition("=")
+        if modo.strip() not in MODOS_CONSISTENCIA: raise ValueError(f"Consistência inválida para {tabela}: {modo}")
+        modos[tabela.strip().strip("`").lower()] = modo.strip()
+    return modos
 
 class NodeMiddleware:
-    def __init__(self, node_id):
+    def __init__(self, node_id, backlog=BACKLOG, cache=CACHE_ATIVO, endereco=None, grupo=GRUPO):
         self.id = str(node_id)
-        if self.id not in NODES_CONFIG:
-            print(f"[ERRO] ID {self.id} não encontrado na configuração.")
+        # Nó fora da configuração (réplica nova) informa o próprio endereço e entra com JOIN
+        self.membros = Membros(NODES_CONFIG, os.path.join(DIR_DADOS, f"membros_no{self.id}.json"))
+        self.config = endereco or self.membros.get(self.id)
+        if self.config is None:
+            log.error("[ERRO] ID %s não encontrado na configuração (informe --ip/--porta para entrar como réplica).", self.id)
             sys.exit(1)
-        self.config = NODES_CONFIG[self.id]
-        self.peers = [nid for nid in NODES_CONFIG if nid != self.id]
 
-        print("------------------------------------------------")
-        print(f"[INIT] Iniciando Nó {self.id}")
-        self.db = DBManager(self.config['db_host'], DB_USER, DB_PASS, DB_NAME)
+        log.info("------------------------------------------------")
+        log.info("[INIT] Iniciando Nó %s", self.id)
+        # Contadores e histogramas do nó: mensagem STATS e GET /metrics
+        self.metricas = Metricas()
+        self.porta_metricas = PORTA_METRICAS
+        self.db = DBManager(self.config['db_host'], DB_USER, DB_PASS, DB_NAME, tamanho_pool=DB_POOL_TAMANHO,
+                            metricas=self.metricas)
         self.coordenador_id = self.id
         self.running = True
+        self.backlog = backlog
+
+        # Uma conexão persistente por peer, reaproveitada por todas as mensagens
+        self.conexoes = {}
+        self.lock_conexoes = threading.Lock()
+        # Streams em andamento (SYNC em chunks): id -> janela de chunks ainda sem ACK
+        self.fluxos = {}
+
+        # Comandos preparados (stmt_id -> SQL): o log e a replicação levam só id + parâmetros
+        self.comandos = ComandosPreparados(os.path.join(DIR_DADOS, f"comandos_no{self.id}.log"))
+        # Log de replicação: seq gerado aqui quando Master, seq aplicado quando réplica
+        self.wal = LogReplicacao(os.path.join(DIR_DADOS, f"wal_no{self.id}.log"), retencao=WAL_RETENCAO,
+                                 comandos=self.comandos)
+        self.lock_escrita = threading.Lock()     # Master: ordem de execução == ordem do seq
+        self.lock_aplicacao = threading.RLock()  # Réplica: aplica entradas uma de cada vez
+        # Resultados de SELECT, invalidados por tabela a cada escrita aplicada aqui
+        self.cache = CacheResultados(CACHE_MAX_ENTRADAS, CACHE_MAX_BYTES, CACHE_TTL) if cache else None
+        self.sincronizando = threading.Event()   # Dump completo em andamento: REPLICACAO é descartada
+        # Master: uma fila ordenada por réplica, enviada em lotes
+        self.pipeline = PipelineReplicacao(self.peers, self.enviar_lote_replicacao, REPL_MAX_LOTE,
+                                           REPL_MAX_ATRASO, REPL_MAX_PENDENTES)
+        self.consistencia = REPL_CONSISTENCIA
+        self.consistencia_tabelas = consistencia_por_tabela(REPL_CONSISTENCIA_TABELAS)
+        # Latência das escritas no Master (execução + espera pelos ACKs), por modo
+        self.latencias_escrita = {modo: Histograma() for modo in MODOS_CONSISTENCIA}
+        self.timeouts_replicacao = {modo: 0 for modo in MODOS_CONSISTENCIA}
+
+        # Carga e atraso publicados nos heartbeats (roteamento de leituras)
+        self.em_voo = 0
+        self.conexoes_abertas = 0       # Conexões de clientes/peers aceitas por este servidor
+        self.lock_carga = threading.Lock()
+        self.seq_coordenador = 0        # Último seq do Master de que temos notícia
+        self.ts_aplicado = 0.0          # Relógio do Master na última entrada aplicada
+        self.contato_coordenador = time.monotonic()
+        # Réplica: compara as tabelas com o Master por árvore de hashes e repara só o que diverge
+        self.anti_entropia = AntiEntropia(self)
+        # Batimentos de todos os nós chegam por gossip; phi-accrual decide quem está suspeito
+        self.detector = DetectorFalhas(self.id, self.membros.ids())
+        self.envios_gossip = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.peers)), thread_name_prefix=f"no{self.id}-gossip")
+        self.gossip_pendente = {}  # peer -> envio ainda em andamento (peer lento não acumula rodadas)
+        self.conflito_desde = None
+
+        # Termo (época) da liderança: persistido e só cresce; o voto impede dois Masters no mesmo termo
+        self.arquivo_termo = os.path.join(DIR_DADOS, f"termo_no{self.id}.json")
+        self.termo, self.voto = self._carregar_termo()
+        self.termo_visto = self.termo  # Maior termo de que já ouvimos falar (próxima candidatura vai além)
+        self.lider_termo = None        # Termo em que este nó ganhou a eleição; None = não é Master confirmado
+        self.lease_ate = 0.0           # Master: aceita escritas até este instante (monotonic)
+        self.envios_batimento = OrderedDict()  # Batimento próprio -> instante em que foi difundido
+        self.lock_termo = threading.RLock()
+        self.lock_eleicao = threading.Lock()
+        self.proxima_candidatura = 0.0
+        self.membros_pendente = None
+
+        # Sharding (opcional): este nó é do 'grupo'; comandos de partições de outros grupos vão ao dono
+        config_shards = carregar_shards()
+        self.shards = None
+        if config_shards:
+            try:
+                self.shards = CamadaShards(MapaShards(config_shards), grupo,
+                                           lambda pedido: self.processar_query("SHARDS", pedido))
+            except (KeyError, ValueError) as e:
+                log.error("[ERRO] Configuração de shards inválida: %s", e)
+                sys.exit(1)
+            log.info("[SHARDS] Grupo %s de %s (principal: %s)", grupo, sorted(self.shards.mapa.grupos), self.shards.mapa.principal)
+
+        self.ultima_sincronizacao = None  # {"linhas", "segundos", "linhas_por_s"} do último restore completo
+        self.registrar_metricas()
+
+    @property
+    def peers(self):
+        return self.membros.peers(self.id)
 
     # ------- Protocolo -------
     def criar_mensagem(self, tipo, payload=None):
         if payload is None: payload = {}
-        payload_str = json.dumps(payload, sort_keys=True)
-        checksum = hashlib.md5(payload_str.encode("utf-8")).hexdigest()
-        return {"tipo": tipo, "origem": self.id, "payload": payload, "checksum": checksum}
+        # Integridade fica no frame (CRC32/HMAC sobre os bytes enviados), não na mensagem
+        return {"tipo": tipo, "origem": self.id, "payload": payload}
 
     def validar_checksum(self, msg_dict):
-        payload = msg_dict.get("payload", {})
-        checksum_recebido = msg_dict.get("checksum", "")
-        payload_str = json.dumps(payload, sort_keys=True)
-        return checksum_recebido == hashlib.md5(payload_str.encode("utf-8")).hexdigest()
+        """Só para clientes legados (JSON cru, sem frame): MD5 do payload."""
+        return msg_dict.get("checksum", "") == checksum_legado(msg_dict.get("payload", {}))
+
+    def resposta_legado(self, response):
+        return dict(response, checksum=checksum_legado(response.get("payload", {})))
     
     # --------- Rede -----------
-    def enviar_mensagem(self, target_id, tipo, payload=None, esperar_resposta=False):
-        if target_id not in NODES_CONFIG: return None
-        target = NODES_CONFIG[target_id]
+    def _conexao(self, target_id):
+        with self.lock_conexoes:
+            conn = self.conexoes.get(target_id)
+            if conn is None:
+                target = self.membros.get(target_id)
+                conn = ConexaoPeer(target['ip'], target['porta'])
+                self.conexoes[target_id] = conn
+            return conn
+
+    def enviar_mensagem(self, target_id, tipo, payload=None, esperar_resposta=False, timeout=TIMEOUT_PADRAO):
+        if target_id not in self.membros: return None
         msg = self.criar_mensagem(tipo, payload)
 
         try:
-            # print(f"[NET OUT] Enviando {tipo} para Nó {target_id}...") 
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5) # Timeout maior para Dumps
-            sock.connect((target['ip'], target['porta']))
-            sock.send(json.dumps(msg).encode("utf-8"))
-
-            resposta = None
-            if esperar_resposta:
-                # Loop de leitura para mensagens grandes
-                chunks = []
-                while True:
-                    try:
-                        chunk = sock.recv(4096)
-                        if not chunk: break
-                        chunks.append(chunk)
-                    except socket.timeout:
-                        break
-                
-                if chunks:
-                    full_data = b''.join(chunks).decode("utf-8")
-                    resposta = json.loads(full_data)
-                    # print(f"[NET IN] Resposta recebida de {target_id} (Tamanho: {len(full_data)} bytes)")
-            
-            sock.close()
+            resposta = self._conexao(target_id).requisitar(msg, timeout=timeout, esperar_resposta=esperar_resposta)
+            if resposta and resposta.get("tipo") == "SEM_RESPOSTA": return None
             return resposta
         except Exception as e:
-            print(f"[NET ERROR] Falha ao enviar para {target_id}: {e}")
+            log.warning("[NET ERROR] Falha ao enviar para %s: %s", target_id, e)
             return None
 
+    def enviar_stream(self, target_id, tipo, payload=None, timeout=TIMEOUT_PADRAO):
+        """Requisição cuja resposta chega em vários frames; erros de rede sobem para quem itera."""
+        msg = self.criar_mensagem(tipo, payload)
+        return self._conexao(target_id).requisitar_stream(msg, timeout=timeout)
+
     def start_server(self):
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
             server.bind((self.config['ip'], self.config['porta']))            
-            server.listen(5)
-            print(f"[SERVER] Rodando em {self.config['ip']}:{self.config['porta']}")
+            server.listen(self.backlog)
+            log.info("[SERVER] Rodando em %s:%s", self.config['ip'], self.config['porta'])
             while self.running:
                 client_socket, _ = server.accept()
                 threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True).start()
         except Exception as e:
-            print(f"[SERVER FATAL] {e}")
+            log.critical("[SERVER FATAL] %s", e)
             sys.exit(1)
 
     def handle_client(self, cliente_socket):
+        with self.lock_carga: self.conexoes_abertas += 1
         try:
-            # Leitura robusta
-            chunks = []
-            while True:
-                cliente_socket.settimeout(2.0)
-                try:
-                    chunk = cliente_socket.recv(4096)
-                    if not chunk: break
-                    chunks.append(chunk)
-                    if len(chunk) < 4096: break # Fim provável
-                except socket.timeout:
-                    break
-            
-            if not chunks: return
-            data = b''.join(chunks).decode("utf-8")
-            msg = json.loads(data)
+            if eh_legado(cliente_socket):
+                if CHAVE_HMAC:
+                    log.warning("[SEC] Cliente legado recusado: HMAC exigido")
+                    return
+                self.handle_cliente_legado(cliente_socket)
+                return
+
+            cliente_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            lock_envio = threading.Lock()
+            binario = False  # Responde em msgpack assim que o peer anunciar que aceita
+            # Uma conexão persistente pode trazer vários frames; lê até o peer fechar
+            while self.running:
+                msg, flags = receber_frame(cliente_socket, com_flags=True)
+                if msg is None: break
+                binario = binario or bool(flags & FLAG_ACEITA_MSGPACK)
+                if msg.get("tipo") in TIPOS_ORDENADOS:
+                    # Replicação precisa ser aplicada na ordem de chegada
+                    self.responder_frame(cliente_socket, lock_envio, msg, binario)
+                else:
+                    threading.Thread(target=self.responder_frame, args=(cliente_socket, lock_envio, msg, binario), daemon=True).start()
+        except (OSError, ValueError) as err:
+            log.warning("[SERVER ERROR] %s", err)
+        finally:
+            cliente_socket.close()
+            with self.lock_carga: self.conexoes_abertas -= 1
 
+    def responder_frame(self, cliente_socket, lock_envio, msg, binario=False):
+        req_id = msg.get("req_id")
+        try:
+            with span(log, "node.msg", tipo=msg.get("tipo"), origem=msg.get("origem")):
+                response = self.processar_medido(msg)
+        except Exception as err:
+            log.warning("[SERVER ERROR] %s", err)
+            response = self.criar_mensagem("ERRO", {"mensagem": str(err)})
+
+        if inspect.isgenerator(response):
+            self.responder_stream(cliente_socket, lock_envio, req_id, response, binario)
+            return
+
+        # Sem req_id o remetente não espera resposta (envio unidirecional)
+        if req_id is None: return
+        if response is None: response = self.criar_mensagem("SEM_RESPOSTA")
+        response = dict(response, req_id=req_id)
+        try:
+            with lock_envio:
+                enviar_frame(cliente_socket, response, binario)
+        except OSError as err:
+            log.warning("[SERVER ERROR] Falha ao responder: %s", err)
+
+    def responder_stream(self, cliente_socket, lock_envio, req_id, frames, binario=False):
+        """Envia cada mensagem do gerador como um frame com o mesmo req_id."""
+        try:
+            if req_id is None: return
+            for frame in frames:
+                with lock_envio:
+                    enviar_frame(cliente_socket, dict(frame, req_id=req_id), binario)
+        except OSError as err:
+            log.warning("[SERVER ERROR] Stream interrompido: %s", err)
+        finally:
+            frames.close()  # libera cursor/conexão do banco se o receptor sumiu
+
+    def handle_cliente_legado(self, cliente_socket):
+        """Clientes antigos: um JSON cru por conexão, fim detectado por recv curto."""
+        chunks = []
+        while True:
+            cliente_socket.settimeout(2.0)
+            try:
+                chunk = cliente_socket.recv(4096)
+                if not chunk: break
+                chunks.append(chunk)
+                if len(chunk) < 4096: break # Fim provável
+            except socket.timeout:
+                break
+
+        if not chunks: return
+        try:
+            msg = json.loads(b''.join(chunks).decode("utf-8"))
             if not self.validar_checksum(msg):
-                print(f"[SEC] Checksum inválido de {msg.get('origem')}")
+                log.warning("[SEC] Checksum inválido de %s", msg.get('origem'))
                 return
-            
-            response = self.processar_mensagem(msg)
+
+            response = self.processar_medido(msg)
             if response:
-                cliente_socket.sendall(json.dumps(response).encode("utf-8"))
+                cliente_socket.sendall(json.dumps(self.resposta_legado(response)).encode("utf-8"))
         except Exception as err:
-            print(f"[SERVER ERROR] {err}")
-        finally:
-            cliente_socket.close()
+            log.warning("[SERVER ERROR] %s", err)
 
     # --------- LÓGICA DE APLICAÇÃO DO DUMP -----------
-    def aplicar_dump(self, dump_dados):
-        print("\n[SYNC START] Iniciando Restore do Banco...")
+    def aplicar_dump(self, dump_dados, tamanho_lote=RESTORE_LOTE, workers=RESTORE_WORKERS):
+        """
+        Restore em massa: cada tabela é recriada e carregada numa transação própria
+        (INSERTs multi-linha em lotes), e as tabelas são carregadas em paralelo em
+        conexões do pool. Retorna as estatísticas da carga (linhas, segundos, linhas/s).
+        """
+        log.info("[SYNC START] Iniciando Restore do Banco...")
+        if self.cache: self.cache.invalidar(None)
         
         if not dump_dados:
-            print("[SYNC] Dump vazio.")
-            return
+            log.info("[SYNC] Dump vazio.")
+            return None
 
-        try:
-            self.db.executar_query("SET FOREIGN_KEY_CHECKS = 0")
-            
-            count_bancos = 0
-            
+        inicio = time.perf_counter()
+        total_linhas = 0
+        # Deixa conexões livres no pool para as queries dos clientes durante o restore
+        workers = max(1, min(workers, self.db.pool.tamanho_max - 2))
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"no{self.id}-restore") as executor:
+            tarefas = {}
             for key, data in dump_dados.items():
                 db_name = data.get("database")
                 table_name = data.get("table")
-                create_sql = data.get("schema")
                 rows = data.get("rows", [])
                 
                 # Validação
                 if not db_name or str(db_name) in ["None", "null"]:
-                    print(f"[SYNC SKIP] Chave inválida encontrada: {key}")
+                    log.info("[SYNC SKIP] Chave inválida encontrada: %s", key)
                     continue
 
-                print(f"[SYNC STEP] Processando Banco: {db_name}")
-                
-                # 1. Cria Banco
-                res = self.db.executar_query(f"CREATE DATABASE IF NOT EXISTS {db_name}")
-                if res['status'] == 'ERRO':
-                    print(f"   [!!!] Erro ao criar banco: {res['mensagem']}")
-                    continue
-                
-                if not table_name: 
-                    # É um banco vazio, termina aqui
-                    continue
+                colunas = list(rows[0].keys()) if rows else []
+                linhas = [tuple(row.get(c) for c in colunas) for row in rows]
+                tarefa = executor.submit(self._restaurar_tabela, db_name, table_name, data.get("schema"),
+                                         colunas, linhas, tamanho_lote)
+                tarefas[tarefa] = key
 
-                # 2. Muda Contexto (USE)
-                res = self.db.executar_query(f"USE {db_name}")
-                if res['status'] == 'ERRO':
-                    print(f"   [!!!] Erro ao entrar no banco: {res['mensagem']}")
-                    continue
+            for tarefa in as_completed(tarefas):
+                try:
+                    total_linhas += tarefa.result()
+                except Exception as e:
+                    log.error("   [!!!] Erro ao restaurar %s: %s", tarefas[tarefa], e)
 
-                # 3. Cria Tabela
-                print(f"   -> Recriando tabela '{table_name}'...")
-                self.db.executar_query(f"DROP TABLE IF EXISTS {table_name}")
-                if create_sql:
-                    self.db.executar_query(create_sql)
-                
-                # 4. Insere Dados
-                if rows:
-                    print(f"   -> Inserindo {len(rows)} registros...")
-                    for row in rows:
-                        colunas = list(row.keys())
-                        valores = []
-                        for v in row.values():
-                            if v is None: valores.append("NULL")
-                            elif isinstance(v, (int, float)): valores.append(str(v))
-                            else:
-                                val_str = str(v).replace("'", "''").replace("\\", "\\\\")
-                                valores.append(f"'{val_str}'")
-                        
-                        sql = f"INSERT INTO {table_name} ({', '.join(colunas)}) VALUES ({', '.join(valores)})"
-                        self.db.executar_query(sql)
-
-            self.db.executar_query("SET FOREIGN_KEY_CHECKS = 1")
-            print("[SYNC END] Sincronização Finalizada!\n")
+        segundos = time.perf_counter() - inicio
+        taxa = total_linhas / segundos if segundos > 0 else 0.0
+        log.info("[SYNC END] Sincronização Finalizada! %d linhas em %.2fs (%.0f linhas/s, %d workers)",
+                 total_linhas, segundos, taxa, workers)
+        return {"linhas": total_linhas, "segundos": round(segundos, 3), "linhas_por_s": round(taxa, 1)}
 
-        except Exception as e:
-            print(f"[SYNC FATAL] {e}")
+    def _restaurar_tabela(self, db_name, table_name, create_sql, colunas, linhas, tamanho_lote):
+        inicio = time.perf_counter()
+        n = self.db.restaurar_tabela(db_name, table_name, create_sql, colunas, linhas, tamanho_lote)
+        if table_name:
+            segundos = time.perf_counter() - inicio
+            log.info("   -> %s.%s: %d registros em %.2fs (%.0f linhas/s)", db_name, table_name, n, segundos,
+                     n / segundos if segundos > 0 else 0.0)
+        return n
 
     # --------- Processamento de Mensagens -----------
     def processar_mensagem(self, msg):
@@ -202,128 +385,1227 @@ class NodeMiddleware:
         payload = msg["payload"]
 
         if tipo == "QUERY_REQ":
-            sql = payload.get("sql", "").strip()
-            print(f"[REQ] Query de {origem}: {sql[:50]}...")
-
-            sql_upper = sql.upper()
-            is_read = any(sql_upper.startswith(k) for k in ["SELECT", "SHOW", "DESCRIBE"])
+            with self.lock_carga: self.em_voo += 1
+            try:
+                resp = self.processar_query(origem, payload, msg.get("req_id"))
+            finally:
+                with self.lock_carga: self.em_voo -= 1
+            # Quem pediu paginação espera um stream: resposta única também fecha o stream
+            if payload.get("paginar") and isinstance(resp, dict): resp = dict(resp, fim_stream=True)
+            return resp
 
-            if is_read:
-                # Leitura: Executa Local
-                res = self.db.executar_query(sql)
-                return self.criar_mensagem("QUERY_RESP", res)
+        elif tipo == "REPLICACAO":
+            sql = payload.get("sql")
+            log.debug("[REPLICA] Gravando: %s...", (sql or payload.get("stmt_id", ""))[:50])
+            if not self.aceitar_lider(origem, payload.get("termo", 0)):
+                return self.criar_mensagem("REJEITADO", {"termo": self.termo, "coordenador": self.coordenador_id})
+            if payload.get("seq") is None:
+                self.db.executar_query(sql)  # Remetente antigo, sem log de replicação
+                self.invalidar_cache(sql, self.db.db_sessao)
             else:
-                # Escrita
-                if self.id == self.coordenador_id:
-                    print(f"[MASTER] Executando e Replicando: {sql[:50]}...")
-                    res = self.db.executar_query(sql)
-                    
-                    # Verifica erro antes de replicar
-                    deu_erro = False
-                    if isinstance(res, dict) and res.get("status") in ["ERRO", "ERROR"]: deu_erro = True
-                    
-                    if not deu_erro:
-                        self.replicar_dados(sql)
-                    else:
-                        print("[MASTER] Erro local. Não replicando.")
+                self.receber_replicacao(origem, payload)
+            return self.criar_mensagem("ACK", {"seq": self.wal.ultimo_seq})
 
-                    return self.criar_mensagem("QUERY_RESP", res)
-                else:
-                    print(f"[SLAVE] Forwarding para Master {self.coordenador_id}")
-                    resp = self.enviar_mensagem(self.coordenador_id, "QUERY_REQ", payload, esperar_resposta=True)
-                    return resp if resp else self.criar_mensagem("ERRO", {"mensagem": "Master OFF"})
+        elif tipo == "PREPARE":
+            stmt_id = self.comandos.registrar(payload.get("sql", ""))
+            return self.criar_mensagem("PREPARADO", {"stmt_id": stmt_id})
 
-        elif tipo == "REPLICACAO":
-            sql = payload.get("sql")
-            print(f"[REPLICA] Gravando: {sql[:50]}...")
-            self.db.executar_query(sql)
-            return self.criar_mensagem("ACK")    
+        elif tipo == "REPLICACAO_LOTE":
+            # Fencing: lote de um Master de termo antigo é recusado e o remetente fica sabendo do termo atual
+            if not self.aceitar_lider(origem, payload.get("termo", 0)):
+                return self.criar_mensagem("REJEITADO", {"termo": self.termo, "coordenador": self.coordenador_id})
+            self.comandos.registrar_varios(payload.get("comandos"))
+            self.receber_lote(origem, payload.get("entradas", []), payload.get("anterior"))
+            return self.criar_mensagem("ACK", {"seq": self.wal.ultimo_seq})
+
+        elif tipo == "AE_TABELAS_REQ":
+            return self.criar_mensagem("AE_TABELAS", {"tabelas": self.db.tabelas_verificaveis()})
+
+        elif tipo == "AE_HASH_REQ":
+            baldes = self.db.hash_faixas(payload["database"], payload["table"], payload.get("pk"), payload["colunas"],
+                                         payload.get("de"), payload.get("ate"), payload.get("largura"))
+            return self.criar_mensagem("AE_HASH", {"baldes": baldes})
+
+        elif tipo == "AE_LINHAS_REQ":
+            # Snapshot aberto com lock_escrita: as linhas correspondem exatamente ao seq enviado
+            posicao = {}
+            colunas, linhas = self.db.ler_faixa(payload["database"], payload["table"], payload.get("pk"),
+                                                payload.get("de"), payload.get("ate"), trava=self.lock_escrita,
+                                                ao_iniciar=lambda: posicao.update(seq=self.wal.ultimo_seq))
+            return self.criar_mensagem("AE_LINHAS", {"colunas": colunas, "linhas": linhas, "seq": posicao["seq"]})
+
+        elif tipo == "STATUS_ANTI_ENTROPIA":
+            return self.criar_mensagem("STATUS_ANTI_ENTROPIA", self.anti_entropia.metricas())
+
+        elif tipo == "STATUS_DUMP":
+            return self.criar_mensagem("STATUS_DUMP", self.db.progresso_dump())
+
+        elif tipo == "STATUS_CACHE":
+            return self.criar_mensagem("STATUS_CACHE", self.cache.metricas() if self.cache else {"ativo": False})
+
+        elif tipo == "STATUS_REPLICACAO":
+            with self.lock_carga: timeouts = dict(self.timeouts_replicacao)
+            latencias = {modo: dict(h.resumo(), timeouts=timeouts[modo]) for modo, h in self.latencias_escrita.items()}
+            return self.criar_mensagem("STATUS_REPLICACAO", {"seq": self.wal.ultimo_seq,
+                                                             "coordenador": self.coordenador_id,
+                                                             "termo": self.termo,
+                                                             "lease_s": round(max(0.0, self.lease_ate - time.monotonic()), 3)
+                                                                        if self.eh_lider() else None,
+                                                             "consistencia": self.consistencia,
+                                                             "latencias": latencias,
+                                                             "peers": self.pipeline.metricas()})
+
+        elif tipo == "STATS":
+            return self.criar_mensagem("STATS", self.metricas.instantaneo())
+
+        elif tipo == "CATCHUP_REQ":
+            desde, termo = payload.get("desde", 0), payload.get("termo")
+            meu_termo = self.wal.termo_em(desde)
+            if termo is not None and (desde > self.wal.ultimo_seq or meu_termo not in (None, termo)):
+                # O log de quem pediu tem um sufixo que este não tem: mandamos onde cada termo começa
+                return self.criar_mensagem("CATCHUP_DATA", {"divergente": True, "termos": self.wal.termos(),
+                                                            "ultimo_seq": self.wal.ultimo_seq})
+            entradas = self.wal.desde(desde, limite=CATCHUP_LOTE)
+            if entradas is None:
+                return self.criar_mensagem("CATCHUP_DATA", {"truncado": True, "ultimo_seq": self.wal.ultimo_seq})
+            mais = bool(entradas) and entradas[-1]["seq"] < self.wal.ultimo_seq
+            return self.criar_mensagem("CATCHUP_DATA", {"entradas": entradas, "mais": mais, "ultimo_seq": self.wal.ultimo_seq,
+                                                        "comandos": self.comandos.resolver(entradas)})
+
+        elif tipo == "SYNC_REQ" and payload.get("stream"):
+            log.info("[SYNC] Nó %s pediu dump em streaming (retomar=%s)", origem, payload.get("retomar"))
+            return self.gerar_stream_sync(f"{origem}:{msg.get('req_id')}", payload)
+
+        elif tipo == "STREAM_ACK":
+            # cancelar: o receptor desistiu do stream (ex.: cursor fechado antes do fim)
+            chave = f"{origem}:{payload.get('stream')}"
+            janela = self.fluxos.pop(chave, None) if payload.get("cancelar") else self.fluxos.get(chave)
+            if janela: janela.release()
+            return None
 
         elif tipo == "SYNC_REQ":
-            print(f"[SYNC] Nó {origem} pediu dados. Gerando dump...")
-            dump = self.db.get_full_dump() 
+            log.info("[SYNC] Nó %s pediu dados. Gerando dump...", origem)
+            # Com lock_escrita os workers do dump abrem o snapshot no mesmo ponto do log
+            dump = self.db.get_full_dump(trava=self.lock_escrita)
             return self.criar_mensagem("SYNC_DATA", dump)
         
         elif tipo == "SYNC_DATA":
-            print(f"[SYNC] Recebi dados do Master.")
-            if payload: self.aplicar_dump(payload)
+            log.info("[SYNC] Recebi dados do Master.")
+            if payload: self.ultima_sincronizacao = self.aplicar_dump(payload) or self.ultima_sincronizacao
             return None
 
+        elif tipo in ("JOIN", "LEAVE"):
+            # Só o Master muda a visão de membros; os outros respondem quem é ele
+            if not self.eh_lider():
+                return self.criar_mensagem("ERRO", {"mensagem": f"Nó {self.id} não é o Master", "coordenador": self.coordenador_id})
+            try:
+                if tipo == "JOIN":
+                    mudou = self.membros.entrar(payload["id"], payload, self.termo)
+                else:
+                    mudou = self.membros.sair(payload.get("id", origem), self.termo)
+            except (KeyError, ValueError) as e:
+                return self.criar_mensagem("ERRO", {"mensagem": str(e)})
+            if mudou:
+                log.info("[MEMBROS] %s %s (versão %s)", payload.get("id", origem), "entrou" if tipo == "JOIN" else "saiu",
+                         self.membros.versao)
+                self.membros_mudaram(*(([payload["id"]], []) if tipo == "JOIN" else ([], [payload.get("id", origem)])))
+                self.difundir_membros()
+            return self.criar_mensagem("MEMBROS", self.membros.visao())
+
+        elif tipo == "MEMBROS":
+            mudancas = self.membros.aplicar(payload)
+            if mudancas: self.membros_mudaram(*mudancas)
+            return None
+
+        elif tipo == "MEMBROS_REQ":
+            return self.criar_mensagem("MEMBROS", self.membros.visao())
+
         # Mensagens de controle simples (sem log excessivo)
-        elif tipo == "HEARTBEAT": return self.criar_mensagem("VIVO")
+        elif tipo == "HEARTBEAT": return self.criar_mensagem("VIVO", self.carga())
         elif tipo == "QUEM_E_O_CHEFE":
-            if self.id == self.coordenador_id: return self.criar_mensagem("EU_SOU_O_CHEFE")
+            if self.eh_lider(): return self.criar_mensagem("EU_SOU_O_CHEFE", {"termo": self.termo})
+        elif tipo == "GOSSIP":
+            novos = self.detector.mesclar(payload.get("visao", {}))
+            if self.coordenador_id in novos and self.coordenador_id != self.id:
+                self.registrar_contato_coordenador(self.detector.info_de(self.coordenador_id).get("seq", 0))
+            return None
+        elif tipo == "STATUS_FALHAS":
+            return self.criar_mensagem("STATUS_FALHAS", self.detector.resumo())
         elif tipo == "COORDENADOR":
-            self.coordenador_id = origem
-            print(f"[INFO] Novo Master: {origem}")
+            aceito, motivo = self.avaliar_candidato(origem, payload)
+            if aceito: return self.criar_mensagem("ACEITO", {"termo": self.termo})
+            return self.criar_mensagem("REJEITADO", {"termo": self.termo, "coordenador": self.coordenador_id, "motivo": motivo})
         elif tipo == "ELEICAO":
-             if int(self.id) > int(origem):
-                threading.Thread(target=self.iniciar_eleicao).start()
+            # Bully, mas só toma a frente quem tem o log pelo menos tão atualizado quanto o de quem chamou
+            if self.membros.eh_votante(self.id) and int(self.id) > int(origem) and \
+                    self.wal.posicao() >= tuple(payload.get("log") or (0, 0)):
+                if not self.lease_valido(): threading.Thread(target=self.iniciar_eleicao).start()
                 return self.criar_mensagem("VIVO")
         
         return None
 
-    def replicar_dados(self, sql):
-        for peer in self.peers:
-            threading.Thread(target=self.enviar_mensagem, args=(peer, "REPLICACAO", {"sql": sql})).start()
+    def processar_query(self, origem, payload, req_id=None):
+        if "transacao" in payload: return self.processar_transacao(payload)
+        sql = payload.get("sql", "").strip()
+        # Comando preparado: {"stmt_id" (ou "sql"), "parametros": [[...], ...]}
+        stmt_id, parametros = payload.get("stmt_id"), payload.get("parametros")
+        if stmt_id or parametros is not None:
+            if sql:
+                stmt_id = self.comandos.registrar(sql)  # PREPARE implícito
+            else:
+                sql = self.comandos.sql(stmt_id)
+                if sql is None:
+                    return self.criar_mensagem("QUERY_RESP", {"status": "ERRO", "codigo": "COMANDO_DESCONHECIDO",
+                                                              "mensagem": f"Comando {stmt_id} não preparado neste nó"})
+            parametros = [[]] if parametros is None else parametros
+        log.debug("[REQ] Query de %s: %s...", origem, sql[:50])
+        if controle_de_sessao(classificar(sql)):
+            # Conexões do pool ficam em autocommit: um BEGIN avulso deixaria as próximas escritas sem COMMIT aqui
+            return self.criar_mensagem("QUERY_RESP", {"status": "ERRO", "codigo": "CONTROLE_DE_SESSAO",
+                                                      "mensagem": "Use o pedido {\"transacao\": [...], \"fim\": ...} "
+                                                                  "em vez de BEGIN/COMMIT/LOCK TABLES/SET autocommit"})
+        if parametros == []:
+            # Nenhum conjunto de parâmetros: nada a executar nem a replicar
+            vazio = {"status": "OK", "resultados": []} if classificar(sql).leitura else \
+                {"status": "OK", "mensagem": "Query executada com sucesso", "afetadas": 0}
+            return self.criar_mensagem("QUERY_RESP", vazio)
+        # Pedido vindo de outro grupo já foi roteado: é daqui, no banco que ele indicou
+        banco = payload.get("database")
+        if self.shards and not payload.get("shard_local"):
+            res = self.shards.processar(sql, parametros, payload, self.db.db_sessao)
+            if res is not None: return self.criar_mensagem("QUERY_RESP", res)
+
+        classe = classificar(sql)
+        if classe.multiplos:
+            # Cada nó decide réplica/Master e replicação por comando: "SELECT ...; DELETE ..." não pode passar como leitura
+            return self.criar_mensagem("QUERY_RESP", {"status": "ERRO", "codigo": "MULTIPLOS_COMANDOS",
+                                                      "mensagem": "Um comando por pedido (use uma transação para vários)"})
+
+        if classe.leitura:
+            if self.id != self.coordenador_id and self.leitura_precisa_do_master(payload):
+                # Réplica atrasada demais para esta leitura (ou o cliente quer ler o que escreveu)
+                if payload.get("paginar"):
+                    # Resultado grande: o cliente busca direto no Master em vez de passar por aqui
+                    coord = self.membros.get(self.coordenador_id) or {}
+                    return self.criar_mensagem("REDIRECIONAR", {"no": self.coordenador_id, "ip": coord.get("ip"),
+                                                                "porta": coord.get("porta")})
+                log.debug("[ROTEAMENTO] Leitura encaminhada ao Master %s", self.coordenador_id)
+                pedido = dict(payload, max_atraso_s=None, ler_proprias_escritas=False)  # Não encaminha de novo
+                return self.encaminhar_ao_master(pedido, sql)
+            if payload.get("paginar"):
+                return self.gerar_stream_query(f"{origem}:{req_id}", sql, payload,
+                                               parametros[0] if parametros is not None else None)
+            # Leitura: Executa Local
+            res = self.ler_local(sql, parametros, usar_cache=not payload.get("sem_cache"), database=banco)
+            return self.criar_mensagem("QUERY_RESP", res)
+        else:
+            # Escrita, ou leitura que trava linhas (FOR UPDATE) / grava fora do resultado (INTO): só no Master
+            if self.id == self.coordenador_id:
+                log.debug("[MASTER] Executando e Replicando: %s...", sql[:50])
+                modo = self.modo_consistencia(payload, [classe], banco or self.db.db_sessao)
+                if modo not in MODOS_CONSISTENCIA:
+                    return self.criar_mensagem("QUERY_RESP", {"status": "ERRO", "mensagem": f"Consistência inválida: {modo}"})
+                inicio = time.perf_counter()
+                seq = None
+                # USE só muda a sessão; o resto roda (e é replicado) no banco da sessão atual
+                database = None if classe.tipo == "USE" else banco or self.db.db_sessao
+                plano = self.plano_linhas(sql, classe, database)
+                imagem = None
+                with self.lock_escrita:
+                    if not self.lease_valido(): return self.resposta_sem_lease()
+                    if plano:
+                        res, imagem = self.db.executar_com_imagens(sql, parametros, database, plano)
+                    elif parametros is not None:
+                        res = self.db.executar_preparado(sql, parametros, database=database)
+                    else:
+                        res = self.db.executar_query(sql, database=database)
+                    if classe.escrita: self.invalidar_cache(sql, database)
+                    
+                    # Verifica erro antes de replicar
+                    deu_erro = False
+                    if isinstance(res, dict) and res.get("status") in ["ERRO", "ERROR"]: deu_erro = True
+                    
+                    if not deu_erro and imagem is not None:
+                        # Só as linhas como ficaram aqui: nada a fazer nas réplicas se nenhuma mudou
+                        if imagem["gravar"] or imagem["apagar"]: seq = self.replicar_linhas(imagem, database)
+                    elif not deu_erro and classe.escrita:
+                        seq = self.replicar_dados(sql, database, stmt_id, parametros)
+                    elif deu_erro:
+                        log.warning("[MASTER] Erro local. Não replicando.")
+
+                # A espera pelos ACKs fica fora do lock: escritas seguintes entram no mesmo lote
+                if seq is not None:
+                    if modo != "async":
+                        res["replicacao"] = self.aguardar_replicacao(
+                            seq, modo, payload.get("timeout_replicacao", REPL_TIMEOUT_ACK))
+                    self.latencias_escrita[modo].observar((time.perf_counter() - inicio) * 1000)
+                return self.criar_mensagem("QUERY_RESP", res)
+            else:
+                log.debug("[SLAVE] Forwarding para Master %s", self.coordenador_id)
+                return self.encaminhar_ao_master(payload, sql)
+
+    def resposta_sem_lease(self):
+        # Sem a maioria confirmando o termo, outro nó pode já ser Master: escrever aqui seria split-brain
+        return self.criar_mensagem("QUERY_RESP", {"status": "ERRO", "codigo": "SEM_LEASE",
+                                                  "mensagem": f"Nó {self.id} sem lease de Master (termo {self.termo})"})
+
+    def processar_transacao(self, payload):
+        """
+        QUERY_REQ {"transacao": [{"sql", "parametros"?}, ...], "fim": "COMMIT" | "ROLLBACK"}:
+        BEGIN, os comandos e o fim numa só transação do MySQL no Master, replicada como uma
+        única entrada do log (as réplicas aplicam tudo ou nada, no mesmo COMMIT do lote).
+        """
+        if self.shards and not payload.get("shard_local") and payload["transacao"]:
+            grupo, erro = self.shards.grupo_da_transacao(payload["transacao"], self.db.db_sessao)
+            if erro: return self.criar_mensagem("QUERY_RESP", {"status": "ERRO", "codigo": "SHARD", "mensagem": erro})
+            if grupo != self.shards.grupo:
+                return self.criar_mensagem("QUERY_RESP", self.shards.transacao_no_grupo(grupo, payload, self.db.db_sessao))
+        if self.id != self.coordenador_id:
+            log.debug("[SLAVE] Transação encaminhada ao Master %s", self.coordenador_id)
+            return self.encaminhar_ao_master(payload, None)
+        comandos, fim = payload["transacao"], (payload.get("fim") or "COMMIT").upper()
+        modo = self.modo_consistencia(payload, [classificar(c.get("sql") or "") for c in comandos],
+                                      payload.get("database") or self.db.db_sessao)
+        erro = None
+        if fim not in ("COMMIT", "ROLLBACK"): erro = f"Fim de transação inválido: {fim}"
+        elif modo not in MODOS_CONSISTENCIA: erro = f"Consistência inválida: {modo}"
+        elif not comandos or not all((c.get("sql") or "").strip() for c in comandos): erro = "Transação sem comandos"
+        elif any(classificar(c["sql"]).multiplos for c in comandos): erro = "Um comando por item da transação"
+        elif any(controle_de_sessao(classificar(c["sql"])) for c in comandos):
+            erro = "BEGIN/COMMIT/LOCK TABLES/SET autocommit não entram na transação (use \"fim\")"
+        elif any(classificar(c["sql"]).tipo in DDL for c in comandos):
+            erro = "DDL faz COMMIT implícito no MySQL: não pode ir numa transação"
+        if erro: return self.criar_mensagem("QUERY_RESP", {"status": "ERRO", "codigo": "TRANSACAO_INVALIDA", "mensagem": erro})
+
+        inicio = time.perf_counter()
+        seq = None
+        database = payload.get("database") or self.db.db_sessao
+        itens = [(c["sql"].strip(), c.get("parametros")) for c in comandos]
+        planos = [self.plano_linhas(sql, classificar(sql), database) for sql, _ in itens] if fim == "COMMIT" else []
+        with self.lock_escrita:
+            if not self.lease_valido(): return self.resposta_sem_lease()
+            res = self.db.executar_transacao(itens, database=database, confirmar=fim == "COMMIT", planos=planos if any(planos) else None)
+            imagens = res.pop("imagens", None) or [None] * len(itens)
+            # Leituras da transação já responderam aqui: as réplicas só precisam das escritas
+            # (e, das capturadas por linhas, só das que mudaram alguma)
+            escritas = [(sql, p, imagem) for (sql, p), imagem in zip(itens, imagens) if classificar(sql).escrita
+                        and (imagem is None or imagem["gravar"] or imagem["apagar"])]
+            if res["status"] == "OK" and fim == "COMMIT" and escritas:
+                for sql, _, _ in escritas: self.invalidar_cache(sql, database)
+                seq = self.replicar_transacao(escritas, database)
+        if seq is not None:
+            if modo != "async":
+                res["replicacao"] = self.aguardar_replicacao(seq, modo, payload.get("timeout_replicacao", REPL_TIMEOUT_ACK))
+            self.latencias_escrita[modo].observar((time.perf_counter() - inicio) * 1000)
+        if res["status"] == "OK":
+            res["mensagem"] = "Transação confirmada" if fim == "COMMIT" else "Transação desfeita"
+        return self.criar_mensagem("QUERY_RESP", res)
+
+    def ler_local(self, sql, parametros=None, usar_cache=True, database=None):
+        """Leitura no MySQL local; com o cache ligado, SELECTs repetidos nem chegam ao banco."""
+        def executar():
+            if parametros is not None: return self.db.executar_preparado(sql, parametros, database=database)
+            return self.db.executar_query(sql, database=database)
+
+        if self.cache is None or not usar_cache or not CacheResultados.cacheavel(sql): return executar()
+        database = database or self.db.db_sessao
+        tabelas = frozenset(tabelas_leitura(sql, database))
+        if not tabelas: return executar()
+        chave = CacheResultados.chave(sql, database, parametros)
+        res = self.cache.buscar(chave)
+        if res is not None: return res
+        versao = self.cache.versao(tabelas)
+        res = executar()
+        if res.get("status") == "OK": self.cache.guardar(chave, res, tabelas, versao)
+        return res
+
+    def invalidar_cache(self, sql, database):
+        """Chamado depois de cada escrita aplicada neste nó (local, replicada ou de catch-up)."""
+        if self.cache is None or sql is None or classificar(sql).tipo == "USE": return
+        self.cache.invalidar(tabelas_escrita(sql, database))
+
+    def encaminhar_ao_master(self, payload, sql):
+        """Repassa o QUERY_REQ; se o Master não conhece o comando preparado, reenvia com o SQL."""
+        resp = self.enviar_mensagem(self.coordenador_id, "QUERY_REQ", payload, esperar_resposta=True, timeout=TIMEOUT_QUERY)
+        if resp and resp["payload"].get("codigo") == "COMANDO_DESCONHECIDO":
+            resp = self.enviar_mensagem(self.coordenador_id, "QUERY_REQ", dict(payload, sql=sql),
+                                        esperar_resposta=True, timeout=TIMEOUT_QUERY)
+        return resp if resp else self.criar_mensagem("ERRO", {"mensagem": "Master OFF"})
+
+    def gerar_stream_query(self, stream_id, sql, payload, params=None):
+        """
+        Leitura paginada: QUERY_PAGINA com no máximo 'janela' páginas sem STREAM_ACK;
+        QUERY_FIM (ou ERRO) fecha o stream. Memória limitada dos dois lados.
+        """
+        janela = threading.Semaphore(payload.get("janela", QUERY_JANELA))
+        self.fluxos[stream_id] = janela
+        with self.lock_carga: self.em_voo += 1
+        total = 0
+        try:
+            for pagina in self.db.iterar_query(sql, payload["paginar"], database=payload.get("database"), params=params):
+                if not janela.acquire(timeout=TIMEOUT_QUERY):
+                    raise TimeoutError("Cliente parou de confirmar páginas")
+                if stream_id not in self.fluxos:
+                    log.debug("[REQ] Stream %s cancelado pelo cliente", stream_id)
+                    return
+                total += len(pagina["linhas"])
+                yield self.criar_mensagem("QUERY_PAGINA", pagina)
+            yield dict(self.criar_mensagem("QUERY_FIM", {"status": "OK", "linhas": total}), fim_stream=True)
+        except Exception as e:
+            log.warning("[REQ] Leitura paginada abortada: %s", e)
+            yield dict(self.criar_mensagem("ERRO", {"mensagem": str(e)}), fim_stream=True)
+        finally:
+            self.fluxos.pop(stream_id, None)
+            with self.lock_carga: self.em_voo -= 1
+
+    # --------- Métricas -----------
+    def _timeouts_por_modo(self):
+        with self.lock_carga:
+            return {(("modo", modo),): n for modo, n in self.timeouts_replicacao.items()}
+
+    def registrar_metricas(self):
+        """O que já é medido em outros lugares entra no registro; o resto é lido na hora da exportação."""
+        m = self.metricas
+        m.registrar("bytes_recebidos", BYTES_RECEBIDOS, "Bytes de frames recebidos pelo processo")
+        m.registrar("bytes_enviados", BYTES_ENVIADOS, "Bytes de frames enviados pelo processo")
+        for modo, h in self.latencias_escrita.items():
+            m.registrar("escrita_ms", h, "Escritas no Master: execução + espera pelos ACKs", modo=modo)
+        m.medidor("timeouts_replicacao", self._timeouts_por_modo, "Escritas que responderam TIMEOUT esperando ACKs")
+        m.medidor("conexoes_abertas", lambda: self.conexoes_abertas, "Conexões aceitas ainda abertas")
+        m.medidor("em_voo", lambda: self.em_voo, "Consultas em execução")
+        m.medidor("pool_em_uso", lambda: self.db.pool.em_uso()[0], "Conexões MySQL emprestadas do pool")
+        m.medidor("seq", lambda: self.wal.ultimo_seq, "Último seq do log de replicação")
+        m.medidor("eh_master", lambda: int(self.eh_lider()), "1 se este nó é o Master confirmado")
+        m.medidor("atraso_seq", lambda: self.atraso()[0], "Entradas do Master ainda não aplicadas aqui")
+        m.medidor("atraso_s", lambda: self.atraso()[1], "Idade da última entrada aplicada quando há atraso")
+        # Master: atraso de cada réplica no pipeline
+        m.medidor("peer_atraso_seq", lambda: self._por_peer("atraso_seq"), "Entradas enfileiradas sem ACK, por réplica")
+        m.medidor("peer_atraso_s", lambda: self._por_peer("atraso_s"), "Idade da entrada mais antiga sem ACK, por réplica")
+        m.medidor("peer_rtt_ms", lambda: self._por_peer("rtt_ms"), "RTT do último lote, por réplica")
+        m.medidor("sync_linhas_por_s", lambda: (self.ultima_sincronizacao or {}).get("linhas_por_s"),
+                  "Vazão do último restore completo recebido")
+
+    def _por_peer(self, campo):
+        return {(("peer", peer),): dados[campo] for peer, dados in self.pipeline.metricas().items()}
+
+    def processar_medido(self, msg):
+        """processar_mensagem contando mensagens, erros e latência por tipo; num stream, até o último frame."""
+        tipo, inicio = msg.get("tipo"), time.perf_counter()
+        self.metricas.contador("mensagens", "Mensagens recebidas, por tipo", tipo=tipo).somar()
+        stream = False
+        try:
+            response = self.processar_mensagem(msg)
+            if inspect.isgenerator(response):
+                stream = True
+                return self._medir_stream(response, tipo, inicio)
+            return response
+        except Exception:
+            self.metricas.contador("mensagens_erro", "Mensagens que terminaram em exceção, por tipo", tipo=tipo).somar()
+            raise
+        finally:
+            if not stream: self._observar_mensagem(tipo, inicio)
+
+    def _medir_stream(self, frames, tipo, inicio):
+        try:
+            yield from frames
+        finally:
+            self._observar_mensagem(tipo, inicio)
+
+    def _observar_mensagem(self, tipo, inicio):
+        self.metricas.histograma("mensagem_ms", "Latência de processamento, por tipo de mensagem",
+                                 tipo=tipo).observar((time.perf_counter() - inicio) * 1000)
+
+    def iniciar_metricas_http(self):
+        porta = self.porta_metricas
+        if not porta: return None
+        try:
+            servidor = servir_prometheus(self.metricas, porta, self.config['ip'])
+        except OSError as e:
+            log.warning("[METRICAS] Não foi possível abrir a porta %s: %s", porta, e)
+            return None
+        log.info("[METRICAS] Prometheus em http://%s:%s/metrics", self.config['ip'], porta)
+        return servidor
+
+    # --------- Carga e atraso (roteamento de leituras) -----------
+    def atraso(self):
+        """
+        (atraso em seqs, atraso em segundos) desta réplica em relação ao Master.
+        Segundos = idade da última entrada aplicada quando há entradas faltando, ou o tempo
+        sem notícias do Master se ele sumiu; None se não dá para estimar (ainda sem entradas).
+        """
+        if self.id == self.coordenador_id: return 0, 0.0
+        atraso_seq = max(0, self.seq_coordenador - self.wal.ultimo_seq)
+        atraso_s = 0.0
+        if atraso_seq:
+            atraso_s = round(time.time() - self.ts_aplicado, 3) if self.ts_aplicado else None
+        silencio = time.monotonic() - self.contato_coordenador
+        if silencio > LIMITE_SILENCIO and atraso_s is not None:
+            atraso_s = round(max(atraso_s, silencio), 3)
+        return atraso_seq, atraso_s
+
+    def carga(self):
+        """Publicado no VIVO: o que o cliente precisa para escolher o nó de uma leitura."""
+        atraso_seq, atraso_s = self.atraso()
+        pool_em_uso, pool_max = self.db.pool.em_uso()
+        return {"id": self.id, "coordenador": self.coordenador_id, "em_voo": self.em_voo,
+                "pool_em_uso": pool_em_uso, "pool_max": pool_max, "seq": self.wal.ultimo_seq,
+                "atraso_seq": atraso_seq, "atraso_s": atraso_s, "membros": list(self.membros.versao)}
+
+    def leitura_precisa_do_master(self, payload):
+        if payload.get("ler_proprias_escritas"): return True
+        limite = payload.get("max_atraso_s")
+        if limite is None: return False
+        atraso_s = self.atraso()[1]
+        return atraso_s is None or atraso_s > limite
+
+    def registrar_contato_coordenador(self, seq):
+        self.seq_coordenador = max(self.seq_coordenador, seq)
+        self.contato_coordenador = time.monotonic()
+
+    # --------- Sync em streaming -----------
+    def gerar_stream_sync(self, stream_id, payload):
+        """
+        Gera SYNC_CHUNK a partir do dump em streaming, com controle de fluxo: no máximo
+        'janela' chunks em voo sem ACK. O último frame (SYNC_FIM ou ERRO) fecha o stream.
+        """
+        janela = threading.Semaphore(payload.get("janela", SYNC_JANELA))
+        self.fluxos[stream_id] = janela
+        enviados = 0
+        # Seq do log no instante do snapshot: o receptor continua o catch-up a partir dele
+        posicao = {}
+        retomar = payload.get("retomar")
+        def marcar_snapshot():
+            posicao.update(seq=self.wal.ultimo_seq, termo=self.wal.posicao()[0])
+            # Retomar só no mesmo ponto do log: com escritas no meio o resto do dump viria de outro
+            # snapshot e o catch-up reaplicaria nele entradas que ele já contém. Aí recomeça do zero.
+            return not retomar or (retomar.get("seq"), retomar.get("termo")) == (posicao["seq"], posicao["termo"])
+        try:
+            dump = self.db.iterar_dump(payload.get("tamanho_chunk", SYNC_CHUNK_LINHAS), retomar,
+                                       trava=self.lock_escrita, ao_iniciar=marcar_snapshot)
+            for chunk in dump:
+                if not janela.acquire(timeout=TIMEOUT_SYNC):
+                    raise TimeoutError("Receptor parou de confirmar chunks")
+                if stream_id not in self.fluxos:
+                    log.info("[SYNC] Stream %s cancelado pelo receptor", stream_id)
+                    return
+                enviados += 1
+                yield self.criar_mensagem("SYNC_CHUNK", dict(chunk, seq=posicao["seq"], termo=posicao["termo"]))
+            yield dict(self.criar_mensagem("SYNC_FIM", {"chunks": enviados, "seq": posicao.get("seq", 0),
+                                                        "termo": posicao.get("termo", 0)}), fim_stream=True)
+        except Exception as e:
+            log.warning("[SYNC] Stream %s abortado: %s", stream_id, e)
+            yield dict(self.criar_mensagem("ERRO", {"mensagem": str(e)}), fim_stream=True)
+        finally:
+            self.fluxos.pop(stream_id, None)
+
+    def aplicar_chunk(self, chunk):
+        """O primeiro chunk de uma tabela recria a tabela; os seguintes só acrescentam linhas."""
+        if self.cache and chunk["table"]: self.cache.invalidar({(chunk["database"].lower(), chunk["table"].lower())})
+        return self.db.restaurar_tabela(chunk["database"], chunk["table"], chunk.get("schema"),
+                                        chunk["colunas"], [tuple(l) for l in chunk["linhas"]],
+                                        RESTORE_LOTE, recriar=chunk["chunk"] == 0)
+
+    def sincronizar_stream(self, coord):
+        """
+        Recebe o dump do coordenador em chunks, aplicando cada um assim que chega.
+        Se a conexão cair, retoma a partir do último chunk aplicado e confirmado; se o Master
+        já tiver escrito depois do snapshot, ele manda tudo de novo a partir de um snapshot novo.
+        """
+        log.info("[SYNC START] Iniciando restore em streaming...")
+        inicio = time.perf_counter()
+        retomar = None
+        total_linhas = 0
+        seq_snapshot = termo_snapshot = None
+        for tentativa in range(SYNC_TENTATIVAS):
+            payload = {"stream": True, "tamanho_chunk": SYNC_CHUNK_LINHAS, "janela": SYNC_JANELA, "retomar": retomar}
+            stream = None
+            try:
+                for frame in self.enviar_stream(coord, "SYNC_REQ", payload, timeout=TIMEOUT_SYNC):
+                    stream = frame.get("req_id", stream)
+                    if frame["tipo"] == "SYNC_CHUNK":
+                        chunk = frame["payload"]
+                        snapshot = (chunk["seq"], chunk.get("termo", 0))
+                        if snapshot != (seq_snapshot, termo_snapshot):
+                            # Primeiro chunk, ou o Master recomeçou o dump num snapshot novo (todas as tabelas de novo)
+                            if seq_snapshot is not None:
+                                log.info("[SYNC] Snapshot mudou (seq %s -> %s): dump recomeçou do início", seq_snapshot, snapshot[0])
+                            seq_snapshot, termo_snapshot = snapshot
+                            total_linhas = 0
+                        total_linhas += self.aplicar_chunk(chunk)
+                        retomar = {"database": chunk["database"], "table": chunk["table"], "chunk": chunk["chunk"],
+                                   "ate": chunk.get("ate"), "ultimo": chunk.get("ultimo", False),
+                                   "seq": seq_snapshot, "termo": termo_snapshot}
+                        self.enviar_mensagem(coord, "STREAM_ACK", {"stream": frame["req_id"]})
+                        if chunk["ultimo"] and chunk["table"]:
+                            log.info("   -> %s.%s: %d chunks aplicados", chunk["database"], chunk["table"], chunk["chunk"] + 1)
+                    elif frame["tipo"] == "SYNC_FIM":
+                        # Mesmo snapshot dos chunks deste stream (e o único, se a retomada não trouxe nenhum chunk)
+                        seq_snapshot, termo_snapshot = frame["payload"]["seq"], frame["payload"].get("termo", 0)
+                        segundos = time.perf_counter() - inicio
+                        taxa = total_linhas / segundos if segundos > 0 else 0.0
+                        log.info("[SYNC END] Sincronização Finalizada! %d linhas em %.2fs (%.0f linhas/s)",
+                                 total_linhas, segundos, taxa)
+                        return {"linhas": total_linhas, "segundos": round(segundos, 3), "linhas_por_s": round(taxa, 1),
+                                "seq": seq_snapshot, "termo": termo_snapshot}
+                    else:
+                        log.warning("[SYNC] Master respondeu %s: %s", frame["tipo"], frame.get("payload"))
+                        break
+            except Exception as e:
+                log.warning("[SYNC] Stream interrompido (%s). Retomando de %s...", e, retomar)
+                # Se o stream ainda está vivo no Master, ele não fica esperando ACK (até TIMEOUT_SYNC)
+                if stream is not None: self.enviar_mensagem(coord, "STREAM_ACK", {"stream": stream, "cancelar": True})
+            time.sleep(min(2 ** tentativa, 10))
+        return None
+
+    # --------- Replicação -----------
+    def replicar_dados(self, sql, database=None, stmt_id=None, parametros=None):
+        """
+        Grava no log (ganha o próximo seq) e envia às réplicas. Chamado com lock_escrita.
+        Comando preparado vai como id + parâmetros; o SQL segue uma vez por lote.
+        """
+        if stmt_id:
+            entrada = {"stmt_id": stmt_id, "parametros": parametros, "database": database, "ts": time.time()}
+        else:
+            entrada = {"sql": sql, "database": database, "ts": time.time()}
+        return self._replicar(entrada)
+
+    def replicar_transacao(self, itens, database=None):
+        """
+        Transação do cliente: uma entrada só do log, com todos os comandos [(sql, parametros, imagem)].
+        Comando com imagem vai como as linhas que ele deixou. Chamado com lock_escrita.
+        """
+        comandos = [{"linhas": imagem} if imagem is not None
+                    else {"stmt_id": self.comandos.registrar(sql), "parametros": parametros} if parametros is not None
+                    else {"sql": sql} for sql, parametros, imagem in itens]
+        return self._replicar({"transacao": comandos, "database": database, "ts": time.time()})
+
+    def replicar_linhas(self, imagem, database=None):
+        """Escrita não determinística: vai como as linhas que ela deixou no Master. Chamado com lock_escrita."""
+        return self._replicar({"linhas": imagem, "database": database, "ts": time.time()})
+
+    def plano_linhas(self, sql, classe, database):
+        """Plano de captura de linhas (replicacao_linhas.planejar) se a escrita precisa dele; senão None."""
+        if not REPL_LINHAS or not classe.escrita: return None
+        return planejar(sql, classe, self.db.esquema, database)
+
+    def _replicar(self, entrada):
+        entrada["termo"] = self.lider_termo
+        seq = self.wal.registrar(entrada)
+        self.difundir_replicacao(dict(entrada, seq=seq))
+        return seq
+
+    def modo_consistencia(self, payload, classes, database):
+        """
+        Modo de uma escrita: o da requisição; senão o mais forte entre as tabelas que ela escreve
+        (as sem modo próprio valem o do cluster); sem tabelas conhecidas, o do cluster.
+        """
+        if payload.get("consistencia"): return payload["consistencia"]
+        tabelas = [t for classe in classes for t in (classe.tabelas_escritas or ())]
+        if not self.consistencia_tabelas or not tabelas: return self.consistencia
+        modos = [self.consistencia_tabelas.get(f"{banco or database}.{tabela}".lower(),
+                                               self.consistencia_tabelas.get(tabela.lower(), self.consistencia))
+                 for banco, tabela in tabelas]
+        return max(modos, key=MODOS_CONSISTENCIA.index)
+
+    def aguardar_replicacao(self, seq, modo, timeout=REPL_TIMEOUT_ACK):
+        """
+        quorum: maioria dos votantes (o Master conta como um voto); all: todos os votantes.
+        Réplicas de leitura (JOIN) não contam: um próximo Master eleito pode não ter o que só elas têm.
+        A escrita já está commitada no Master: em TIMEOUT ela continua valendo e segue
+        sendo replicada, o cliente só fica sabendo que a durabilidade pedida não foi confirmada.
+        """
+        votantes = set(self.peers_votantes())
+        if modo == "quorum":
+            necessarios = self.maioria() - (1 if self.membros.eh_votante(self.id) else 0)
+        else:
+            necessarios = len(votantes)
+        acks = self.pipeline.aguardar(seq, necessarios, timeout, votantes)
+        status = "OK" if acks >= necessarios else "TIMEOUT"
+        if status == "TIMEOUT":
+            with self.lock_carga: self.timeouts_replicacao[modo] += 1
+            log.warning("[MASTER] seq %d: %d/%d ACKs em %.1fs (%s)", seq, acks, necessarios, timeout, modo)
+        return {"modo": modo, "seq": seq, "acks": acks, "necessarios": necessarios, "status": status}
+
+    def difundir_replicacao(self, payload):
+        # Só enfileira: as threads do pipeline mandam em lotes, na ordem do seq
+        self.pipeline.enfileirar(payload)
+
+    def enviar_lote_replicacao(self, peer, lote):
+        """
+        Usado pelo pipeline. Retorna o seq confirmado pela réplica ou None. O lote leva o termo
+        em que as entradas foram geradas e o (seq, termo) da entrada anterior (log-matching).
+        """
+        anterior = lote[0]["seq"] - 1
+        termo_anterior = self.wal.termo_em(anterior)
+        payload = {"entradas": lote, "comandos": self.comandos.resolver(lote), "termo": lote[-1].get("termo", 0),
+                   "anterior": {"seq": anterior, "termo": termo_anterior} if termo_anterior is not None else None}
+        resp = self.enviar_mensagem(peer, "REPLICACAO_LOTE", payload, esperar_resposta=True, timeout=TIMEOUT_QUERY)
+        if resp and resp["tipo"] == "ACK": return resp["payload"].get("seq")
+        if resp and resp["tipo"] == "REJEITADO": self.termo_superado(resp["payload"])
+        return None
+
+    def comando_da_entrada(self, entrada):
+        """(sql, database, parametros) de uma entrada do log; comandos preparados são resolvidos pelo id."""
+        if "stmt_id" in entrada:
+            return self.comandos.sql(entrada["stmt_id"]), entrada.get("database"), entrada["parametros"]
+        return entrada["sql"], entrada.get("database"), None
+
+    def comandos_da_entrada(self, entrada):
+        """
+        [(sql, database, parametros), ...]: um item, os comandos de uma transação ou os que aplicam
+        uma imagem de linhas (sql None = id desconhecido).
+        """
+        if "linhas" in entrada: return comandos_das_linhas(entrada["linhas"])
+        if "transacao" not in entrada: return [self.comando_da_entrada(entrada)]
+        comandos = []
+        for c in entrada["transacao"]:
+            if "linhas" in c: comandos += comandos_das_linhas(c["linhas"])
+            else: comandos.append(self.comando_da_entrada(dict(c, database=entrada.get("database"))))
+        return comandos
+
+    def aplicar_entrada(self, entrada):
+        """
+        Réplica: aplica uma entrada do log do Master e registra o seq no log local.
+        True = aplicada, False = duplicada, None = falhou aqui e não foi registrada (quem chamou
+        para de aplicar e recupera: o catch-up tenta de novo, e se falhar outra vez, dump completo).
+        """
+        with self.lock_aplicacao:
+            if entrada["seq"] <= self.wal.ultimo_seq: return False  # Duplicada
+            comandos = self.comandos_da_entrada(entrada)
+            sql, database, parametros = comandos[0]
+            if any(c[0] is None for c in comandos):
+                res = {"status": "ERRO", "mensagem": "Comando preparado desconhecido"}
+            elif "transacao" in entrada or "linhas" in entrada:
+                res = self.db.executar_transacao([(c[0], c[2]) for c in comandos], database=database)
+            elif parametros is not None:
+                res = self.db.executar_preparado(sql, parametros, database=database)
+            else:
+                res = self.db.executar_query(sql, database=database)
+            for sql, database, _ in comandos: self.invalidar_cache(sql, database or self.db.db_sessao)
+            if res.get("status") == "ERRO":
+                log.warning("[REPLICA] seq %d falhou localmente: %s", entrada["seq"], res.get("mensagem"))
+                return None
+            self.wal.registrar({k: v for k, v in entrada.items() if k != "seq"}, seq=entrada["seq"])
+            self.ts_aplicado = entrada.get("ts", self.ts_aplicado)
+            return True
+
+    def aplicar_lote(self, entradas):
+        """
+        Réplica: group commit de um lote contíguo de entradas (um COMMIT e um fsync do log).
+        Só o prefixo aplicado vai para o log; retorna False se alguma entrada ficou de fora
+        (falhou aqui ou usa um comando preparado desconhecido): quem chamou recupera pelo catch-up.
+        """
+        with self.lock_aplicacao:
+            validas, itens = [], []
+            for entrada in entradas:
+                comandos = self.comandos_da_entrada(entrada)
+                if any(c[0] is None for c in comandos):
+                    # O catch-up traz o SQL junto com as entradas
+                    log.warning("[REPLICA] seq %d: comando preparado desconhecido", entrada["seq"])
+                    break
+                validas.append(entrada)
+                # Transação ou imagem de linhas: a lista inteira vira um item (tudo ou nada dentro do COMMIT do lote)
+                itens.append(comandos if "transacao" in entrada or "linhas" in entrada else comandos[0])
+            resultados = self.db.executar_lote(itens) if itens else []
+            for item in itens[:len(resultados)]:
+                for sql, database, _ in (item if isinstance(item, list) else [item]):
+                    self.invalidar_cache(sql, database or self.db.db_sessao)
+            aplicadas = []
+            for entrada, res in zip(validas, resultados):
+                if res["status"] == "ERRO":
+                    log.warning("[REPLICA] seq %d falhou localmente: %s", entrada["seq"], res.get("mensagem"))
+                    break
+                aplicadas.append(entrada)
+            if aplicadas:
+                self.wal.registrar_lote(aplicadas)
+                self.ts_aplicado = aplicadas[-1].get("ts", self.ts_aplicado)
+            return len(aplicadas) == len(entradas)
+
+    def _tratar_buraco(self, origem, seq_recebido, situacao="buraco"):
+        # Perdemos mensagens, sobrou um sufixo de termo antigo ou uma entrada falhou aqui: o delta resolve
+        # os três casos (a entrada que falhou é tentada de novo; falhando outra vez, vai o dump completo)
+        motivo = {"buraco": "Buraco no log", "divergente": "Divergência no log"}.get(situacao, "Entrada não aplicada")
+        log.warning("[REPLICA] %s (local=%d, recebido=%d). Pedindo delta...", motivo, self.wal.ultimo_seq, seq_recebido)
+        if self.recuperar_atraso(origem) is None:
+            log.warning("[REPLICA] Delta indisponível; ressincronizando tudo.")
+            # Fora da thread da conexão: ela precisa continuar lendo enquanto o dump corre
+            self.sincronizando.set()
+            threading.Thread(target=self.sincronizar_completo, args=(origem,), daemon=True).start()
+
+    def receber_replicacao(self, origem, entrada):
+        self.registrar_contato_coordenador(entrada["seq"])
+        # Durante um dump completo o catch-up do final (a partir do seq do snapshot) cobre esta entrada
+        if self.sincronizando.is_set(): return
+        with self.lock_aplicacao:
+            if entrada["seq"] > self.wal.ultimo_seq + 1:
+                self._tratar_buraco(origem, entrada["seq"])
+                return
+            if self.aplicar_entrada(entrada) is None: self._tratar_buraco(origem, entrada["seq"], "falha")
+
+    def receber_lote(self, origem, entradas, anterior=None):
+        if entradas: self.registrar_contato_coordenador(entradas[-1]["seq"])
+        if self.sincronizando.is_set(): return
+        with self.lock_aplicacao:
+            situacao = self._conferir_log(entradas, anterior)
+            if situacao != "ok":
+                self._tratar_buraco(origem, entradas[0]["seq"], situacao)
+                return
+            novas = [e for e in entradas if e["seq"] > self.wal.ultimo_seq]
+            if novas and not self.aplicar_lote(novas):
+                self._tratar_buraco(origem, self.wal.ultimo_seq + 1, "falha")
+
+    def _conferir_log(self, entradas, anterior):
+        """
+        Log-matching do lote com o log local: "ok", "buraco" (faltam entradas antes dele) ou
+        "divergente" (no último seq que os dois têm, o termo é outro: sobrou aqui um sufixo
+        de um Master deposto, que precisa sair antes de aplicar o lote).
+        """
+        if not entradas: return "ok"
+        ultimo = self.wal.ultimo_seq
+        if entradas[0]["seq"] > ultimo + 1: return "buraco"
+        termos = {e["seq"]: e.get("termo", 0) for e in entradas}
+        if anterior: termos[anterior["seq"]] = anterior["termo"]
+        ponto = min(ultimo, entradas[-1]["seq"])
+        local = self.wal.termo_em(ponto)
+        if ponto not in termos or local is None or local == termos[ponto]: return "ok"
+        return "divergente"
+
+    def recuperar_atraso(self, coord):
+        """
+        Catch-up incremental: pede ao coordenador só as entradas depois do último seq aplicado.
+        Retorna quantas foram aplicadas, ou None se o log do coordenador já foi truncado, ele
+        não respondeu ou uma entrada falhou de novo aqui: só um dump completo resolve.
+        """
+        aplicadas = 0
+        with self.lock_aplicacao:
+            while True:
+                pedido = {"desde": self.wal.ultimo_seq, "termo": self.wal.termo_em(self.wal.ultimo_seq)}
+                resp = self.enviar_mensagem(coord, "CATCHUP_REQ", pedido, esperar_resposta=True, timeout=TIMEOUT_SYNC)
+                if not resp or resp["tipo"] != "CATCHUP_DATA" or resp["payload"].get("truncado"):
+                    return None
+                if resp["payload"].get("divergente"):
+                    if self.descartar_divergencia(coord, resp["payload"]) is None: return None
+                    continue
+                self.comandos.registrar_varios(resp["payload"].get("comandos"))
+                for entrada in resp["payload"]["entradas"]:
+                    aplicada = self.aplicar_entrada(entrada)
+                    if aplicada is None: return None  # Nem o Master reenviando resolve: dump completo
+                    if aplicada: aplicadas += 1
+                if not resp["payload"].get("mais"): break
+        log.info("[CATCHUP] %d escritas recuperadas do Master %s (seq local=%d)", aplicadas, coord, self.wal.ultimo_seq)
+        return aplicadas
+
+    def descartar_divergencia(self, coord, remoto):
+        """
+        Tira do log local o sufixo que o Master não tem (escritas de um Master deposto que não
+        chegaram à maioria). Elas já foram aplicadas no banco: a anti-entropia compara as
+        tabelas que elas tocaram e traz as faixas do Master. None se o ponto comum já saiu do log.
+        """
+        ponto = self.wal.ponto_comum(remoto["termos"], remoto["ultimo_seq"])
+        if ponto is None: return None
+        descartadas = self.wal.truncar(ponto)
+        tabelas = set()
+        for sql, database, _ in (c for entrada in descartadas for c in self.comandos_da_entrada(entrada)):
+            afetadas = tabelas_escrita(sql, database or self.db.db_sessao) if sql else None
+            if afetadas is None:
+                tabelas = None
+                break
+            tabelas |= afetadas
+        log.warning("[REPLICA] %d entradas de termo antigo descartadas do log (seq %d em diante); reconciliando %s",
+                    len(descartadas), ponto + 1, "todas as tabelas" if tabelas is None else sorted(".".join(t) for t in tabelas))
+        if self.cache: self.cache.invalidar(tabelas)
+        if descartadas: self.anti_entropia.verificar(coord, tabelas)
+        return len(descartadas)
+
+    def sincronizar_completo(self, coord):
+        """Dump completo em streaming; o log local recomeça no seq do snapshot do Master."""
+        self.sincronizando.set()
+        try:
+            resultado = self.sincronizar_stream(coord)
+            if resultado is None: return None
+            self.ultima_sincronizacao = resultado
+            with self.lock_aplicacao:
+                self.wal.reiniciar(resultado["seq"], resultado["termo"])
+        finally:
+            self.sincronizando.clear()
+        # Escritas que chegaram ao Master durante o dump
+        self.recuperar_atraso(coord)
+        return resultado
             
-    def iniciar_eleicao(self):
-        print(f"[ELEIÇÃO] Iniciando...")
-        sou_o_maior = True
-        for peer in self.peers:
-            if int(peer) > int(self.id):
-                resp = self.enviar_mensagem(peer, "ELEICAO", esperar_resposta=True)
-                if resp and resp["tipo"] == "VIVO":
-                    sou_o_maior = False
+    # --------- Membros -----------
+    def membros_mudaram(self, adicionados, removidos):
+        """Conexões, detector e pipeline acompanham a visão nova."""
+        for nid in list(adicionados) + list(removidos):
+            with self.lock_conexoes: conn = self.conexoes.pop(nid, None)
+            if conn: conn.fechar()
+        for nid in removidos: self.detector.esquecer(nid)
+        for nid in adicionados:
+            if nid != self.id: self.detector.reiniciar(nid)
+        self.pipeline.ajustar(self.peers)
+
+    def difundir_membros(self):
+        """Master: manda a visão nova a todos; quem perder a mensagem a busca ao ver a versão no gossip."""
+        visao = self.membros.visao()
+        for peer in self.peers: self.envios_gossip.submit(self.enviar_mensagem, peer, "MEMBROS", visao)
+
+    def buscar_membros(self):
+        """Algum nó publicou no gossip uma visão mais nova que a nossa: pede a ele."""
+        versao, no = max(((versao_de(self.detector.info_de(p).get("membros")), p) for p in self.peers), default=((0, 0), None))
+        if versao <= self.membros.versao or self.membros_pendente is not None and not self.membros_pendente.done(): return
+        def buscar():
+            resp = self.enviar_mensagem(no, "MEMBROS_REQ", esperar_resposta=True)
+            if resp and resp["tipo"] == "MEMBROS":
+                mudancas = self.membros.aplicar(resp["payload"])
+                if mudancas: self.membros_mudaram(*mudancas)
+        self.membros_pendente = self.envios_gossip.submit(buscar)
+
+    def entrar_no_cluster(self, coord):
+        """Nó fora da visão (réplica nova): JOIN no Master com o próprio endereço; a resposta é a visão."""
+        endereco = {"id": self.id, "ip": self.config["ip"], "porta": self.config["porta"], "db_host": self.config["db_host"]}
+        resp = self.enviar_mensagem(coord, "JOIN", endereco, esperar_resposta=True)
+        if not resp or resp["tipo"] != "MEMBROS":
+            log.warning("[JOIN] Master %s recusou a entrada: %s", coord, resp and resp["payload"].get("mensagem"))
+            return False
+        mudancas = self.membros.aplicar(resp["payload"])
+        if mudancas: self.membros_mudaram(*mudancas)
+        log.info("[JOIN] Entrei como réplica de leitura (membros versão %s: %s)", self.membros.versao, sorted(self.membros.ids()))
+        return True
+
+    def sair_do_cluster(self):
+        """Réplica de leitura encerrando: LEAVE no Master (votantes só saem pela configuração)."""
+        if self.membros.eh_votante(self.id) or self.id not in self.membros or self.eh_lider(): return
+        resp = self.enviar_mensagem(self.coordenador_id, "LEAVE", {"id": self.id}, esperar_resposta=True)
+        if resp and resp["tipo"] == "MEMBROS": log.info("[MEMBROS] Saí do cluster (versão %s)", resp["payload"]["versao"])
+
+    # --------- Termos, lease e eleição -----------
+    def _carregar_termo(self):
+        try:
+            with open(self.arquivo_termo, encoding="utf-8") as f:
+                dados = json.load(f)
+            return dados["termo"], dados.get("voto")
+        except (OSError, ValueError, KeyError):
+            return 0, None
+
+    def _gravar_termo(self, termo, voto):
+        """Chamado com lock_termo, antes de responder: um nó reiniciado não vota duas vezes no mesmo termo."""
+        temporario = self.arquivo_termo + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump({"termo": termo, "voto": voto}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, self.arquivo_termo)
+        self.termo, self.voto = termo, voto
+        self.termo_visto = max(self.termo_visto, termo)
+
+    def maioria(self):
+        """Só os votantes da configuração contam: réplicas que entram e saem não mexem na maioria."""
+        return len(self.membros.votantes()) // 2 + 1
+
+    def peers_votantes(self):
+        return [peer for peer in self.peers if self.membros.eh_votante(peer)]
+
+    def eh_lider(self):
+        return self.coordenador_id == self.id and self.lider_termo == self.termo
+
+    def lease_valido(self):
+        return self.eh_lider() and time.monotonic() < self.lease_ate
+
+    def lider_ativo(self):
+        """Promessa do lease: ouvimos o Master há menos de DURACAO_LEASE, então não aceitamos outro."""
+        if self.eh_lider(): return time.monotonic() < self.lease_ate
+        return self.coordenador_id != self.id and time.monotonic() - self.contato_coordenador < DURACAO_LEASE
+
+    def seguir(self, lider, termo):
+        """Passa a seguir 'lider' no 'termo' (>= o atual). Chamado com lock_termo."""
+        if self.eh_lider() and lider != self.id:
+            log.warning("[MASTER] %s é Master no termo %d: deixando a liderança.", lider, termo)
+            self.pipeline.descartar()
+        if termo != self.termo or self.voto != lider: self._gravar_termo(termo, lider)
+        if lider != self.id:
+            self.lider_termo = None
+            self.lease_ate = 0.0
+        if self.coordenador_id != lider:
+            log.info("[INFO] Novo Master: %s (termo %d)", lider, termo)
+            self.seq_coordenador = 0  # Seqs do Master anterior não valem para o novo
+        self.coordenador_id = lider
+        self.detector.reiniciar(lider)
+        self.contato_coordenador = time.monotonic()
+
+    def aceitar_lider(self, origem, termo):
+        """
+        Replicação só de quem ganhou um termo >= o nosso (só quem ganhou replica, e só um
+        ganha cada termo). Termo maior, ou o mesmo vindo de outro nó, faz seguir o remetente.
+        """
+        with self.lock_termo:
+            if termo < self.termo:
+                log.warning("[FENCING] Replicação de %s no termo %d recusada (termo atual %d)", origem, termo, self.termo)
+                return False
+            if termo > self.termo or origem != self.coordenador_id: self.seguir(origem, termo)
+            return True
+
+    def termo_superado(self, resposta):
+        """Master recebeu REJEITADO: se há termo maior, deixa a liderança e segue quem a réplica segue."""
+        with self.lock_termo:
+            termo = resposta.get("termo", 0)
+            if termo <= self.termo: return
+            lider = resposta.get("coordenador")
+            if lider and lider != self.id:
+                self.seguir(lider, termo)
+                return
+            if self.eh_lider():
+                log.warning("[MASTER] Termo %d superado pelo %d: deixando a liderança.", self.termo, termo)
+                self.pipeline.descartar()
+            self._gravar_termo(termo, None)
+            self.lider_termo = None
+            self.lease_ate = 0.0
+
+    def avaliar_candidato(self, origem, pedido):
+        """Resposta a COORDENADOR: (aceito, motivo). Na sondagem só diz se aceitaria, sem mudar nada."""
+        termo = pedido.get("termo", 0)
+        if not self.membros.eh_votante(origem): return False, "votante"
+        with self.lock_termo:
+            if termo < self.termo or (termo == self.termo and self.voto not in (None, origem)): return False, "termo"
+            if origem != self.coordenador_id and self.lider_ativo(): return False, "lider_ativo"
+            if tuple(pedido.get("log") or (0, 0)) < self.wal.posicao(): return False, "log"
+            if not pedido.get("sondagem"): self.seguir(origem, termo)
+            return True, None
+
+    def candidatura(self, sondagem):
+        """Pedido de COORDENADOR; fora da sondagem grava o termo novo com o voto em si mesmo."""
+        with self.lock_termo:
+            termo = max(self.termo, self.termo_visto) + 1
+            if not sondagem: self._gravar_termo(termo, self.id)
+            return {"termo": termo, "log": self.wal.posicao(), "sondagem": sondagem}
+
+    def apurar(self, pedido, respostas):
+        """
+        Conta os votos (o próprio nó é um). Sem maioria, segue o Master ativo que algum peer
+        apontou; senão fica sem Master confirmado até a próxima candidatura.
+        """
+        votos = 1 + sum(1 for resp in respostas if resp and resp["tipo"] == "ACEITO")
+        if votos >= self.maioria(): return True
+        with self.lock_termo:
+            for resp in respostas:
+                if not resp or resp["tipo"] != "REJEITADO": continue
+                p = resp["payload"]
+                self.termo_visto = max(self.termo_visto, p.get("termo", 0))
+                lider = p.get("coordenador")
+                if p.get("motivo") == "lider_ativo" and lider not in (None, self.id) and \
+                        (p["termo"] > self.termo or (p["termo"] == self.termo and self.voto in (None, lider))):
+                    self.seguir(lider, p["termo"])
                     break
-        if sou_o_maior: self.tornar_coordenador()
-    
+        log.info("[ELEIÇÃO] %d de %d votos no termo %d%s: sem maioria.", votos, len(self.membros.votantes()), pedido["termo"],
+                 " (sondagem)" if pedido["sondagem"] else "")
+        return False
+
+    def assumir(self, pedido, inicio):
+        """Ganhou a votação: o lease conta do envio do pedido (quem aceitou prometeu a partir do recebimento)."""
+        with self.lock_termo:
+            if self.termo != pedido["termo"] or self.voto != self.id: return False  # Outro termo chegou no meio
+            self.coordenador_id = self.id
+            self.lider_termo = pedido["termo"]
+            self.lease_ate = inicio + DURACAO_LEASE
+            self.pipeline.descartar()
+        log.info("[MASTER] Assumindo Liderança! (termo %d)", pedido["termo"])
+        return True
+
+    def renovar_lease(self, batimento):
+        """
+        Cada nó publica no gossip o último batimento do Master que recebeu e não aceita outro
+        Master até DURACAO_LEASE depois de recebê-lo. O lease do Master vai até DURACAO_LEASE
+        depois do envio do batimento mais recente que a maioria já confirmou neste termo.
+        Só valem batimentos desta geração: um "visto" de antes de reiniciar não confirma nada.
+        """
+        agora = time.monotonic()
+        self.envios_batimento[batimento] = agora
+        while len(self.envios_batimento) > 4 * DURACAO_LEASE / INTERVALO_GOSSIP + 10:
+            self.envios_batimento.popitem(last=False)
+        if not self.eh_lider(): return
+        confirmados = [agora]
+        for peer in self.peers_votantes():
+            info = self.detector.info_de(peer)
+            if info.get("coordenador") == self.id and info.get("termo") == self.termo:
+                visto = info.get("visto")
+                if not isinstance(visto, list) or visto[0] != self.detector.geracao: continue
+                enviado = self.envios_batimento.get(visto[1])
+                if enviado is not None: confirmados.append(enviado)
+        if len(confirmados) >= self.maioria():
+            confirmados.sort(reverse=True)
+            self.lease_ate = max(self.lease_ate, confirmados[self.maioria() - 1] + DURACAO_LEASE)
+
+    def iniciar_eleicao(self):
+        if not self.lock_eleicao.acquire(blocking=False): return  # Já há uma em andamento
+        try:
+            log.info("[ELEIÇÃO] Iniciando (termo atual %d)...", self.termo)
+            posicao = self.wal.posicao()
+            for peer in self.peers_votantes():
+                # Nó maior já suspeito pelo detector não atrasa a eleição
+                if int(peer) > int(self.id) and not self.detector.suspeito(peer):
+                    resp = self.enviar_mensagem(peer, "ELEICAO", {"log": posicao}, esperar_resposta=True, timeout=TIMEOUT_ELEICAO)
+                    if resp and resp["tipo"] == "VIVO": return
+            self.tornar_coordenador()
+        finally:
+            self.lock_eleicao.release()
+
     def tornar_coordenador(self):
-        self.coordenador_id = self.id
-        print(f"[MASTER] Assumindo Liderança!")
-        for peer in self.peers: self.enviar_mensagem(peer, "COORDENADOR")
-    
+        """
+        Sondagem (ninguém muda de estado: termos não sobem à toa numa partição) e depois a votação.
+        Só votantes são consultados; as réplicas de leitura seguem o vencedor pela replicação.
+        """
+        votantes = self.peers_votantes()
+        with ThreadPoolExecutor(max_workers=max(1, len(votantes))) as envios:
+            for sondagem in (True, False):
+                pedido = self.candidatura(sondagem)
+                inicio = time.monotonic()
+                respostas = list(envios.map(lambda peer: self.enviar_mensagem(peer, "COORDENADOR", pedido, esperar_resposta=True,
+                                                                                timeout=TIMEOUT_ELEICAO), votantes))
+                if not self.apurar(pedido, respostas): return False
+        return self.assumir(pedido, inicio)
+
+    def visao_gossip(self):
+        """Incrementa o próprio batimento; o que vai para os peers sorteados nesta rodada."""
+        coord = self.coordenador_id
+        visao = self.detector.bater({"coordenador": coord, "termo": self.termo, "seq": self.wal.ultimo_seq,
+                                     "visto": self.detector.batimento(coord), "membros": list(self.membros.versao)})
+        self.renovar_lease(visao[self.id]["batimento"])
+        return visao
+
+    def difundir_gossip(self):
+        visao = self.visao_gossip()
+        for peer in self.detector.alvos(self.peers):
+            pendente = self.gossip_pendente.get(peer)
+            if pendente and not pendente.done(): continue
+            self.gossip_pendente[peer] = self.envios_gossip.submit(self.enviar_mensagem, peer, "GOSSIP", {"visao": visao})
+
+    def suspeitar_coordenador(self):
+        """True se o Master está suspeito; depois de uma eleição ele volta a ser vigiado do zero."""
+        coord = self.coordenador_id
+        if coord == self.id or not self.detector.suspeito(coord): return False
+        log.warning("[ALERTA] Master %s caiu! (phi=%.1f)", coord, self.detector.phi(coord))
+        self.detector.reiniciar(coord)
+        return True
+
+    def visoes_divergentes(self):
+        """
+        Nós vivos apontando Masters diferentes (ex.: subiram juntos e cada um se declarou)
+        por mais de CONFLITO_PERSISTENTE: uma eleição resolve. O atraso evita eleger de novo
+        durante a troca normal de Master, enquanto o gossip ainda traz a visão antiga.
+        Master com lease válido não se candidata de novo: os outros é que vão segui-lo.
+        """
+        vistos = set(self.detector.coordenadores().values()) | {self.coordenador_id}
+        if len(vistos) <= 1 or self.lease_valido():
+            self.conflito_desde = None
+            return False
+        agora = time.monotonic()
+        if self.conflito_desde is None: self.conflito_desde = agora
+        if agora - self.conflito_desde < CONFLITO_PERSISTENTE: return False
+        log.warning("[ALERTA] Nós vivos apontam Masters diferentes (%s). Nova eleição.", sorted(vistos))
+        self.conflito_desde = None
+        return True
+
+    def precisa_eleicao(self):
+        if not self.membros.eh_votante(self.id):
+            self.suspeitar_coordenador()  # Réplica de leitura só espera o próximo Master
+            return False
+        if self.suspeitar_coordenador() or self.visoes_divergentes(): return True
+        # Sem Master confirmado (subiu sem maioria, ou perdeu a votação): tenta de novo de tempos em tempos
+        if self.coordenador_id == self.id and not self.eh_lider() and time.monotonic() >= self.proxima_candidatura:
+            self.proxima_candidatura = time.monotonic() + INTERVALO_CANDIDATURA
+            return True
+        return False
+
     def monitorar_coordenador(self):
-        print("[MONITOR] Ativo.")
+        log.info("[MONITOR] Ativo (gossip a cada %.2fs, lease de %.2fs).", INTERVALO_GOSSIP, DURACAO_LEASE)
+        # A contagem de silêncio começa agora, não na criação do nó (o join pode ter demorado)
+        for peer in self.peers: self.detector.reiniciar(peer)
         while self.running:
-            time.sleep(5)
-            if self.id == self.coordenador_id: continue 
-            resp = self.enviar_mensagem(self.coordenador_id, "HEARTBEAT", esperar_resposta=True)
-            if not resp:
-                print(f"[ALERTA] Master {self.coordenador_id} caiu!")
-                self.iniciar_eleicao()
+            time.sleep(INTERVALO_GOSSIP)
+            self.difundir_gossip()
+            self.buscar_membros()
+            # Em outra thread: a votação espera respostas e o gossip não pode parar
+            if self.precisa_eleicao(): threading.Thread(target=self.iniciar_eleicao, daemon=True).start()
     
-    def join_cluster(self):
-        print("[JOIN] Entrando no cluster...")    
-        coord = None
+    def procurar_master(self):
         for peer in self.peers:
             resp = self.enviar_mensagem(peer, "QUEM_E_O_CHEFE", esperar_resposta=True)
-            if resp and resp["tipo"] == "EU_SOU_O_CHEFE":
-                coord = peer
-                break
+            if resp and resp["tipo"] == "EU_SOU_O_CHEFE": return peer, resp
+        return None, None
+
+    def join_cluster(self):
+        log.info("[JOIN] Entrando no cluster...")
+        coord, resp = self.procurar_master()
+        # Réplica de leitura só entra por um Master: sem ele, espera o cluster eleger um
+        while not coord and not self.membros.eh_votante(self.id) and self.running:
+            log.info("[JOIN] Nenhum Master respondeu; nova tentativa em %.0fs.", INTERVALO_CANDIDATURA)
+            time.sleep(INTERVALO_CANDIDATURA)
+            coord, resp = self.procurar_master()
+        # Réplica de leitura sempre manda JOIN (sem efeito se a visão já a tem com o mesmo endereço)
+        if coord and not self.membros.eh_votante(self.id) and not self.entrar_no_cluster(coord): coord = None
         if coord:
-            self.coordenador_id = coord
-            print(f"[JOIN] Master encontrado: {coord}. Pedindo Sync...")
-            resp = self.enviar_mensagem(self.coordenador_id, "SYNC_REQ", esperar_resposta=True)
-            
-            if resp and resp["tipo"] == "SYNC_DATA":
-                self.aplicar_dump(resp["payload"])
-            else: 
-                print("[JOIN] Falha ao receber dados de sincronização.") 
+            with self.lock_termo:
+                # Termo menor que o nosso: a primeira replicação recusada faz o Master convocar outra eleição
+                if resp["payload"].get("termo", 0) >= self.termo: self.seguir(coord, resp["payload"]["termo"])
+                self.coordenador_id = coord
+            log.info("[JOIN] Master encontrado: %s. Seq local=%d, pedindo delta...", coord, self.wal.ultimo_seq)
+            # Seq 0 = nunca sincronizou: o banco do Master tem dados anteriores ao log
+            if self.wal.ultimo_seq == 0 or self.recuperar_atraso(coord) is None:
+                log.info("[JOIN] Log do Master não cobre o seq local. Pedindo Sync completo...")
+                if self.sincronizar_completo(coord) is None:
+                    log.warning("[JOIN] Falha ao receber dados de sincronização.")
         else:
-            print("[JOIN] Sozinho na rede. Viro Master.")
+            # Só vira Master com a maioria aceitando o termo; sozinho fica só lendo até os outros subirem
+            log.info("[JOIN] Nenhum Master respondeu. Candidatando-me...")
             self.coordenador_id = self.id
+            self.iniciar_eleicao()
   
     def run(self):
         threading.Thread(target=self.start_server, daemon=True).start()
+        self.iniciar_metricas_http()
         time.sleep(1)
         self.join_cluster()
         threading.Thread(target=self.monitorar_coordenador, daemon=True).start()
+        if ANTI_ENTROPIA_ATIVA: self.anti_entropia.iniciar()
         try:
             while True: time.sleep(1)
         except KeyboardInterrupt:
-            print("Encerrando.")
+            log.info("Encerrando.")
+            self.sair_do_cluster()
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2: print("Uso: python middleware.py <ID_NO>")
-    else: NodeMiddleware(sys.argv[1]).run()
+    parser = argparse.ArgumentParser(description="Nó do banco distribuído")
+    parser.add_argument("id_no")
+    parser.add_argument("--async", dest="modo_async", action="store_true", help="servidor em event loop (asyncio)")
+    parser.add_argument("--backlog", type=int, default=None, help="fila de conexões pendentes do listen()")
+    parser.add_argument("--max-concorrencia", type=int, default=None, help="requisições processadas ao mesmo tempo (modo async)")
+    parser.add_argument("--consistencia", choices=MODOS_CONSISTENCIA, default=None,
+                        help="modo de replicação padrão do cluster (padrão: $DDB_CONSISTENCIA ou async)")
+    parser.add_argument("--consistencia-tabelas", default=None,
+                        help="modo por tabela, ex.: ddb.pedidos=quorum,eventos=async (padrão: $DDB_CONSISTENCIA_TABELAS)")
+    parser.add_argument("--cache", action="store_true", default=CACHE_ATIVO, help="cache de resultados de SELECT (ou DDB_CACHE=1)")
+    parser.add_argument("--log-level", default=None, help="DEBUG, INFO, WARNING... (padrão: $DDB_LOG_LEVEL ou INFO)")
+    parser.add_argument("--log-arquivo", default=None, help="também grava o log neste arquivo")
+    parser.add_argument("--ip", default=None, help="endereço deste nó, para entrar como réplica de leitura (JOIN)")
+    parser.add_argument("--porta", type=int, default=None, help="porta deste nó (com --ip)")
+    parser.add_argument("--db-host", default=None, help="MySQL deste nó (padrão: o --ip)")
+    parser.add_argument("--porta-metricas", type=int, default=None, help="HTTP /metrics no formato do Prometheus (ou $DDB_PORTA_METRICAS)")
+    parser.add_argument("--grupo", default=GRUPO, help="grupo de shards deste nó (com $DDB_SHARDS; padrão: $DDB_GRUPO)")
+    args = parser.parse_args()
+    if args.log_level or args.log_arquivo:
+        configurar_logs(nivel=(args.log_level or "INFO").upper(), arquivo=args.log_arquivo)
+    endereco = None
+    if args.ip or args.porta:
+        if not (args.ip and args.porta): parser.error("--ip e --porta vão juntos")
+        endereco = {"ip": args.ip, "porta": args.porta, "db_host": args.db_host or args.ip}
+
+    if args.modo_async:
+        from servidor_async import NodeMiddlewareAsync, BACKLOG_PADRAO, MAX_CONCORRENCIA_PADRAO
+        no = NodeMiddlewareAsync(args.id_no,
+                                 backlog=args.backlog or BACKLOG_PADRAO,
+                                 max_concorrencia=args.max_concorrencia or MAX_CONCORRENCIA_PADRAO,
+                                 cache=args.cache, endereco=endereco, grupo=args.grupo)
+    else:
+        no = NodeMiddleware(args.id_no, backlog=args.backlog or BACKLOG, cache=args.cache, endereco=endereco, grupo=args.grupo)
+    if args.consistencia: no.consistencia = args.consistencia
+    if args.consistencia_tabelas is not None: no.consistencia_tabelas = consistencia_por_tabela(args.consistencia_tabelas)
+    if args.porta_metricas is not None: no.porta_metricas = args.porta_metricas
+    no.run()
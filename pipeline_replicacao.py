@@ -0,0 +1,164 @@
+import time
+import threading
+from collections import deque
+from logs import get_logger
+
+log = get_logger("pipeline")
+
+
+class FilaPeer:
+    """
+    Fila em ordem de seq para um peer, com uma thread que envia lotes.
+    Enquanto um lote está em voo, as escritas seguintes se acumulam e viram o próximo
+    lote; com pouca carga, espera no máximo 'max_atraso' segundos para juntar entradas.
+    """
+    def __init__(self, peer_id, enviar_lote, max_lote, max_atraso, max_pendentes, ao_confirmar=None):
+        self.peer_id = peer_id
+        self.enviar_lote = enviar_lote
+        self.max_lote = max_lote
+        self.max_atraso = max_atraso
+        self.max_pendentes = max_pendentes
+        self.ao_confirmar = ao_confirmar
+        self.fila = deque()  # (entrada, instante em que entrou na fila)
+        self.cond = threading.Condition()
+        self.rodando = True
+
+        # Métricas
+        self.ultimo_enfileirado = 0
+        self.ultimo_confirmado = 0
+        self.lotes_enviados = 0
+        self.entradas_enviadas = 0
+        self.descartadas = 0
+        self.falhas = 0
+        self.ultimo_rtt = 0.0
+
+        threading.Thread(target=self._loop, daemon=True, name=f"repl-{peer_id}").start()
+
+    def enfileirar(self, entrada):
+        with self.cond:
+            self.fila.append((entrada, time.monotonic()))
+            self.ultimo_enfileirado = entrada["seq"]
+            if len(self.fila) > self.max_pendentes:
+                # Peer muito atrasado: o buraco de seq fará ele pedir o delta pelo log
+                self.fila.popleft()
+                self.descartadas += 1
+            self.cond.notify()
+
+    def _proximo_lote(self):
+        with self.cond:
+            while self.rodando and not self.fila:
+                self.cond.wait()
+            if not self.rodando: return None
+            prazo = self.fila[0][1] + self.max_atraso
+            while len(self.fila) < self.max_lote:
+                restante = prazo - time.monotonic()
+                if restante <= 0: break
+                self.cond.wait(restante)
+            return [self.fila[i][0] for i in range(min(self.max_lote, len(self.fila)))]
+
+    def _loop(self):
+        espera = 0.1
+        while self.rodando:
+            lote = self._proximo_lote()
+            if not lote: continue
+            inicio = time.monotonic()
+            confirmado = self.enviar_lote(self.peer_id, lote)
+            if confirmado is None or confirmado < lote[0]["seq"]:
+                # Peer fora (ou ocupado com um dump): mantém a fila, a réplica ignora seqs repetidos
+                if self.falhas == 0 or espera >= 5.0:
+                    log.warning("[PIPELINE] Peer %s não confirmou lote (seq %d..%d); %d pendentes",
+                                self.peer_id, lote[0]["seq"], lote[-1]["seq"], len(self.fila))
+                self.falhas += 1
+                time.sleep(espera)
+                espera = min(espera * 2, 5.0)
+                continue
+            espera = 0.1
+            with self.cond:
+                self.ultimo_rtt = time.monotonic() - inicio
+                self.lotes_enviados += 1
+                self.entradas_enviadas += len(lote)
+                self.ultimo_confirmado = max(self.ultimo_confirmado, confirmado)
+                while self.fila and self.fila[0][0]["seq"] <= self.ultimo_confirmado:
+                    self.fila.popleft()
+            if self.ao_confirmar: self.ao_confirmar()
+
+    def descartar(self):
+        with self.cond:
+            self.fila.clear()
+            self.ultimo_enfileirado = self.ultimo_confirmado = 0
+
+    def metricas(self):
+        with self.cond:
+            agora = time.monotonic()
+            return {
+                "enfileirado": self.ultimo_enfileirado,
+                "confirmado": self.ultimo_confirmado,
+                "atraso_seq": max(0, self.ultimo_enfileirado - self.ultimo_confirmado),
+                "atraso_s": round(agora - self.fila[0][1], 3) if self.fila else 0.0,
+                "pendentes": len(self.fila),
+                "lotes": self.lotes_enviados,
+                "media_lote": round(self.entradas_enviadas / self.lotes_enviados, 1) if self.lotes_enviados else 0.0,
+                "rtt_ms": round(self.ultimo_rtt * 1000, 2),
+                "descartadas": self.descartadas,
+                "falhas": self.falhas,
+            }
+
+    def parar(self):
+        with self.cond:
+            self.rodando = False
+            self.cond.notify_all()
+
+
+class PipelineReplicacao:
+    """
+    Uma FilaPeer por réplica; o coordenador só enfileira e segue em frente.
+    Quem precisa de durabilidade (quorum/all) espera em 'aguardar' pelos ACKs do seq.
+    """
+    def __init__(self, peers, enviar_lote, max_lote=500, max_atraso=0.005, max_pendentes=100000):
+        self.cond_acks = threading.Condition()
+        self.enviar_lote = enviar_lote
+        self.max_lote = max_lote
+        self.max_atraso = max_atraso
+        self.max_pendentes = max_pendentes
+        self.filas = {peer: FilaPeer(peer, enviar_lote, max_lote, max_atraso, max_pendentes, self._confirmado)
+                      for peer in peers}
+
+    def ajustar(self, peers):
+        """
+        Membros mudaram: fila nova para quem entrou (começa do próximo seq; o resto vem pelo sync),
+        fim da fila de quem saiu. O dicionário é trocado inteiro: quem está iterando o antigo segue.
+        """
+        filas = {peer: fila for peer, fila in self.filas.items() if peer in peers}
+        for peer in set(self.filas) - set(filas): self.filas[peer].parar()
+        for peer in set(peers) - set(filas):
+            filas[peer] = FilaPeer(peer, self.enviar_lote, self.max_lote, self.max_atraso, self.max_pendentes, self._confirmado)
+        self.filas = filas
+        self._confirmado()
+
+    def _confirmado(self):
+        with self.cond_acks: self.cond_acks.notify_all()
+
+    def enfileirar(self, entrada):
+        for fila in self.filas.values(): fila.enfileirar(entrada)
+
+    def confirmacoes(self, seq, peers=None):
+        """Quantos peers (todos, ou só os de 'peers') já confirmaram 'seq' (ACK cumulativo: confirmado >= seq)."""
+        return sum(1 for peer, fila in self.filas.items()
+                   if (peers is None or peer in peers) and fila.ultimo_confirmado >= seq)
+
+    def aguardar(self, seq, necessarios, timeout, peers=None):
+        """Espera até 'necessarios' peers (entre 'peers', se dado) confirmarem 'seq'. Retorna quantos confirmaram."""
+        with self.cond_acks:
+            self.cond_acks.wait_for(lambda: self.confirmacoes(seq, peers) >= necessarios, timeout)
+            return self.confirmacoes(seq, peers)
+
+    def descartar(self):
+        """Troca de Master: o que está na fila é de um termo que as réplicas não aceitam mais."""
+        for fila in self.filas.values(): fila.descartar()
+        self._confirmado()
+
+    def metricas(self):
+        return {peer: fila.metricas() for peer, fila in self.filas.items()}
+
+    def parar(self):
+        for fila in self.filas.values(): fila.parar()
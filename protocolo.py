@@ -0,0 +1,421 @@
+import os
+import hmac
+import zlib
+import asyncio
+import socket
+import struct
+import hashlib
+import json
+import threading
+import itertools
+import queue
+from metricas import BYTES_RECEBIDOS, BYTES_ENVIADOS
+
+try:
+    import msgpack
+except ImportError:  # Sem msgpack o nó só fala JSON (e não anuncia o contrário)
+    msgpack = None
+
+# Cada frame = 4 bytes (tamanho do corpo, big-endian) + 1 byte de flags + 4 bytes de CRC32
+# do corpo [+ 32 bytes de HMAC-SHA256 se FLAG_HMAC] + corpo (JSON UTF-8 ou msgpack, talvez zlib).
+# A integridade é verificada uma vez, sobre os bytes que passaram pelo fio.
+CABECALHO = struct.Struct("!IBI")
+# Mantido bem abaixo de 0x7B000000: um primeiro byte '{' só pode ser cliente legado (JSON cru).
+TAMANHO_MAXIMO = 256 * 1024 * 1024
+
+FLAG_HMAC = 0x01
+FLAG_MSGPACK = 0x02          # Corpo em msgpack (senão JSON)
+FLAG_ZLIB = 0x04             # Corpo comprimido
+FLAG_ACEITA_MSGPACK = 0x08   # Quem enviou sabe ler msgpack: o outro lado pode passar a usar
+TAMANHO_HMAC = 32
+# Com chave configurada (a mesma em todos os nós e clientes), frames levam HMAC no lugar do CRC
+# e frames sem HMAC são recusados.
+CHAVE_HMAC = os.environ.get("DDB_CHAVE_HMAC", "").encode("utf-8") or None
+# DDB_CODIFICACAO=json desliga o msgpack neste processo (útil para depurar o tráfego)
+BINARIO = msgpack is not None and os.environ.get("DDB_CODIFICACAO", "msgpack") == "msgpack"
+# Corpos a partir deste tamanho vão comprimidos (0 desliga)
+LIMIAR_COMPRESSAO = int(os.environ.get("DDB_COMPRESSAO_LIMIAR", 64 * 1024))
+NIVEL_COMPRESSAO = 1
+# Envio para um peer que não lê há este tempo (buffer TCP cheio) derruba a conexão
+TIMEOUT_ENVIO = float(os.environ.get("DDB_TIMEOUT_ENVIO", 30))
+
+
+class FrameCorrompido(ValueError):
+    """CRC/HMAC não confere: a conexão não é mais confiável e é encerrada."""
+
+
+def _assinatura(flags, corpo):
+    return hmac.new(CHAVE_HMAC, bytes((flags,)) + corpo, hashlib.sha256).digest()
+
+
+# --------- Codificação -----------
+def _serializar(msg, binario):
+    flags = FLAG_ACEITA_MSGPACK if BINARIO else 0
+    if binario and BINARIO:
+        corpo = msgpack.packb(msg, use_bin_type=True)
+        flags |= FLAG_MSGPACK
+    else:
+        corpo = json.dumps(msg).encode("utf-8")
+    if LIMIAR_COMPRESSAO and len(corpo) >= LIMIAR_COMPRESSAO:
+        comprimido = zlib.compress(corpo, NIVEL_COMPRESSAO)
+        if len(comprimido) < len(corpo) * 0.9:
+            corpo, flags = comprimido, flags | FLAG_ZLIB
+    return corpo, flags
+
+def _desserializar(corpo, flags):
+    if flags & FLAG_ZLIB:
+        d = zlib.decompressobj()
+        corpo = d.decompress(corpo, TAMANHO_MAXIMO)
+        if d.unconsumed_tail:
+            raise ValueError(f"Frame descomprimido excede {TAMANHO_MAXIMO} bytes")
+    if flags & FLAG_MSGPACK:
+        if msgpack is None: raise ValueError("Frame em msgpack sem msgpack instalado")
+        return msgpack.unpackb(corpo, raw=False, strict_map_key=False)
+    return json.loads(corpo.decode("utf-8"))
+
+
+# --------- Framing -----------
+def codificar_frame(msg, binario=False):
+    """'binario' só quando o outro lado anunciou FLAG_ACEITA_MSGPACK; JSON continua valendo sempre."""
+    corpo, flags = _serializar(msg, binario)
+    if CHAVE_HMAC:
+        flags |= FLAG_HMAC
+        frame = CABECALHO.pack(len(corpo), flags, 0) + _assinatura(flags, corpo) + corpo
+    else:
+        frame = CABECALHO.pack(len(corpo), flags, zlib.crc32(corpo)) + corpo
+    BYTES_ENVIADOS.somar(len(frame))
+    return frame
+
+def _ler_cabecalho(cabecalho):
+    tamanho, flags, crc = CABECALHO.unpack(cabecalho)
+    if tamanho > TAMANHO_MAXIMO:
+        raise ValueError(f"Frame de {tamanho} bytes excede o limite")
+    if CHAVE_HMAC and not flags & FLAG_HMAC:
+        raise FrameCorrompido("Frame sem HMAC recusado")
+    return tamanho, flags, crc
+
+def _decodificar_corpo(flags, crc, assinatura, corpo):
+    BYTES_RECEBIDOS.somar(CABECALHO.size + len(corpo) + (len(assinatura) if assinatura else 0))
+    if flags & FLAG_HMAC:
+        if not CHAVE_HMAC or not hmac.compare_digest(assinatura, _assinatura(flags, corpo)):
+            raise FrameCorrompido("HMAC inválido")
+    elif zlib.crc32(corpo) != crc:
+        raise FrameCorrompido("CRC32 inválido")
+    return _desserializar(corpo, flags)
+
+def receber_exato(sock, n):
+    """Lê exatamente n bytes. Retorna None se a conexão fechou antes do primeiro byte."""
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            if not buf: return None
+            raise ConnectionError("Conexão encerrada no meio de um frame")
+        buf.extend(chunk)
+    return bytes(buf)
+
+def enviar_frame(sock, msg, binario=False):
+    sock.sendall(codificar_frame(msg, binario))
+
+def receber_frame(sock, com_flags=False):
+    """A mensagem (ou None se o peer fechou); com_flags=True retorna (mensagem, flags)."""
+    cabecalho = receber_exato(sock, CABECALHO.size)
+    if cabecalho is None: return (None, 0) if com_flags else None
+    tamanho, flags, crc = _ler_cabecalho(cabecalho)
+    resto = receber_exato(sock, tamanho + (TAMANHO_HMAC if flags & FLAG_HMAC else 0))
+    if resto is None:
+        raise ConnectionError("Conexão encerrada no meio de um frame")
+    if flags & FLAG_HMAC:
+        msg = _decodificar_corpo(flags, crc, resto[:TAMANHO_HMAC], resto[TAMANHO_HMAC:])
+    else:
+        msg = _decodificar_corpo(flags, crc, None, resto)
+    return (msg, flags) if com_flags else msg
+
+def checksum_legado(payload):
+    """MD5 do payload: só o caminho de JSON cru dos clientes antigos ainda usa."""
+    return hashlib.md5(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def eh_legado(sock):
+    """Clientes antigos mandam JSON cru sem cabeçalho de tamanho."""
+    primeiro = sock.recv(1, socket.MSG_PEEK)
+    return primeiro == b"{"
+
+
+# --------- Conexão persistente -----------
+class _Pendente:
+    """Requisição esperando uma única resposta."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.evento = threading.Event()
+        self.resposta = None
+
+    def entregar(self, msg):
+        self.resposta = msg
+        self.evento.set()
+        return True
+
+    def falhar(self):
+        self.evento.set()
+
+class _PendenteStream:
+    """Requisição cuja resposta é uma sequência de frames (o último traz fim_stream)."""
+    def __init__(self, sock):
+        self.sock = sock
+        self.fila = queue.Queue()
+
+    def entregar(self, msg):
+        self.fila.put(msg)
+        return bool(msg.get("fim_stream"))
+
+    def falhar(self):
+        self.fila.put(None)
+
+
+def _prazo_envio(sock, segundos):
+    """SO_SNDTIMEO: send() sem progresso por 'segundos' falha (OSError); a leitura continua sem prazo."""
+    if not segundos: return
+    if os.name == "nt":
+        valor = struct.pack("L", int(segundos * 1000))
+    else:
+        valor = struct.pack("ll", int(segundos), int(segundos % 1 * 1_000_000))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, valor)
+
+
+class ConexaoPeer:
+    """
+    Conexão TCP de longa duração com um peer.
+    Várias requisições podem estar em voo ao mesmo tempo: cada uma leva um req_id
+    e a thread de leitura entrega a resposta para quem está esperando aquele id.
+    Começa em JSON e passa a msgpack quando o peer anuncia que aceita (binario=False fica em JSON).
+    """
+    def __init__(self, ip, porta, timeout_conexao=3, binario=True):
+        self.endereco = (ip, porta)
+        self.timeout_conexao = timeout_conexao
+        self.usar_binario = binario
+        self.binario = False  # Negociado por conexão
+        self.sock = None
+        self.ids = itertools.count(1)
+        self.pendentes = {}  # req_id -> _Pendente / _PendenteStream
+        self.lock_estado = threading.Lock()
+        self.lock_envio = threading.Lock()
+        self.lock_conexao = threading.Lock()  # Um connect por vez, fora do lock_estado
+
+    def _conectar(self):
+        """Socket atual ou um novo. O connect (até timeout_conexao) não segura o lock_estado."""
+        with self.lock_conexao:
+            with self.lock_estado:
+                if self.sock: return self.sock
+            sock = socket.create_connection(self.endereco, timeout=self.timeout_conexao)
+            # Leitura bloqueante (a thread de leitura espera o quanto for); o envio tem prazo próprio
+            sock.settimeout(None)
+            _prazo_envio(sock, TIMEOUT_ENVIO)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock_estado:
+                self.sock = sock
+                self.binario = False
+            threading.Thread(target=self._loop_leitura, args=(sock,), daemon=True).start()
+            return sock
+
+    def _loop_leitura(self, sock):
+        try:
+            while True:
+                msg, flags = receber_frame(sock, com_flags=True)
+                if msg is None: break
+                if flags & FLAG_ACEITA_MSGPACK and self.usar_binario and self.sock is sock: self.binario = True
+                req_id = msg.get("req_id")
+                with self.lock_estado:
+                    entrada = self.pendentes.get(req_id)
+                if entrada and entrada.entregar(msg):
+                    with self.lock_estado:
+                        self.pendentes.pop(req_id, None)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._descartar(sock)
+
+    def _descartar(self, sock):
+        with self.lock_estado:
+            if self.sock is sock: self.sock = None
+            orfaos = [rid for rid, e in self.pendentes.items() if e.sock is sock]
+            entradas = [self.pendentes.pop(rid) for rid in orfaos]
+        for entrada in entradas: entrada.falhar()
+        try: sock.close()
+        except OSError: pass
+
+    def _enviar(self, msg, tipo_pendente):
+        sock = self._conectar()
+        with self.lock_estado:
+            entrada = None
+            if tipo_pendente:
+                msg["req_id"] = next(self.ids)
+                entrada = tipo_pendente(sock)
+                self.pendentes[msg["req_id"]] = entrada
+        try:
+            with self.lock_envio:
+                enviar_frame(sock, msg, self.binario)
+        except OSError:
+            self._descartar(sock)
+            raise
+        return entrada
+
+    def _enviar_com_retentativa(self, msg, tipo_pendente):
+        try:
+            return self._enviar(msg, tipo_pendente)
+        except OSError:
+            # Conexão reaproveitada pode ter morrido (peer reiniciou): tenta uma vez numa nova
+            return self._enviar(msg, tipo_pendente)
+
+    def requisitar(self, msg, timeout=5.0, esperar_resposta=True):
+        entrada = self._enviar_com_retentativa(msg, _Pendente if esperar_resposta else None)
+        if entrada is None: return None
+
+        if not entrada.evento.wait(timeout):
+            with self.lock_estado:
+                self.pendentes.pop(msg["req_id"], None)
+            raise socket.timeout(f"Sem resposta em {timeout}s")
+        if entrada.resposta is None:
+            raise ConnectionError("Conexão encerrada antes da resposta")
+        return entrada.resposta
+
+    def requisitar_stream(self, msg, timeout=5.0):
+        """Gera os frames de uma resposta em streaming; 'timeout' vale para cada frame."""
+        entrada = self._enviar_com_retentativa(msg, _PendenteStream)
+        try:
+            while True:
+                try:
+                    frame = entrada.fila.get(timeout=timeout)
+                except queue.Empty:
+                    raise socket.timeout(f"Stream parado há {timeout}s")
+                if frame is None:
+                    raise ConnectionError("Conexão encerrada no meio do stream")
+                yield frame
+                if frame.get("fim_stream"): return
+        finally:
+            with self.lock_estado:
+                self.pendentes.pop(msg["req_id"], None)
+
+    def fechar(self):
+        with self.lock_estado:
+            sock = self.sock
+        if sock: self._descartar(sock)
+
+
+# --------- Versão asyncio -----------
+async def receber_frame_async(reader, cabecalho=b"", com_flags=False):
+    """Mesmo formato de receber_frame; 'cabecalho' permite reaproveitar bytes já lidos."""
+    try:
+        cabecalho += await reader.readexactly(CABECALHO.size - len(cabecalho))
+    except asyncio.IncompleteReadError as err:
+        if not err.partial and not cabecalho: return (None, 0) if com_flags else None
+        raise ConnectionError("Conexão encerrada no meio de um frame")
+    tamanho, flags, crc = _ler_cabecalho(cabecalho)
+    try:
+        assinatura = await reader.readexactly(TAMANHO_HMAC) if flags & FLAG_HMAC else None
+        corpo = await reader.readexactly(tamanho)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Conexão encerrada no meio de um frame")
+    msg = _decodificar_corpo(flags, crc, assinatura, corpo)
+    return (msg, flags) if com_flags else msg
+
+async def enviar_frame_async(writer, msg, binario=False):
+    writer.write(codificar_frame(msg, binario))
+    await writer.drain()
+
+
+class ConexaoPeerAsync:
+    """Equivalente de ConexaoPeer para o event loop: um socket por peer, respostas casadas por req_id."""
+    def __init__(self, ip, porta, timeout_conexao=3, binario=True):
+        self.endereco = (ip, porta)
+        self.timeout_conexao = timeout_conexao
+        self.usar_binario = binario
+        self.binario = False
+        self.writer = None
+        self.ids = itertools.count(1)
+        self.pendentes = {}  # req_id -> (Future ou asyncio.Queue de um stream, writer)
+        self.lock = None
+
+    async def _garantir_conexao(self):
+        if self.lock is None: self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.writer is None or self.writer.is_closing():
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(*self.endereco), self.timeout_conexao)
+                sock = writer.get_extra_info("socket")
+                if sock is not None: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.writer = writer
+                self.binario = False
+                asyncio.ensure_future(self._loop_leitura(reader, writer))
+            return self.writer
+
+    async def _loop_leitura(self, reader, writer):
+        try:
+            while True:
+                msg, flags = await receber_frame_async(reader, com_flags=True)
+                if msg is None: break
+                if flags & FLAG_ACEITA_MSGPACK and self.usar_binario and self.writer is writer: self.binario = True
+                entrada = self.pendentes.get(msg.get("req_id"))
+                if entrada is None: continue
+                if isinstance(entrada[0], asyncio.Queue):
+                    entrada[0].put_nowait(msg)
+                    if msg.get("fim_stream"): self.pendentes.pop(msg["req_id"], None)
+                else:
+                    self.pendentes.pop(msg["req_id"], None)
+                    if not entrada[0].done(): entrada[0].set_result(msg)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._descartar(writer)
+
+    def _descartar(self, writer):
+        if self.writer is writer: self.writer = None
+        for rid in [rid for rid, e in self.pendentes.items() if e[1] is writer]:
+            alvo = self.pendentes.pop(rid)[0]
+            if isinstance(alvo, asyncio.Queue): alvo.put_nowait(None)
+            elif not alvo.done(): alvo.set_exception(ConnectionError("Conexão encerrada antes da resposta"))
+        writer.close()
+
+    async def requisitar(self, msg, timeout=5.0, esperar_resposta=True):
+        for tentativa in range(2):
+            writer = await self._garantir_conexao()
+            fut = None
+            if esperar_resposta:
+                msg["req_id"] = next(self.ids)
+                fut = asyncio.get_running_loop().create_future()
+                self.pendentes[msg["req_id"]] = (fut, writer)
+            try:
+                await enviar_frame_async(writer, msg, self.binario)
+                break
+            except OSError:
+                self._descartar(writer)
+                if tentativa: raise
+        if fut is None: return None
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self.pendentes.pop(msg["req_id"], None)
+
+    async def requisitar_stream(self, msg, timeout=5.0):
+        """Gera os frames de uma resposta em streaming; 'timeout' vale para cada frame."""
+        writer = await self._garantir_conexao()
+        msg["req_id"] = next(self.ids)
+        fila = asyncio.Queue()
+        self.pendentes[msg["req_id"]] = (fila, writer)
+        try:
+            try:
+                await enviar_frame_async(writer, msg, self.binario)
+            except OSError:
+                self._descartar(writer)
+                raise
+            while True:
+                try:
+                    frame = await asyncio.wait_for(fila.get(), timeout)
+                except asyncio.TimeoutError:
+                    raise socket.timeout(f"Stream parado há {timeout}s")
+                if frame is None:
+                    raise ConnectionError("Conexão encerrada no meio do stream")
+                yield frame
+                if frame.get("fim_stream"): return
+        finally:
+            self.pendentes.pop(msg["req_id"], None)
+
+    def fechar(self):
+        if self.writer: self._descartar(self.writer)
@@ -0,0 +1,128 @@
+from datetime import timedelta
+from classificador_sql import DML, insert_valores, indice_campo, valor_na_tupla, nome, palavra
+
+MAX_LINHAS = 10000  # Imagens maiores que isso: o comando vai como SQL (a anti-entropia cobre o que divergir)
+MODIFICADORES = ("LOW_PRIORITY", "QUICK", "IGNORE", "DELAYED", "HIGH_PRIORITY")
+
+
+def _posicao(toks, *palavras, desde=0):
+    return next((i for i in range(desde, len(toks)) if toks[i].nivel == 0 and palavra(toks[i], *palavras)), None)
+
+
+def planejar(sql, classe, esquema_de, database):
+    """
+    Plano de captura das linhas que o comando muda no Master, ou None quando reexecutar o SQL
+    nas réplicas dá o mesmo resultado (ou quando não dá para saber quais linhas são: aí vai o SQL).
+    Só comandos de uma tabela com PK. 'esquema_de(banco, tabela)' como DBManager.esquema.
+    """
+    if classe.tipo not in DML or classe.multiplos or not classe.tabelas_escritas or len(classe.tabelas_escritas) != 1:
+        return None
+    (banco, tabela), = classe.tabelas_escritas
+    if not (banco or database): return None
+    if classe.tipo in ("UPDATE", "DELETE") and classe.deterministico: return None
+    esquema = esquema_de(banco or database, tabela)
+    if not esquema or not esquema["pk"]: return None
+    plano = {"banco": esquema["banco"], "tabela": esquema["tabela"], "pk": esquema["pk"]}
+    if classe.tipo in ("INSERT", "REPLACE"): return _planejar_insert(classe, esquema, plano)
+    return _planejar_update_delete(sql, classe, plano)
+
+
+def _planejar_insert(classe, esquema, plano):
+    toks, pk = classe.toks, [c.lower() for c in esquema["pk"]]
+    estrutura = insert_valores(toks)
+    if estrutura is None: return None  # INSERT ... SELECT / INSERT ... SET
+    colunas, tuplas = estrutura
+    colunas = colunas or [c.lower() for c in esquema["colunas"]]
+    if esquema["auto"] is not None and pk == [esquema["auto"].lower()]:
+        # Chave do AUTO_INCREMENT: cada nó gera a sua, então vale o que o Master gerou
+        posicao = colunas.index(pk[0]) if pk[0] in colunas else None
+        geradas = [posicao is None or _gerado(toks, indice_campo(toks, tupla, posicao)) for tupla in tuplas]
+        if all(geradas):
+            # Linhas trocadas por REPLACE / ON DUPLICATE KEY UPDATE não aparecem nas chaves geradas
+            if classe.tipo != "INSERT" or _posicao(toks, "DUPLICATE") is not None: return None
+            return dict(plano, gerada=True, passo=esquema["passo"], tuplas=len(tuplas))
+        if any(geradas): return None
+    if classe.deterministico: return None  # Mesmas chaves e mesmos valores em qualquer nó
+    if any(c not in colunas for c in pk): return None
+    chaves = [[valor_na_tupla(toks, tupla, colunas.index(c)) for c in pk] for tupla in tuplas]
+    if any(valor == "?" for chave in chaves for valor, _ in chave): return None
+    return dict(plano, chaves=chaves)
+
+
+def _gerado(toks, i):
+    """Valor da coluna AUTO_INCREMENT que pede um valor gerado: NULL, DEFAULT ou 0."""
+    return palavra(toks[i], "NULL", "DEFAULT") or (toks[i].texto == "0" and i + 1 < len(toks) and toks[i + 1].texto in (",", ")"))
+
+
+def _planejar_update_delete(sql, classe, plano):
+    """
+    UPDATE/DELETE de uma tabela: as chaves candidatas saem de um SELECT ... FOR UPDATE com o mesmo
+    WHERE (sem ORDER BY/LIMIT: um superconjunto das linhas que o comando escolher), antes de executá-lo.
+    """
+    toks = classe.toks
+    total = len(toks) - (toks[-1].texto == ";")
+    inicio = 1
+    while inicio < total and palavra(toks[inicio], *MODIFICADORES): inicio += 1
+    onde = _posicao(toks, "WHERE")
+    fim_filtro = _posicao(toks, "ORDER", "LIMIT", desde=onde or inicio)
+    fim_filtro = total if fim_filtro is None else fim_filtro
+    if classe.tipo == "UPDATE":
+        set_ = _posicao(toks, "SET")
+        if set_ is None: return None
+        fonte = toks[inicio:set_]
+        # Mudar a PK tira a linha do lugar onde ela vai ser procurada depois de executar
+        atribuidas = {nome(toks[i]) for i in range(set_ + 1, onde or fim_filtro)
+                      if toks[i].nivel == 0 and toks[i].tipo in ("palavra", "nome") and i + 1 < len(toks) and toks[i + 1].texto == "="}
+        if atribuidas & {c.lower() for c in plano["pk"]}: return None
+    else:
+        if inicio >= total or not palavra(toks[inicio], "FROM") or _posicao(toks, "USING") is not None: return None
+        fonte = toks[inicio + 1:onde or fim_filtro]
+    if not fonte or any(t.nivel == 0 and (t.texto == "," or palavra(t, "JOIN")) for t in fonte): return None
+    filtro, marcadores = "", (0, 0)
+    if onde is not None:
+        filtro = " " + sql[toks[onde].inicio:toks[fim_filtro - 1].fim]
+        antes = sum(1 for t in toks[:onde] if t.tipo == "marcador")
+        marcadores = (antes, antes + sum(1 for t in toks[onde:fim_filtro] if t.tipo == "marcador"))
+    colunas = ", ".join(f"`{c}`" for c in plano["pk"])
+    # Uma linha além do limite basta para saber que o comando não cabe numa entrada de linhas
+    selecao = f"SELECT {colunas} FROM {sql[fonte[0].inicio:fonte[-1].fim]}{filtro} LIMIT {MAX_LINHAS + 1} FOR UPDATE"
+    return dict(plano, selecao=selecao, marcadores=marcadores)
+
+
+def chaves_do_insert(plano, params):
+    """Chaves (tuplas) que um INSERT com chaves explícitas grava com este conjunto de parâmetros."""
+    return [tuple(params[indice] if indice is not None else valor for valor, indice in chave) for chave in plano["chaves"]]
+
+
+def codificar(v):
+    """Valor lido do MySQL -> JSON (o log é JSON); o texto de datas e decimais o MySQL lê de volta sem perda."""
+    if v is None or isinstance(v, (int, float, str)): return v
+    if isinstance(v, (bytes, bytearray)): return {"hex": bytes(v).hex()}
+    if isinstance(v, timedelta):  # TIME
+        segundos = abs(v.total_seconds())
+        return f"{'-' if v < timedelta(0) else ''}{int(segundos // 3600):02d}:{int(segundos % 3600 // 60):02d}:{segundos % 60:09.6f}"
+    if isinstance(v, (set, frozenset)): return ",".join(sorted(v))  # SET
+    return str(v)
+
+
+def decodificar(v):
+    return bytes.fromhex(v["hex"]) if isinstance(v, dict) else v
+
+
+def comandos_das_linhas(imagem):
+    """
+    [(sql, database, parametros)] que aplicam uma imagem de linhas na réplica: apaga as chaves
+    que sumiram e grava (insere ou sobrescreve) as linhas como ficaram no Master.
+    """
+    tabela = f"`{imagem['banco']}`.`{imagem['tabela']}`"
+    comandos = []
+    if imagem["apagar"]:
+        filtro = " AND ".join(f"`{c}` = %s" for c in imagem["pk"])
+        comandos.append((f"DELETE FROM {tabela} WHERE {filtro}", imagem["banco"],
+                         [[decodificar(v) for v in chave] for chave in imagem["apagar"]]))
+    if imagem["gravar"]:
+        colunas = imagem["colunas"]
+        sql = (f"INSERT INTO {tabela} ({', '.join(f'`{c}`' for c in colunas)}) VALUES ({', '.join(['%s'] * len(colunas))})"
+               f" ON DUPLICATE KEY UPDATE {', '.join(f'`{c}` = VALUES(`{c}`)' for c in colunas)}")
+        comandos.append((sql, imagem["banco"], [[decodificar(v) for v in linha] for linha in imagem["gravar"]]))
+    return comandos
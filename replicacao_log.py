@@ -0,0 +1,189 @@
+import os
+import json
+import threading
+from collections import deque
+from logs import get_logger
+
+log = get_logger("wal")
+
+
+class LogReplicacao:
+    """
+    Log de replicação append-only e durável (uma entrada JSON por linha).
+
+    Cada escrita replicada recebe um número de sequência monotônico. O mesmo log existe
+    no coordenador (onde os números são gerados) e nas réplicas (que gravam cada entrada
+    aplicada com o seq recebido), então 'ultimo_seq' é sempre a posição aplicada pelo nó.
+    As últimas 'retencao' entradas ficam em memória para responder pedidos de delta;
+    pedidos mais antigos que isso são tratados como log truncado (-> dump completo).
+    Cada entrada leva o termo do Master que a gerou: dois logs com o mesmo (seq, termo)
+    são iguais até ali, o que permite achar onde o log de um Master deposto divergiu.
+    'comandos' (ComandosPreparados, opcional) é sincronizado antes de cada gravação e
+    compactado junto com o log, para as entradas retidas continuarem resolvíveis.
+    """
+    def __init__(self, caminho, retencao=100000, fsync=True, comandos=None):
+        self.caminho = caminho
+        self.retencao = retencao
+        self.fsync = fsync
+        self.comandos = comandos
+        self.lock = threading.Lock()
+        self.entradas = deque()
+        self.ultimo_seq = 0
+        self.primeiro_seq = 1  # menor seq que ainda dá para servir
+        self.termo_inicio = 0  # termo da entrada primeiro_seq - 1 (já fora da memória)
+        self.linhas_arquivo = 0
+
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        self._carregar()
+        self.arquivo = open(caminho, "a", encoding="utf-8")
+
+    def _carregar(self):
+        if not os.path.exists(self.caminho): return
+        with open(self.caminho, encoding="utf-8") as f:
+            for linha in f:
+                try:
+                    entrada = json.loads(linha)
+                except ValueError:
+                    break  # última linha incompleta (queda no meio da escrita)
+                self.linhas_arquivo += 1
+                if "reinicio" in entrada:
+                    self.entradas.clear()
+                    self.ultimo_seq = entrada["reinicio"]
+                    self.primeiro_seq = self.ultimo_seq + 1
+                    self.termo_inicio = entrada.get("termo", 0)
+                    continue
+                self._anexar_memoria(entrada)
+        log.info("[WAL] %s carregado: seq %d..%d", self.caminho, self.primeiro_seq, self.ultimo_seq)
+
+    def _anexar_memoria(self, entrada):
+        self.entradas.append(entrada)
+        self.ultimo_seq = entrada["seq"]
+        if len(self.entradas) > self.retencao:
+            self.termo_inicio = self.entradas.popleft().get("termo", 0)
+            self.primeiro_seq = self.entradas[0]["seq"]
+        elif len(self.entradas) == 1:
+            self.primeiro_seq = entrada["seq"]
+
+    def _gravar(self, linhas):
+        if self.comandos and self.fsync: self.comandos.sincronizar()  # O registro dos ids antes das entradas
+        self.arquivo.write("".join(json.dumps(l) + "\n" for l in linhas))
+        self.arquivo.flush()
+        if self.fsync: os.fsync(self.arquivo.fileno())
+        self.linhas_arquivo += len(linhas)
+        if self.linhas_arquivo > 2 * self.retencao: self._compactar()
+
+    def _compactar(self):
+        """Reescreve o arquivo só com o que está retido em memória."""
+        temporario = self.caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"reinicio": self.primeiro_seq - 1, "termo": self.termo_inicio}) + "\n")
+            for entrada in self.entradas: f.write(json.dumps(entrada) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.arquivo.close()
+        os.replace(temporario, self.caminho)
+        self.arquivo = open(self.caminho, "a", encoding="utf-8")
+        self.linhas_arquivo = len(self.entradas) + 1
+        if self.comandos: self.comandos.compactar(self.entradas)
+
+    def registrar(self, entrada, seq=None):
+        """
+        Anexa uma entrada. Sem 'seq' (coordenador) gera o próximo número; com 'seq' (réplica)
+        grava o número recebido. Retorna o seq, ou None se a entrada já estava no log.
+        """
+        with self.lock:
+            seq = self.ultimo_seq + 1 if seq is None else seq
+            if seq <= self.ultimo_seq: return None
+            entrada = dict(entrada, seq=seq)
+            self._gravar([entrada])
+            self._anexar_memoria(entrada)
+            return seq
+
+    def registrar_lote(self, entradas):
+        """Réplica: grava várias entradas (já com seq) com um único fsync."""
+        with self.lock:
+            novas = [e for e in entradas if e["seq"] > self.ultimo_seq]
+            if not novas: return
+            self._gravar(novas)
+            for entrada in novas: self._anexar_memoria(entrada)
+
+    def desde(self, seq, limite=None):
+        """Entradas com seq > 'seq' (até 'limite'); None se parte delas já foi descartada."""
+        with self.lock:
+            if seq >= self.ultimo_seq: return []
+            if seq + 1 < self.primeiro_seq: return None
+            inicio = seq + 1 - self.primeiro_seq
+            if self.entradas[inicio]["seq"] != seq + 1:
+                # Sequência com buraco (não deveria acontecer): procura linearmente
+                inicio = next(i for i, e in enumerate(self.entradas) if e["seq"] > seq)
+            fim = len(self.entradas) if limite is None else min(len(self.entradas), inicio + limite)
+            return [self.entradas[i] for i in range(inicio, fim)]
+
+    def reiniciar(self, seq, termo=0):
+        """Depois de um dump completo: o estado local corresponde a 'seq' e o histórico anterior não vale."""
+        with self.lock:
+            self.entradas.clear()
+            self.ultimo_seq = seq
+            self.primeiro_seq = seq + 1
+            self.termo_inicio = termo
+            self._gravar([{"reinicio": seq, "termo": termo}])
+
+    def _indice(self, seq):
+        inicio = seq - self.primeiro_seq
+        if inicio < len(self.entradas) and self.entradas[inicio]["seq"] == seq: return inicio
+        return next(i for i, e in enumerate(self.entradas) if e["seq"] == seq)
+
+    def termo_em(self, seq):
+        """Termo da entrada 'seq'; None se ela não existe aqui ou já saiu da memória."""
+        with self.lock:
+            if seq == self.primeiro_seq - 1: return self.termo_inicio
+            if seq < self.primeiro_seq or seq > self.ultimo_seq: return None
+            return self.entradas[self._indice(seq)].get("termo", 0)
+
+    def posicao(self):
+        """(termo, seq) da última entrada: quem tem o maior está mais atualizado."""
+        with self.lock:
+            return (self.entradas[-1].get("termo", 0) if self.entradas else self.termo_inicio), self.ultimo_seq
+
+    def termos(self):
+        """[[termo, primeiro seq com esse termo]] do que está em memória (para achar o ponto comum)."""
+        with self.lock:
+            trocas = [[self.termo_inicio, self.primeiro_seq - 1]]
+            for entrada in self.entradas:
+                if entrada.get("termo", 0) != trocas[-1][0]: trocas.append([entrada.get("termo", 0), entrada["seq"]])
+            return trocas
+
+    def ponto_comum(self, termos, ultimo_seq):
+        """
+        Maior seq em que este log e o descrito por 'termos'/'ultimo_seq' têm o mesmo termo;
+        até ali os dois são iguais. None se a divergência é mais antiga que a memória.
+        """
+        def termo_remoto(seq):
+            anterior = None
+            for termo, desde in termos:
+                if desde > seq: break
+                anterior = termo
+            return anterior
+
+        with self.lock:
+            for entrada in reversed(self.entradas):
+                seq = entrada["seq"]
+                if seq <= ultimo_seq and termo_remoto(seq) == entrada.get("termo", 0): return seq
+            seq = self.primeiro_seq - 1
+            if seq <= ultimo_seq and termo_remoto(seq) == self.termo_inicio: return seq
+            return None
+
+    def truncar(self, seq):
+        """Descarta as entradas depois de 'seq' (sufixo que o Master atual não tem); retorna as descartadas."""
+        with self.lock:
+            descartadas = []
+            while self.entradas and self.entradas[-1]["seq"] > seq:
+                descartadas.append(self.entradas.pop())
+            self.ultimo_seq = seq
+            if not self.entradas: self.primeiro_seq = seq + 1
+            self._compactar()
+            return descartadas[::-1]
+
+    def fechar(self):
+        with self.lock:
+            self.arquivo.close()
@@ -0,0 +1,135 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+from protocolo import ConexaoPeer
+from classificador_sql import eh_leitura
+from membros import versao_de
+
+INTERVALO_CARGA = 1.0 # Segundos entre consultas de carga a cada nó
+TIMEOUT_CARGA = 2.0
+
+
+class Roteador:
+    """
+    Escolhe o nó de cada requisição no lado do cliente.
+    Uma thread consulta todos os nós (HEARTBEAT -> VIVO com a carga publicada) e guarda
+    a última resposta de cada um. Escritas e leituras que precisam ver as próprias escritas
+    vão para o coordenador; as demais leituras vão para o nó menos carregado cujo atraso
+    de replicação está dentro do limite pedido.
+    O VIVO traz a versão da visão de membros: quando ela sobe, o roteador pede a visão
+    (MEMBROS_REQ), passa a consultar os nós novos e deixa de escolher os que saíram.
+    'ao_descobrir(node)' deixa o dono da lista acrescentar o nó junto (ele chama adicionar).
+    """
+    def __init__(self, nodes, criar_mensagem, intervalo=INTERVALO_CARGA, ao_descobrir=None):
+        self.nodes = list(nodes)
+        self.criar_mensagem = criar_mensagem
+        self.intervalo = intervalo
+        self.ao_descobrir = ao_descobrir or self.adicionar
+        self.versao_membros = (0, 0)
+        self.membros = set()    # (ip, porta) da última visão recebida
+        self.removidos = set()  # (ip, porta) que saíram da visão
+        self.conexoes = [ConexaoPeer(n["ip"], n["porta"]) for n in self.nodes]
+        self.cargas = [None] * len(self.nodes)       # Último VIVO de cada nó
+        self.atualizado = [0.0] * len(self.nodes)    # monotonic da última resposta
+        self.locais = [0] * len(self.nodes)          # Requisições deste cliente em voo por nó
+        self.lock = threading.Lock()
+        self.rodando = True
+        threading.Thread(target=self._loop, daemon=True, name="roteador").start()
+
+    def _consultar(self, i):
+        try:
+            resp = self.conexoes[i].requisitar(self.criar_mensagem("HEARTBEAT", None), timeout=TIMEOUT_CARGA)
+        except Exception:
+            resp = None
+        with self.lock:
+            if resp and resp.get("tipo") == "VIVO":
+                self.cargas[i] = resp.get("payload") or {}
+                self.atualizado[i] = time.monotonic()
+            else:
+                self.cargas[i] = None
+            versao = versao_de(self.cargas[i] and self.cargas[i].get("membros"))
+        if versao > self.versao_membros: self._atualizar_membros(i)
+
+    def _atualizar_membros(self, i):
+        try:
+            resp = self.conexoes[i].requisitar(self.criar_mensagem("MEMBROS_REQ", None), timeout=TIMEOUT_CARGA)
+        except Exception:
+            return
+        if not resp or resp.get("tipo") != "MEMBROS": return
+        visao = resp["payload"]
+        atuais = {(n["ip"], n["porta"]) for n in visao["nos"].values()}
+        with self.lock:
+            if versao_de(visao["versao"]) <= self.versao_membros: return
+            self.versao_membros = versao_de(visao["versao"])
+            self.removidos = (self.removidos | self.membros) - atuais
+            self.membros = atuais
+        for ip, porta in sorted(atuais): self.ao_descobrir({"ip": ip, "porta": porta})
+
+    def adicionar(self, node):
+        """Índice do nó em 'nodes', acrescentando-o (e passando a consultá-lo) se ainda não era conhecido."""
+        chave = (node["ip"], node["porta"])
+        with self.lock:
+            for i, n in enumerate(self.nodes):
+                if (n["ip"], n["porta"]) == chave: return i
+            self.nodes.append({"ip": node["ip"], "porta": node["porta"]})
+            self.conexoes.append(ConexaoPeer(node["ip"], node["porta"]))
+            self.cargas.append(None)
+            self.atualizado.append(0.0)
+            self.locais.append(0)
+            return len(self.nodes) - 1
+
+    def _loop(self):
+        while self.rodando:
+            threads = [threading.Thread(target=self._consultar, args=(i,), daemon=True) for i in range(len(self.nodes))]
+            for t in threads: t.start()
+            for t in threads: t.join()
+            time.sleep(self.intervalo)
+
+    def _vivos(self):
+        limite = time.monotonic() - 3 * self.intervalo - TIMEOUT_CARGA
+        return [i for i, c in enumerate(self.cargas) if c is not None and self.atualizado[i] >= limite
+                and (self.nodes[i]["ip"], self.nodes[i]["porta"]) not in self.removidos]
+
+    def _coordenador(self, vivos):
+        # Nó que se declara coordenador; senão, o que a maioria aponta
+        for i in vivos:
+            if self.cargas[i].get("coordenador") == self.cargas[i].get("id"): return i
+        votos = [self.cargas[i].get("coordenador") for i in vivos]
+        if not votos: return None
+        escolhido = max(set(votos), key=votos.count)
+        return next((i for i in vivos if self.cargas[i].get("id") == escolhido), None)
+
+    def _pontuacao(self, i):
+        carga = self.cargas[i]
+        uso_pool = carga.get("pool_em_uso", 0) / max(1, carga.get("pool_max", 1))
+        return carga.get("em_voo", 0) + self.locais[i] + uso_pool
+
+    def escolher(self, leitura=True, max_atraso_s=None, ler_proprias_escritas=False):
+        """Índice do nó em 'nodes'. Sem informação de carga ainda, escolhe ao acaso."""
+        with self.lock:
+            vivos = self._vivos()
+            if not vivos:
+                restantes = [i for i, n in enumerate(self.nodes) if (n["ip"], n["porta"]) not in self.removidos]
+                return random.choice(restantes or range(len(self.nodes)))
+            coord = self._coordenador(vivos)
+            if not leitura or ler_proprias_escritas:
+                return coord if coord is not None else random.choice(vivos)
+            candidatos = [i for i in vivos if i == coord or max_atraso_s is None
+                          or (self.cargas[i].get("atraso_s") is not None and self.cargas[i]["atraso_s"] <= max_atraso_s)]
+            if not candidatos: candidatos = [coord] if coord is not None else vivos
+            menor = min(self._pontuacao(i) for i in candidatos)
+            return random.choice([i for i in candidatos if self._pontuacao(i) == menor])
+
+    @contextmanager
+    def usar(self, i):
+        """Conta a requisição como em voo no nó i enquanto ela não termina."""
+        with self.lock: self.locais[i] += 1
+        try:
+            yield self.nodes[i]
+        finally:
+            with self.lock: self.locais[i] -= 1
+
+    def parar(self):
+        self.rodando = False
+        for conn in self.conexoes: conn.fechar()
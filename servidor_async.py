@@ -0,0 +1,263 @@
+import asyncio
+import inspect
+import json
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from detector_falhas import INTERVALO_GOSSIP
+from middleware import (NodeMiddleware, TIMEOUT_PADRAO, TIPOS_ORDENADOS, TIMEOUT_ELEICAO, DURACAO_LEASE,
+                        DB_POOL_TAMANHO, CACHE_ATIVO, ANTI_ENTROPIA_ATIVA, GRUPO)
+from protocolo import ConexaoPeerAsync, receber_frame_async, enviar_frame_async, CHAVE_HMAC, FLAG_ACEITA_MSGPACK
+from logs import get_logger, span
+
+log = get_logger("node")
+
+BACKLOG_PADRAO = 1024
+MAX_CONCORRENCIA_PADRAO = 256
+MAX_WORKERS_DB = DB_POOL_TAMANHO # Mais threads que conexões só deixaria threads esperando checkout
+# Streams (leitura paginada, SYNC) esperam ACKs do receptor por até minutos: executor próprio,
+# senão leitores lentos ocupam as threads do banco e nada mais anda no nó
+MAX_WORKERS_STREAMS = 64
+# Não bloqueiam (só liberam a janela de um stream): tratados no próprio loop, sem executor
+TIPOS_NO_LOOP = {"STREAM_ACK"}
+
+class NodeMiddlewareAsync(NodeMiddleware):
+    """
+    Modo event loop do nó: accept, leitura de frames, heartbeat e eleição rodam como
+    corrotinas numa única thread. Só o que bloqueia (processar_mensagem e o MySQL por
+    trás dele) vai para um executor de tamanho fixo. A replicação usa o pipeline comum
+    (uma thread por réplica), cujos envios passam pelas conexões do loop.
+    """
+    def __init__(self, node_id, backlog=BACKLOG_PADRAO, max_concorrencia=MAX_CONCORRENCIA_PADRAO, max_workers_db=MAX_WORKERS_DB,
+                 cache=CACHE_ATIVO, endereco=None, grupo=GRUPO, max_workers_streams=MAX_WORKERS_STREAMS):
+        super().__init__(node_id, backlog, cache, endereco, grupo)
+        self.max_concorrencia = max_concorrencia
+        self.executor = ThreadPoolExecutor(max_workers=max_workers_db, thread_name_prefix=f"no{self.id}-db")
+        self.executor_streams = ThreadPoolExecutor(max_workers=max_workers_streams, thread_name_prefix=f"no{self.id}-stream")
+        self.conexoes_async = {}
+        self.loop = None
+        self.limite = None
+
+    # --------- Ponte thread <-> loop -----------
+    def _no_loop(self, coro):
+        """Agenda uma corrotina no loop a partir de uma thread do executor."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _bloqueante(self, func, *args, executor=None):
+        return await self.loop.run_in_executor(executor or self.executor, func, *args)
+
+    # --------- Rede -----------
+    def _conexao_async(self, target_id):
+        conn = self.conexoes_async.get(target_id)
+        if conn is None:
+            target = self.membros.get(target_id)
+            conn = ConexaoPeerAsync(target['ip'], target['porta'])
+            self.conexoes_async[target_id] = conn
+        return conn
+
+    async def enviar_mensagem_async(self, target_id, tipo, payload=None, esperar_resposta=False, timeout=TIMEOUT_PADRAO):
+        if target_id not in self.membros: return None
+        msg = self.criar_mensagem(tipo, payload)
+        try:
+            resposta = await self._conexao_async(target_id).requisitar(msg, timeout=timeout, esperar_resposta=esperar_resposta)
+            if resposta and resposta.get("tipo") == "SEM_RESPOSTA": return None
+            return resposta
+        except (OSError, asyncio.TimeoutError) as e:
+            log.warning("[NET ERROR] Falha ao enviar para %s: %s", target_id, e)
+            return None
+
+    def enviar_mensagem(self, target_id, tipo, payload=None, esperar_resposta=False, timeout=TIMEOUT_PADRAO):
+        # Chamado de dentro de processar_mensagem (thread do executor) e pelas threads do pipeline
+        # de replicação: usa as conexões do loop. Antes do loop subir, é como um peer fora (o pipeline tenta de novo)
+        if self.loop is None: return None
+        fut = self._no_loop(self.enviar_mensagem_async(target_id, tipo, payload, esperar_resposta, timeout))
+        return fut.result() if esperar_resposta else None
+
+    def membros_mudaram(self, adicionados, removidos):
+        super().membros_mudaram(adicionados, removidos)
+        for nid in list(adicionados) + list(removidos):
+            conn = self.conexoes_async.pop(nid, None)
+            # Os streams são do loop: fechados por ele
+            if conn and self.loop: self.loop.call_soon_threadsafe(conn.fechar)
+
+    # --------- Servidor -----------
+    async def start_server_async(self):
+        server = await asyncio.start_server(
+            self.handle_client_async, self.config['ip'], self.config['porta'],
+            backlog=self.backlog, reuse_address=True)
+        log.info("[SERVER ASYNC] Rodando em %s:%s (backlog=%s, concorrência=%s)",
+                 self.config['ip'], self.config['porta'], self.backlog, self.max_concorrencia)
+        return server
+
+    async def handle_client_async(self, reader, writer):
+        lock_envio = asyncio.Lock()
+        tarefas = set()
+        with self.lock_carga: self.conexoes_abertas += 1
+        try:
+            primeiro = await reader.read(1)
+            if not primeiro: return
+            if primeiro == b"{":
+                if CHAVE_HMAC:
+                    log.warning("[SEC] Cliente legado recusado: HMAC exigido")
+                    return
+                await self.handle_cliente_legado_async(primeiro, reader, writer)
+                return
+
+            sock = writer.get_extra_info("socket")
+            if sock is not None: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            binario = False  # Responde em msgpack assim que o peer anunciar que aceita
+            msg, flags = await receber_frame_async(reader, primeiro, com_flags=True)
+            while msg is not None and self.running:
+                binario = binario or bool(flags & FLAG_ACEITA_MSGPACK)
+                if msg.get("tipo") in TIPOS_NO_LOOP:
+                    try:
+                        self.processar_medido(msg)
+                    except Exception as err:
+                        log.warning("[SERVER ERROR] %s", err)
+                elif msg.get("tipo") in TIPOS_ORDENADOS:
+                    await self.responder_frame_async(writer, lock_envio, msg, binario)
+                else:
+                    tarefa = asyncio.ensure_future(self.responder_frame_async(writer, lock_envio, msg, binario))
+                    tarefas.add(tarefa)
+                    tarefa.add_done_callback(tarefas.discard)
+                msg, flags = await receber_frame_async(reader, com_flags=True)
+            if tarefas: await asyncio.gather(*tarefas, return_exceptions=True)
+        except (OSError, ValueError) as err:
+            log.warning("[SERVER ERROR] %s", err)
+        finally:
+            writer.close()
+            with self.lock_carga: self.conexoes_abertas -= 1
+
+    async def responder_frame_async(self, writer, lock_envio, msg, binario=False):
+        req_id = msg.get("req_id")
+        async with self.limite:
+            try:
+                with span(log, "node.msg", tipo=msg.get("tipo"), origem=msg.get("origem")):
+                    response = await self._bloqueante(self.processar_medido, msg)
+            except Exception as err:
+                log.warning("[SERVER ERROR] %s", err)
+                response = self.criar_mensagem("ERRO", {"mensagem": str(err)})
+
+        if inspect.isgenerator(response):
+            await self.responder_stream_async(writer, lock_envio, req_id, response, binario)
+            return
+
+        if req_id is None: return
+        if response is None: response = self.criar_mensagem("SEM_RESPOSTA")
+        try:
+            async with lock_envio:
+                await enviar_frame_async(writer, dict(response, req_id=req_id), binario)
+        except OSError as err:
+            log.warning("[SERVER ERROR] Falha ao responder: %s", err)
+
+    async def responder_stream_async(self, writer, lock_envio, req_id, frames, binario=False):
+        """O gerador lê do banco e espera ACKs: cada next() roda no executor de streams."""
+        try:
+            if req_id is None: return
+            while True:
+                frame = await self._bloqueante(next, frames, None, executor=self.executor_streams)
+                if frame is None: break
+                async with lock_envio:
+                    await enviar_frame_async(writer, dict(frame, req_id=req_id), binario)
+        except OSError as err:
+            log.warning("[SERVER ERROR] Stream interrompido: %s", err)
+        finally:
+            await self._bloqueante(frames.close, executor=self.executor_streams)
+
+    async def handle_cliente_legado_async(self, dados, reader, writer):
+        """JSON cru: acumula até o documento fazer parse (ou o cliente parar de mandar)."""
+        while True:
+            try:
+                msg = json.loads(dados.decode("utf-8"))
+                break
+            except ValueError:
+                try:
+                    chunk = await asyncio.wait_for(reader.read(4096), 2.0)
+                except asyncio.TimeoutError:
+                    return
+                if not chunk: return
+                dados += chunk
+
+        if not self.validar_checksum(msg):
+            log.warning("[SEC] Checksum inválido de %s", msg.get('origem'))
+            return
+        async with self.limite:
+            response = await self._bloqueante(self.processar_medido, msg)
+        if response:
+            writer.write(json.dumps(self.resposta_legado(response)).encode("utf-8"))
+            await writer.drain()
+
+    # --------- Eleição -----------
+    async def iniciar_eleicao_async(self):
+        if not self.lock_eleicao.acquire(blocking=False): return  # Já há uma em andamento
+        try:
+            log.info("[ELEIÇÃO] Iniciando (termo atual %d)...", self.termo)
+            posicao = self.wal.posicao()
+            maiores = [peer for peer in self.peers_votantes() if int(peer) > int(self.id) and not self.detector.suspeito(peer)]
+            respostas = await asyncio.gather(*(self.enviar_mensagem_async(peer, "ELEICAO", {"log": posicao}, esperar_resposta=True,
+                                                                          timeout=TIMEOUT_ELEICAO) for peer in maiores))
+            if not any(resp and resp["tipo"] == "VIVO" for resp in respostas):
+                await self.tornar_coordenador_async()
+        finally:
+            self.lock_eleicao.release()
+
+    def iniciar_eleicao(self):
+        self._no_loop(self.iniciar_eleicao_async())
+
+    async def tornar_coordenador_async(self):
+        votantes = self.peers_votantes()
+        for sondagem in (True, False):
+            pedido = self.candidatura(sondagem)
+            inicio = time.monotonic()
+            respostas = await asyncio.gather(*(self.enviar_mensagem_async(peer, "COORDENADOR", pedido, esperar_resposta=True,
+                                                                          timeout=TIMEOUT_ELEICAO) for peer in votantes))
+            if not self.apurar(pedido, respostas): return False
+        return self.assumir(pedido, inicio)
+
+    def tornar_coordenador(self):
+        self._no_loop(self.tornar_coordenador_async())
+
+    def difundir_gossip(self):
+        # Envios viram tasks: um peer que não responde não segura o monitor
+        visao = self.visao_gossip()
+        for peer in self.detector.alvos(self.peers):
+            pendente = self.gossip_pendente.get(peer)
+            if pendente and not pendente.done(): continue
+            self.gossip_pendente[peer] = asyncio.ensure_future(self.enviar_mensagem_async(peer, "GOSSIP", {"visao": visao}))
+
+    async def monitorar_coordenador_async(self):
+        log.info("[MONITOR] Ativo (gossip a cada %.2fs, lease de %.2fs).", INTERVALO_GOSSIP, DURACAO_LEASE)
+        for peer in self.peers: self.detector.reiniciar(peer)
+        while self.running:
+            await asyncio.sleep(INTERVALO_GOSSIP)
+            self.difundir_gossip()
+            self.buscar_membros()
+            # Task à parte: a votação espera respostas e o gossip não pode parar
+            if self.precisa_eleicao(): asyncio.ensure_future(self.iniciar_eleicao_async())
+
+    # --------- Ciclo de vida -----------
+    async def main_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.limite = asyncio.Semaphore(self.max_concorrencia)
+        server = await self.start_server_async()
+        self.iniciar_metricas_http()
+        async with server:
+            await asyncio.sleep(1)
+            # join_cluster é uma sequência única de requisições; roda no executor e usa a ponte
+            await self._bloqueante(self.join_cluster)
+            # Thread própria: fala com o Master pela mesma ponte de enviar_mensagem
+            if ANTI_ENTROPIA_ATIVA: self.anti_entropia.iniciar()
+            try:
+                await self.monitorar_coordenador_async()
+            finally:
+                # Ctrl+C cancela o monitor com o loop ainda de pé: o LEAVE ainda sai por ele
+                await self._bloqueante(self.sair_do_cluster)
+
+    def run(self):
+        try:
+            asyncio.run(self.main_async())
+        except KeyboardInterrupt:
+            log.info("Encerrando.")
+        finally:
+            self.executor.shutdown(wait=False)
+            self.executor_streams.shutdown(wait=False)
@@ -0,0 +1,542 @@
+import os
+import json
+import zlib
+import bisect
+from decimal import Decimal, InvalidOperation
+from concurrent.futures import ThreadPoolExecutor
+from cliente_ddb import Conexao, ErroDDB
+from membros import enderecos
+from classificador_sql import Token, classificar, insert_valores, valor_na_tupla, valor_literal as _valor, \
+    nome as _nome, palavra as _palavra
+from logs import get_logger
+
+log = get_logger("sharding")
+
+ARQUIVO_SHARDS = os.environ.get("DDB_SHARDS", "shards.json")
+GRUPO = os.environ.get("DDB_GRUPO")  # Grupo (conjunto de réplicas) deste nó
+MAX_GRUPOS_PARALELO = 16
+# Repassadas ao grupo dono junto com o comando
+OPCOES_REPASSADAS = ("consistencia", "timeout_replicacao", "max_atraso_s", "ler_proprias_escritas", "sem_cache")
+
+
+def carregar_shards(arquivo=ARQUIVO_SHARDS):
+    """
+    Configuração de sharding (opcional; sem o arquivo, o cluster é um grupo só):
+    {"grupos": {"A": {"1": {"ip", "porta"}, ...}, "B": {...}},
+     "principal": "A",
+     "tabelas": {"ddb.pedidos": {"chave": "cliente_id", "tipo": "hash", "particoes": ["A", "B"]},
+                 "ddb.eventos": {"chave": "id", "tipo": "range", "limites": [1000000], "particoes": ["A", "B"]}}}
+    Cada grupo é um cluster completo (Master, réplicas, eleição e log próprios). Cada partição
+    fica num grupo; um grupo pode ter várias partições da mesma tabela. "tipo_chave" ("numero"
+    ou "texto", opcional) é o tipo da coluna chave: o valor é convertido para ele antes do roteamento.
+    """
+    if not os.path.exists(arquivo): return None
+    with open(arquivo, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# --------- Análise do SQL (só o que o roteamento precisa) -----------
+FIM_WHERE = {"GROUP", "ORDER", "LIMIT", "HAVING", "FOR", "UNION", "LOCK"}
+AGREGACOES = {"COUNT", "SUM", "MIN", "MAX", "AVG"}
+
+
+class Comando:
+    """Estrutura de um comando SQL vista pelo roteador de shards."""
+    def __init__(self, sql):
+        self.sql = sql
+        classe = classificar(sql)
+        self.toks = list(classe.toks)
+        self.tipo = self.toks[0].texto.upper() if self.toks and self.toks[0].tipo == "palavra" else ""
+        # Lidas e escritas: [(banco ou None, tabela)]
+        self.tabelas = sorted(classe.tabelas_lidas | (classe.tabelas_escritas or frozenset()), key=str)
+
+    def _posicao(self, *palavras, desde=0, nivel=0):
+        for i in range(desde, len(self.toks)):
+            if self.toks[i].nivel == nivel and _palavra(self.toks[i], *palavras): return i
+        return None
+
+    def valores_chave(self, chave):
+        """
+        Valores de 'chave' que o WHERE fixa (chave = v, ou chave IN (...)), como [(valor, índice do parâmetro)].
+        None se o WHERE não restringe a chave (ou tem OR no nível de cima): vale para todas as partições.
+        """
+        toks = self.toks
+        inicio = self._posicao("WHERE")
+        if inicio is None: return None
+        fim = self._posicao(*FIM_WHERE, desde=inicio + 1)
+        fim = len(toks) if fim is None else fim
+        if any(toks[i].nivel == 0 and _palavra(toks[i], "OR") for i in range(inicio, fim)): return None
+        for i in range(inicio + 1, fim):
+            t = toks[i]
+            if t.nivel != 0 or t.tipo not in ("palavra", "nome") or _nome(t) != chave: continue
+            if i + 1 < fim and toks[i + 1].texto == ".": continue  # Era o nome da tabela em tabela.coluna
+            if i + 1 < fim and toks[i + 1].texto == "=" and i + 2 < fim:
+                return [_valor(toks, i + 2)]
+            if i + 2 < fim and _palavra(toks[i + 1], "IN") and toks[i + 2].texto == "(":
+                valores, j = [], i + 3
+                while j < fim and toks[j].texto != ")":
+                    if toks[j].texto != ",":
+                        valores.append(_valor(toks, j))
+                        if toks[j].texto == "-": j += 1
+                    j += 1
+                return valores
+            if i >= 2 and toks[i - 1].texto == "=" and toks[i - 2].nivel == 0 and i - 2 > inicio:
+                return [_valor(toks, i - 2)]
+        return None
+
+    def altera_coluna(self, coluna):
+        """UPDATE ... SET coluna = ...: a linha mudaria de partição."""
+        set_ = self._posicao("SET")
+        if set_ is None: return False
+        fim = self._posicao("WHERE", "ORDER", "LIMIT", desde=set_ + 1)
+        fim = len(self.toks) if fim is None else fim
+        return any(self.toks[i].nivel == 0 and self.toks[i].tipo in ("palavra", "nome") and _nome(self.toks[i]) == coluna
+                   and i + 1 < fim and self.toks[i + 1].texto == "=" for i in range(set_ + 1, fim))
+
+    def insert(self):
+        """INSERT ... (colunas) VALUES (...), (...): (colunas, [(início, fim) de cada tupla]) ou None."""
+        estrutura = insert_valores(self.toks) if self.tipo in ("INSERT", "REPLACE") else None
+        return estrutura if estrutura and estrutura[0] else None
+
+    def lista_select(self):
+        """Itens do SELECT: [(nome da coluna no resultado, agregação ou None)]."""
+        toks = self.toks
+        inicio = 1
+        if len(toks) > 1 and _palavra(toks[1], "DISTINCT"): inicio = 2
+        fim = self._posicao("FROM")
+        fim = len(toks) if fim is None else fim
+        itens, atual = [], []
+        for t in toks[inicio:fim] + [Token("simbolo", ",", 0, 0, 0)]:
+            if t.texto == "," and t.nivel == 0:
+                if atual: itens.append(atual)
+                atual = []
+            else:
+                atual.append(t)
+        resultado = []
+        for item in itens:
+            if len(item) >= 3 and _palavra(item[-2], "AS"):
+                nome, expressao = item[-1].texto.strip("`\"'"), item[:-2]
+            elif len(item) >= 2 and item[-1].tipo in ("palavra", "nome") and (item[-2].texto == ")" or item[-2].tipo in ("palavra", "nome")):
+                nome, expressao = item[-1].texto.strip("`"), item[:-1]  # Apelido sem AS
+            else:
+                expressao = item
+                simples = len(item) == 1 or (len(item) == 3 and item[1].texto == ".")
+                nome = item[-1].texto.strip("`") if simples and item[-1].tipo in ("palavra", "nome") \
+                    else self.sql[item[0].inicio:item[-1].fim]
+            funcao = None
+            if len(expressao) >= 3 and expressao[0].texto.upper() in AGREGACOES and expressao[1].texto == "(" \
+                    and expressao[-1].texto == ")" and expressao[-1].nivel == 0:
+                funcao = expressao[0].texto.upper()
+            resultado.append((nome, funcao))
+        return resultado
+
+    def ordem(self):
+        """ORDER BY do nível de cima: [(expressão, decrescente)]."""
+        toks = self.toks
+        i = self._posicao("ORDER")
+        if i is None: return []
+        fim = self._posicao("LIMIT", "FOR", "LOCK", desde=i)
+        fim = len(toks) if fim is None else fim
+        itens, atual = [], []
+        for t in toks[i + 2:fim] + [Token("simbolo", ",", 0, 0, 0)]:
+            if t.texto == "," and t.nivel == 0:
+                desc = bool(atual) and _palavra(atual[-1], "DESC")
+                if atual and _palavra(atual[-1], "ASC", "DESC"): atual = atual[:-1]
+                if atual: itens.append((self.sql[atual[0].inicio:atual[-1].fim], desc))
+                atual = []
+            else:
+                atual.append(t)
+        return itens
+
+    def limite(self):
+        """(início do LIMIT no texto, fim, offset, quantidade) ou None. Com marcadores, quantidade None."""
+        toks = self.toks
+        i = self._posicao("LIMIT")
+        if i is None or i + 1 >= len(toks): return None
+        offset, quantidade = None, toks[i + 1]
+        if i + 3 < len(toks) and toks[i + 2].texto == ",": offset, quantidade = toks[i + 1], toks[i + 3]
+        elif i + 3 < len(toks) and _palavra(toks[i + 2], "OFFSET"): offset = toks[i + 3]
+        fim = max(t.fim for t in (offset, quantidade) if t is not None)
+        if any(t is not None and t.tipo != "numero" for t in (offset, quantidade)): return toks[i].inicio, fim, 0, None
+        return toks[i].inicio, fim, int(offset.texto) if offset else 0, int(quantidade.texto)
+
+    def tem(self, *palavras):
+        return self._posicao(*palavras) is not None
+
+
+# --------- Mapa de partições -----------
+class ChaveInvalida(ValueError):
+    """Valor da chave de partição que não converte para o tipo da coluna."""
+
+
+class Particionamento:
+    def __init__(self, nome, config):
+        self.nome = nome
+        self.chave = config["chave"].lower()
+        self.tipo = config.get("tipo", "hash")
+        self.particoes = list(config["particoes"])
+        self.limites = list(config.get("limites", []))
+        if self.tipo not in ("hash", "range"): raise ValueError(f"{nome}: tipo de partição inválido: {self.tipo}")
+        if self.tipo == "range" and len(self.limites) != len(self.particoes) - 1:
+            raise ValueError(f"{nome}: range com {len(self.particoes)} partições precisa de {len(self.particoes) - 1} limites")
+        # Tipo declarado da coluna chave: "numero" ou "texto". Sem ele, o range segue o tipo dos limites
+        # e o hash trata como número o que parece número (5, '5', 5.0 e Decimal('5.00') caem juntos)
+        padrao = None
+        if self.tipo == "range": padrao = "texto" if any(isinstance(v, str) for v in self.limites) else "numero"
+        self.tipo_chave = config.get("tipo_chave", padrao)
+        if self.tipo_chave not in (None, "numero", "texto") or (self.tipo == "range" and self.tipo_chave is None):
+            raise ValueError(f"{nome}: tipo_chave inválido: {self.tipo_chave}")
+        self._chaves_limites = [self.normalizar(v) for v in self.limites]
+
+    @property
+    def esquema(self):
+        """Tabelas com o mesmo esquema têm as linhas de mesma chave no mesmo grupo (JOIN pela chave é local)."""
+        return self.tipo, tuple(self.particoes), tuple(self.limites)
+
+    def normalizar(self, valor):
+        """Valor da chave no tipo da coluna (Decimal ou str). ChaveInvalida se não converte."""
+        if self.tipo_chave == "texto" or isinstance(valor, bool):
+            return valor if isinstance(valor, str) else str(valor)
+        try:
+            numero = Decimal(str(valor).strip())
+            if numero.is_finite(): return numero
+        except InvalidOperation:
+            pass
+        if self.tipo_chave is None and isinstance(valor, str): return valor
+        raise ChaveInvalida(f"Valor {valor!r} não serve como chave {self.chave} (numérica) de {self.nome}")
+
+    def grupo(self, valor):
+        if valor is None:  # NULL: menor que qualquer valor no range; no hash, sempre a mesma partição
+            return self.particoes[0] if self.tipo == "range" else self.particoes[zlib.crc32(b"None") % len(self.particoes)]
+        chave = self.normalizar(valor)
+        if self.tipo == "range":
+            return self.particoes[bisect.bisect_right(self._chaves_limites, chave)]
+        if isinstance(chave, Decimal):
+            # Forma canônica: inteiro sem casas, senão sem zeros à direita
+            chave = str(int(chave)) if chave == chave.to_integral_value() else format(chave.normalize(), "f")
+        return self.particoes[zlib.crc32(chave.encode("utf-8")) % len(self.particoes)]
+
+    def grupos(self):
+        return list(dict.fromkeys(self.particoes))
+
+
+class MapaShards:
+    def __init__(self, config):
+        self.grupos = {nome: enderecos(nos) for nome, nos in config["grupos"].items()}
+        self.principal = config.get("principal") or next(iter(self.grupos))
+        self.tabelas = {}
+        for nome, info in config.get("tabelas", {}).items():
+            banco, _, tabela = nome.lower().rpartition(".")
+            part = Particionamento(nome, info)
+            desconhecidos = set(part.particoes) - set(self.grupos)
+            if desconhecidos: raise ValueError(f"{nome}: grupos desconhecidos {sorted(desconhecidos)}")
+            self.tabelas[(banco or None, tabela)] = part
+
+    def particionamento(self, banco, tabela):
+        return self.tabelas.get((banco and banco.lower(), tabela)) or self.tabelas.get((None, tabela))
+
+
+# --------- Roteamento e scatter-gather -----------
+def _erro(mensagem, codigo="SHARD"):
+    return {"status": "ERRO", "codigo": codigo, "mensagem": mensagem}
+
+
+def _numero(v):
+    return Decimal(v) if isinstance(v, str) else v
+
+
+def _chave_ordem(v, decimal):
+    """
+    Chave de ordenação no tipo do resultado: números comparam como números e texto como texto
+    (só coluna DECIMAL, que chega como string, vira número). NULL primeiro, como no MySQL.
+    """
+    if v is None: return 0, 0, 0
+    if decimal: v = _numero(v)
+    return (1, 0, v) if isinstance(v, (int, float, Decimal)) else (1, 1, v)
+
+
+def _combinar(funcao, a, b, decimal=False):
+    if a is None: return b
+    if b is None: return a
+    if funcao in ("COUNT", "SUM"):
+        soma = _numero(a) + _numero(b)
+        return str(soma) if isinstance(a, str) or isinstance(b, str) else soma
+    escolhido = min if funcao == "MIN" else max
+    return escolhido(a, b, key=lambda v: _chave_ordem(v, decimal))
+
+
+class CamadaShards:
+    """
+    Roteamento dos comandos em tabelas particionadas. Cada grupo é um cluster completo
+    (com Master próprio), então as escritas de partições diferentes correm em paralelo
+    em Masters diferentes. Comando de um grupo só vai para ele; leituras que cobrem
+    vários grupos são espalhadas e os resultados juntados aqui (ORDER BY, LIMIT, DISTINCT
+    e COUNT/SUM/MIN/MAX). Tabelas sem partição ficam no grupo principal.
+    'executar_local(payload)' roda o comando neste nó, sem passar de novo pelo roteamento.
+    """
+    def __init__(self, mapa, grupo, executar_local):
+        if grupo not in mapa.grupos: raise ValueError(f"Grupo {grupo!r} fora da configuração de shards")
+        self.mapa = mapa
+        self.grupo = grupo
+        self.executar_local = executar_local
+        self.conexoes = {}
+        self.envios = ThreadPoolExecutor(max_workers=min(MAX_GRUPOS_PARALELO, len(mapa.grupos)),
+                                         thread_name_prefix=f"shards-{grupo}")
+
+    def _conexao(self, grupo):
+        conn = self.conexoes.get(grupo)
+        if conn is None:
+            conn = self.conexoes.setdefault(grupo, Conexao(self.mapa.grupos[grupo]))
+        return conn
+
+    def _no_grupo(self, grupo, payload, sql, parametros, database):
+        """Resultado (payload do QUERY_RESP) do comando no grupo dono."""
+        if grupo == self.grupo:
+            pedido = {k: v for k, v in payload.items() if k not in ("stmt_id", "paginar")}
+            pedido.update(sql=sql, shard_local=True, database=database)
+            if parametros is not None: pedido["parametros"] = parametros
+            else: pedido.pop("parametros", None)
+            return self.executar_local(pedido)["payload"]
+        opcoes = {k: payload[k] for k in OPCOES_REPASSADAS if k in payload}
+        try:
+            conn = self._conexao(grupo)
+            if parametros is None: return conn.executar(sql, shard_local=True, database=database, **opcoes)
+            return conn.executar_lote(sql, parametros, shard_local=True, database=database, **opcoes)
+        except ErroDDB as e:
+            return _erro(f"Grupo {grupo}: {e}")
+
+    def _espalhar(self, grupos, payload, sql, parametros, database):
+        futuros = {g: self.envios.submit(self._no_grupo, g, payload, sql, parametros, database) for g in grupos}
+        return {g: f.result() for g, f in futuros.items()}
+
+    def _destino(self, comando, database):
+        """(particionamento ou None, erro). Todas as tabelas particionadas do comando têm de ter o mesmo esquema."""
+        parts, soltas = [], []
+        for banco, tabela in comando.tabelas:
+            part = self.mapa.particionamento(banco or database, tabela)
+            (parts.append(part) if part else soltas.append(tabela))
+        if not parts: return None, None
+        if len({p.esquema for p in parts}) > 1 or soltas:
+            return None, "Comando junta tabelas de particionamentos diferentes (ou com tabela não particionada)"
+        return parts[0], None
+
+    def grupos_do_comando(self, comando, part, parametros):
+        """Grupos que o comando toca, pelo WHERE na chave; todos se ele não restringe a chave."""
+        valores = comando.valores_chave(part.chave)
+        if valores is None or any(v == "?" for v, _ in valores): return part.grupos()
+        grupos = set()
+        for valor, indice in valores:
+            if indice is None:
+                grupos.add(part.grupo(valor))
+            else:
+                if not parametros: return part.grupos()
+                grupos.update(part.grupo(conjunto[indice]) for conjunto in parametros)
+        return sorted(grupos)
+
+    def processar(self, sql, parametros, payload, database):
+        """
+        None se o comando é deste grupo (segue o caminho normal do nó); senão o payload do
+        QUERY_RESP, já com o resultado do(s) grupo(s) dono(s).
+        """
+        comando = Comando(sql)
+        if comando.tipo in ("USE", "SET", "SHOW", "DESCRIBE", "EXPLAIN", ""): return None
+        if comando.tipo in ("CREATE", "DROP", "ALTER", "TRUNCATE", "RENAME"):
+            return self._ddl(comando, payload, sql, database)
+        part, erro = self._destino(comando, database)
+        if erro: return _erro(erro)
+        if part is None:
+            if not comando.tabelas or self.mapa.principal == self.grupo: return None
+            return self._no_grupo(self.mapa.principal, payload, sql, parametros, database)
+
+        if comando.tipo == "UPDATE" and comando.altera_coluna(part.chave):
+            return _erro(f"UPDATE da chave de partição ({part.chave}) mudaria a linha de grupo: use DELETE + INSERT")
+        try:
+            if comando.tipo in ("INSERT", "REPLACE"): return self._inserir(comando, part, payload, parametros, database)
+            grupos = self.grupos_do_comando(comando, part, parametros)
+        except ChaveInvalida as e:
+            return _erro(str(e))
+        if len(grupos) == 1:
+            if grupos[0] == self.grupo: return None
+            return self._no_grupo(grupos[0], payload, sql, parametros, database)
+        if payload.get("paginar"):
+            return _erro("Leitura paginada em vários grupos não é suportada: restrinja pela chave ou use LIMIT")
+        if comando.tipo == "SELECT": return self._ler_espalhado(comando, grupos, payload, parametros, database)
+        # UPDATE/DELETE sem a chave: cada grupo aplica a sua parte (não é atômico entre grupos)
+        return self._juntar_escritas(self._espalhar(grupos, payload, sql, parametros, database))
+
+    def grupo_da_transacao(self, comandos, database):
+        """(grupo, erro) de uma transação: todos os comandos precisam cair no mesmo grupo."""
+        grupos = set()
+        for item in comandos:
+            comando = Comando(item["sql"])
+            if comando.tipo in ("USE", "SET", ""): continue
+            part, erro = self._destino(comando, database)
+            if erro: return None, erro
+            if part is None:
+                if comando.tabelas: grupos.add(self.mapa.principal)
+                continue
+            try:
+                if comando.tipo in ("INSERT", "REPLACE"):
+                    alvo, _ = self._dividir_insert(comando, part, item.get("parametros"))
+                    if alvo is None: return None, "INSERT sem a chave de partição numa transação"
+                    grupos.update(alvo)
+                else:
+                    grupos.update(self.grupos_do_comando(comando, part, item.get("parametros")))
+            except ChaveInvalida as e:
+                return None, str(e)
+        if len(grupos) > 1: return None, f"Transação toca os grupos {sorted(grupos)}: só transações de um grupo são suportadas"
+        return (grupos.pop() if grupos else self.grupo), None
+
+    def transacao_no_grupo(self, grupo, payload, database):
+        try:
+            opcoes = {k: payload[k] for k in OPCOES_REPASSADAS if k in payload}
+            if any(len(c.get("parametros") or []) > 1 for c in payload["transacao"]):
+                return _erro("Transação repassada a outro grupo: um conjunto de parâmetros por comando")
+            comandos = [(c["sql"], c["parametros"][0]) if c.get("parametros") else c["sql"] for c in payload["transacao"]]
+            return self._conexao(grupo).transacao(comandos, payload.get("fim") or "COMMIT", shard_local=True,
+                                                   database=database, **opcoes)
+        except ErroDDB as e:
+            return _erro(f"Grupo {grupo}: {e}")
+
+    def _ddl(self, comando, payload, sql, database):
+        """CREATE/DROP DATABASE e DDL de tabela particionada vão a todos os grupos; o resto, ao principal."""
+        if not comando.tabelas and comando.tem("DATABASE", "SCHEMA"):
+            grupos = list(self.mapa.grupos)
+        else:
+            part, erro = self._destino(comando, database)
+            if erro: return _erro(erro)
+            grupos = list(self.mapa.grupos) if part else [self.mapa.principal]
+        if grupos == [self.grupo]: return None
+        return self._juntar_escritas(self._espalhar(grupos, payload, sql, None, database))
+
+    def _dividir_insert(self, comando, part, parametros):
+        """({grupo: [índices das tuplas ou dos conjuntos de parâmetros]}, modo) ou (None, erro)."""
+        estrutura = comando.insert()
+        if estrutura is None or part.chave not in estrutura[0]:
+            return None, f"INSERT em tabela particionada precisa de VALUES com a coluna {part.chave}"
+        colunas, tuplas = estrutura
+        posicao = colunas.index(part.chave)
+        divisao = {}
+        if parametros is not None:
+            if len(tuplas) != 1: return None, "INSERT com parâmetros em tabela particionada: uma tupla por comando"
+            valor, indice = self._valor_na_tupla(comando, tuplas[0], posicao)
+            for n, conjunto in enumerate(parametros):
+                divisao.setdefault(part.grupo(conjunto[indice] if indice is not None else valor), []).append(n)
+            return divisao, "parametros"
+        for n, tupla in enumerate(tuplas):
+            valor, indice = self._valor_na_tupla(comando, tupla, posicao)
+            if valor == "?" or indice is not None: return None, f"Valor de {part.chave} não é um literal"
+            divisao.setdefault(part.grupo(valor), []).append(n)
+        return divisao, "tuplas"
+
+    @staticmethod
+    def _valor_na_tupla(comando, tupla, posicao):
+        return valor_na_tupla(comando.toks, tupla, posicao)
+
+    def _inserir(self, comando, part, payload, parametros, database):
+        divisao, modo = self._dividir_insert(comando, part, parametros)
+        if divisao is None: return _erro(modo)
+        if len(divisao) == 1:
+            grupo = next(iter(divisao))
+            if grupo == self.grupo: return None
+            return self._no_grupo(grupo, payload, comando.sql, parametros, database)
+        tuplas = comando.insert()[1]
+        pedidos = {}
+        for grupo, indices in divisao.items():
+            if modo == "parametros":
+                pedidos[grupo] = (comando.sql, [parametros[n] for n in indices])
+            else:
+                toks = comando.toks
+                prefixo = comando.sql[:toks[tuplas[0][0]].inicio]
+                sufixo = comando.sql[toks[tuplas[-1][1]].fim:]
+                corpo = ", ".join(comando.sql[toks[tuplas[n][0]].inicio:toks[tuplas[n][1]].fim] for n in indices)
+                pedidos[grupo] = (prefixo + corpo + sufixo, None)
+        futuros = {g: self.envios.submit(self._no_grupo, g, payload, s, p, database) for g, (s, p) in pedidos.items()}
+        # Cada grupo confirma a sua parte (não é atômico entre grupos)
+        return self._juntar_escritas({g: f.result() for g, f in futuros.items()})
+
+    @staticmethod
+    def _juntar_escritas(resultados):
+        erros = {g: r for g, r in resultados.items() if r.get("status") == "ERRO"}
+        if erros:
+            mensagem = "; ".join(f"{g}: {r.get('mensagem')}" for g, r in sorted(erros.items()))
+            return dict(_erro(f"Falha em {len(erros)} de {len(resultados)} grupos ({mensagem})"),
+                        grupos_ok=sorted(set(resultados) - set(erros)))
+        resposta = {"status": "OK", "mensagem": "Query executada com sucesso", "grupos": sorted(resultados)}
+        if any("afetadas" in r for r in resultados.values()):
+            resposta["afetadas"] = sum(r.get("afetadas", 0) for r in resultados.values())
+        return resposta
+
+    def _ler_espalhado(self, comando, grupos, payload, parametros, database):
+        if parametros is not None and len(parametros) > 1:
+            return _erro("Leitura com vários conjuntos de parâmetros em vários grupos não é suportada")
+        itens = comando.lista_select()
+        agregado = any(funcao for _, funcao in itens)
+        if any(funcao == "AVG" for _, funcao in itens):
+            return _erro("AVG em vários grupos não é suportado: peça SUM e COUNT")
+        if comando.tem("HAVING") or comando.tem("UNION"):
+            return _erro("HAVING/UNION em vários grupos não são suportados")
+        limite = comando.limite()
+        if limite and limite[3] is None: return _erro("LIMIT com parâmetros em vários grupos não é suportado")
+        sql = comando.sql
+        if limite:
+            # Cada grupo devolve o bastante para o resultado final; com agregação, tudo (o LIMIT é depois)
+            inicio, fim, offset, quantidade = limite
+            trecho = "" if agregado else f"LIMIT {offset + quantidade}"
+            sql = sql[:inicio] + trecho + sql[fim:]
+        resultados = self._espalhar(grupos, payload, sql, parametros, database)
+        erros = [f"{g}: {r.get('mensagem')}" for g, r in sorted(resultados.items()) if r.get("status") != "OK"]
+        if erros: return _erro("Leitura falhou em " + "; ".join(erros))
+        linhas = [linha for g in sorted(resultados) for linha in resultados[g].get("dados", [])]
+        decimais = {c for r in resultados.values() for c in r.get("decimais", [])}
+
+        if agregado:
+            linhas = self._agregar(linhas, itens, decimais)
+        elif comando.tem("DISTINCT") or comando.tem("GROUP"):
+            vistas, unicas = set(), []
+            for linha in linhas:
+                chave = tuple(map(repr, linha.values()))
+                if chave not in vistas:
+                    vistas.add(chave)
+                    unicas.append(linha)
+            linhas = unicas
+        erro = self._ordenar(linhas, comando.ordem(), itens, decimais)
+        if erro: return _erro(erro)
+        if limite: linhas = linhas[limite[2]:limite[2] + limite[3]]
+        resposta = {"status": "OK", "dados": linhas, "grupos": sorted(resultados)}
+        if decimais: resposta["decimais"] = sorted(decimais)
+        return resposta
+
+    @staticmethod
+    def _agregar(linhas, itens, decimais):
+        """Junta as linhas parciais de cada grupo: agrupa pelas colunas sem agregação e combina as outras."""
+        funcoes = {nome: funcao for nome, funcao in itens if funcao}
+        grupos = {}
+        for linha in linhas:
+            chave = tuple(repr(v) for k, v in linha.items() if k not in funcoes)
+            atual = grupos.get(chave)
+            if atual is None:
+                grupos[chave] = dict(linha)
+                continue
+            for nome, funcao in funcoes.items():
+                if nome in linha: atual[nome] = _combinar(funcao, atual.get(nome), linha[nome], nome in decimais)
+        return list(grupos.values())
+
+    @staticmethod
+    def _ordenar(linhas, ordem, itens, decimais):
+        nomes = [nome for nome, _ in itens]
+        # Da última chave para a primeira: sort estável dá a ordem composta
+        if not linhas: return None
+        for expressao, desc in reversed(ordem):
+            coluna = expressao.strip("`")
+            if coluna.isdigit() and 0 < int(coluna) <= len(nomes): coluna = nomes[int(coluna) - 1]
+            if coluna not in linhas[0]: coluna = coluna.rpartition(".")[2].strip("`")
+            if coluna not in linhas[0]:
+                return f"ORDER BY {expressao} em vários grupos: a coluna precisa estar no SELECT"
+            decimal = coluna in decimais
+            linhas.sort(key=lambda l: _chave_ordem(l[coluna], decimal), reverse=desc)
+        return None
+
+    def fechar(self):
+        for conn in self.conexoes.values(): conn.fechar()
+        self.envios.shutdown(wait=False)